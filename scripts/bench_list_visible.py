@@ -0,0 +1,141 @@
+import argparse
+import json
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+from src.env.visibility import TARGET_FIELDS, ObjectIndex
+
+# A kitchen-like type mix for the synthetic fallback.
+_TYPES = [
+    "Apple", "Bowl", "Bread", "Cabinet", "Chair", "CoffeeMachine", "CounterTop", "Cup", "DishSponge", "Drawer",
+    "Egg", "Faucet", "Floor", "Fork", "Fridge", "GarbageCan", "Knife", "Lettuce", "LightSwitch", "Microwave",
+    "Mug", "Pan", "PepperShaker", "Plate", "Pot", "Potato", "SaltShaker", "Shelf", "Sink", "Spatula", "Spoon",
+    "StoveBurner", "StoveKnob", "Toaster", "Tomato", "Window",
+]
+
+
+def legacy_list_visible(metadata: Dict[str, Any], target: str) -> Dict[str, Any]:
+    """The linear scan `ThorObjectNavEnv.list_visible` used before the index."""
+    objects = metadata.get("objects", [])
+    visible = [o for o in objects if o.get("visible")]
+    target_visible = False
+    target_bbox = None
+    target_distance = None
+    for obj in visible:
+        if obj.get("objectType", "").lower() == target.lower():
+            target_visible = True
+            target_bbox = obj.get("boundingBox")
+            target_distance = obj.get("distance")
+            break
+    return {
+        "visible": visible,
+        "target_visible": target_visible,
+        "target_bbox": target_bbox,
+        "target_distance": target_distance,
+    }
+
+
+def synthetic_metadata(steps: int, num_objects: int, seed: int) -> List[Dict[str, Any]]:
+    """One scene's object list; every step re-rolls visibility and distance like a walking agent."""
+    rng = random.Random(seed)
+    layout = [(f"{t}|{i}", t) for i, t in enumerate(rng.choice(_TYPES) for _ in range(num_objects))]
+    events = []
+    for _ in range(steps):
+        objects = []
+        for object_id, object_type in layout:
+            objects.append({
+                "objectId": object_id,
+                "objectType": object_type,
+                "visible": rng.random() < 0.2,
+                "distance": round(rng.uniform(0.2, 6.0), 3),
+                "boundingBox": None,
+                "position": {"x": rng.random(), "y": 0.9, "z": rng.random()},
+            })
+        events.append({"objects": objects})
+    return events
+
+
+def load_metadata(path: str) -> List[Dict[str, Any]]:
+    """Event metadata recorded as JSONL (one per line) or a JSON list."""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        payload = json.load(f)
+    return payload if isinstance(payload, list) else [payload]
+
+
+def record_metadata(scene: str, steps: int, out_path: str, seed: int) -> None:
+    """Random navigation in a live scene (needs ai2thor), one metadata dict per line."""
+    from src.env.thor_objectnav_env import ThorObjectNavEnv
+
+    rng = random.Random(seed)
+    env = ThorObjectNavEnv(scene=scene)
+    try:
+        event = env.reset(scene)
+        with open(out_path, "w", encoding="utf-8") as f:
+            for _ in range(steps):
+                f.write(json.dumps(event.metadata) + "\n")
+                event = env.step({"action": rng.choice(["MoveAhead", "RotateLeft", "RotateRight"])})
+    finally:
+        env.close()
+
+
+def _bench(fn, events: List[Dict], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for metadata in events:
+            fn(metadata)
+        best = min(best, time.perf_counter() - start)
+    return best / len(events) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Per-call cost of list_visible: linear scan vs type index.")
+    parser.add_argument("--metadata", default="", help="recorded metadata (.jsonl/.json); synthetic if empty")
+    parser.add_argument("--record", default="", metavar="SCENE", help="record --steps events in SCENE first")
+    parser.add_argument("--target", default="Mug")
+    parser.add_argument("--steps", type=int, default=500)
+    parser.add_argument("--objects", type=int, default=110, help="objects per synthetic event")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.record:
+        args.metadata = args.metadata or f"metadata_{args.record}.jsonl"
+        record_metadata(args.record, args.steps, args.metadata, args.seed)
+    events = load_metadata(args.metadata) if args.metadata else synthetic_metadata(args.steps, args.objects, args.seed)
+
+    # Same reuse rule as ThorObjectNavEnv.list_visible.
+    state: Dict[str, Optional[ObjectIndex]] = {"index": None}
+
+    def indexed(metadata: Dict[str, Any], fields=TARGET_FIELDS) -> Dict[str, Any]:
+        objects = metadata.get("objects", [])
+        index = state["index"]
+        if index is None or not index.fits(objects):
+            index = state["index"] = ObjectIndex(objects)
+        return index.lookup(objects, args.target, fields)
+
+    for metadata in events:
+        expected = legacy_list_visible(metadata, args.target)
+        got = indexed(metadata, TARGET_FIELDS + ("visible",))
+        assert got == expected, "index lookup disagrees with the linear scan"
+
+    rows = [
+        ("legacy scan", _bench(lambda m: legacy_list_visible(m, args.target), events, args.repeat)),
+        ("index, target fields", _bench(indexed, events, args.repeat)),
+        ("index, + visible list", _bench(lambda m: indexed(m, TARGET_FIELDS + ("visible",)), events, args.repeat)),
+    ]
+    state["index"] = None
+    rows.append(("index rebuilt per event", _bench(lambda m: ObjectIndex(m["objects"]).lookup(
+        m["objects"], args.target), events, args.repeat)))
+    base = rows[0][1]
+    print(f"{len(events)} events, {len(events[0].get('objects', []))} objects, target {args.target}")
+    print(f"{'variant':<26} {'us/call':>8} {'speedup':>8}")
+    for name, us in rows:
+        print(f"{name:<26} {us:>8.2f} {base / us:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
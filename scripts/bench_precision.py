@@ -0,0 +1,107 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import resource
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+import yaml
+
+from src.agent.action_space import ACTIONS
+from src.vlm.parsing import parse_action_line
+
+
+def _rss_mb() -> float:
+    # ru_maxrss is KiB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _load_inputs(run_dir: str, template: str, limit: int) -> List[Tuple[np.ndarray, str]]:
+    """Saved frames of a previous run with planner prompts rebuilt from steps.jsonl."""
+    if not run_dir:
+        rng = np.random.default_rng(0)
+        prompt = template.format(target="mug", action_space=ACTIONS, trajectory="(none)", rag_snippets="(none)")
+        return [(rng.integers(0, 255, size=(300, 300, 3), dtype=np.uint8), prompt) for _ in range(limit)]
+    from PIL import Image
+
+    targets = {}
+    with open(os.path.join(run_dir, "steps.jsonl"), "r", encoding="utf-8") as f:
+        for line in f:
+            step = json.loads(line)
+            targets[(step["episode_id"], step["step_idx"])] = step["target_prompt"]
+    inputs = []
+    for path in sorted(glob.glob(os.path.join(run_dir, "frames", "episode_*", "step_*.png")))[:limit]:
+        episode_id = int(os.path.basename(os.path.dirname(path)).split("_")[1])
+        step_idx = int(os.path.basename(path)[5:10])
+        target = targets.get((episode_id, step_idx), "mug")
+        prompt = template.format(target=target, action_space=ACTIONS, trajectory="(none)", rag_snippets="(none)")
+        inputs.append((np.asarray(Image.open(path).convert("RGB")), prompt))
+    return inputs
+
+
+def _bench_mode(job: Tuple[str, str, str, int, str, str, int]) -> Dict:
+    model_path, device, precision, num_threads, run_dir, prompt_path, steps = job
+    from src.vlm.qwen_vl_hf import QwenVLHF
+
+    with open(prompt_path, "r", encoding="utf-8") as f:
+        planner = yaml.safe_load(f)["planner"]
+    inputs = _load_inputs(run_dir, planner["template"], steps)
+    rss_before = _rss_mb()
+    start = time.perf_counter()
+    model = QwenVLHF(model_path, device, precision=precision, num_threads=num_threads)
+    load_s = time.perf_counter() - start
+    rss_loaded = _rss_mb()
+    actions, latencies = [], []
+    for frame, prompt in inputs:
+        start = time.perf_counter()
+        raw = model.generate(frame, prompt, max_new_tokens=32)
+        latencies.append(time.perf_counter() - start)
+        actions.append(parse_action_line(raw))
+    return {
+        "precision": precision,
+        "load_s": round(load_s, 2),
+        "rss_model_mb": round(rss_loaded - rss_before, 1),
+        "rss_peak_mb": round(_rss_mb(), 1),
+        "step_s_mean": round(float(np.mean(latencies)), 3) if latencies else None,
+        "step_s_p90": round(float(np.percentile(latencies, 90)), 3) if latencies else None,
+        "parsed_rate": round(sum(a in ACTIONS for a in actions) / max(1, len(actions)), 3),
+        "actions": actions,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Load time, RSS, step latency and parsed-action agreement per precision mode."
+    )
+    parser.add_argument("--model-path", required=True, help="small local checkpoint")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--modes", default="fp32,bf16,int8", help="first mode is the accuracy reference")
+    parser.add_argument("--num-threads", type=int, default=0)
+    parser.add_argument("--run-dir", default="", help="previous run with saved frames; random frames if empty")
+    parser.add_argument("--prompt", default="configs/prompt.yaml")
+    parser.add_argument("--steps", type=int, default=20)
+    args = parser.parse_args()
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    # One fresh process per mode so RSS and load time are not shared between modes.
+    ctx = multiprocessing.get_context("spawn")
+    rows = []
+    for mode in modes:
+        job = (args.model_path, args.device, mode, args.num_threads, args.run_dir, args.prompt, args.steps)
+        with ctx.Pool(processes=1) as pool:
+            rows.append(pool.apply(_bench_mode, (job,)))
+    reference = rows[0]["actions"]
+    print(f"{'mode':<6} {'load_s':>7} {'rss_mb':>8} {'step_s':>7} {'p90_s':>7} {'parsed':>7} {'agree':>6}")
+    for row in rows:
+        agree = sum(a == b for a, b in zip(row["actions"], reference)) / max(1, len(reference))
+        print(
+            f"{row['precision']:<6} {row['load_s']:>7} {row['rss_model_mb']:>8} {row['step_s_mean']:>7} "
+            f"{row['step_s_p90']:>7} {row['parsed_rate']:>7} {agree:>6.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import yaml
+
+from src.vlm.qwen_vl_hf import QwenVLHF
+
+
+def _time_to_first_token(model: QwenVLHF, frames, prompt: str, prefix: str) -> float:
+    start = time.perf_counter()
+    for frame in frames:
+        model.generate(frame, prompt, max_new_tokens=1, prefix=prefix)
+    return (time.perf_counter() - start) / len(frames)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Planner time-to-first-token with and without the prefix KV cache.")
+    parser.add_argument("--config", default="configs/run.yaml")
+    parser.add_argument("--steps", type=int, default=10)
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        cfg = yaml.safe_load(f)
+    with open(os.path.join(os.path.dirname(args.config), "prompt.yaml"), "r", encoding="utf-8") as f:
+        planner = yaml.safe_load(f)["planner"]
+    prompt = planner["prefix_template"].format(
+        target="mug", action_space=[], trajectory="MoveAhead, RotateLeft", rag_snippets="(none)"
+    )
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 255, size=(300, 300, 3), dtype=np.uint8) for _ in range(args.steps)]
+
+    model = QwenVLHF(cfg["model"]["local_path"], cfg["model"]["device"])
+    model.generate(frames[0], prompt, max_new_tokens=1, prefix=planner["prefix"])  # warm-up
+    baseline = _time_to_first_token(model, frames, prompt, planner["prefix"])
+    model.prefix_cache_size = 1
+    model.generate(frames[0], prompt, max_new_tokens=1, prefix=planner["prefix"])  # fills the cache
+    cached = _time_to_first_token(model, frames, prompt, planner["prefix"])
+    print(f"ttft no cache: {baseline * 1000:.1f} ms/step")
+    print(f"ttft cached:   {cached * 1000:.1f} ms/step ({baseline / cached:.2f}x)")
+    print(f"prefix cache:  {model.prefix_cache_stats}")
+
+
+if __name__ == "__main__":
+    main()
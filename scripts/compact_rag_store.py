@@ -0,0 +1,16 @@
+import argparse
+
+from src.rag.store import compact_file
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Dedupe and rewrite a rag_store.jsonl in place.")
+    parser.add_argument("paths", nargs="+")
+    args = parser.parse_args()
+    for path in args.paths:
+        stats = compact_file(path)
+        print(f"{path}: {stats['lines_before']} lines -> {stats['entries_after']} entries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import argparse
+import os
+import sys
+
+from src.utils.archive import ArchiveReader, iter_archives
+
+
+def _archives(path: str):
+    return [path] if path.endswith(".rec") else list(iter_archives(path))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Inspect or unpack debug/episode_XXX.rec archives.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    ls = sub.add_parser("ls", help="list record names")
+    ls.add_argument("path", help="a .rec file or a run directory")
+    ls.add_argument("--prefix", default="")
+    cat = sub.add_parser("cat", help="write one record to stdout")
+    cat.add_argument("archive")
+    cat.add_argument("name")
+    extract = sub.add_parser("extract", help="restore the per-file layout (frames/, debug/...)")
+    extract.add_argument("path", help="a .rec file or a run directory")
+    extract.add_argument("--out", default=None, help="defaults to the run directory")
+    extract.add_argument("--prefix", default="")
+    args = parser.parse_args()
+
+    if args.cmd == "cat":
+        reader = ArchiveReader(args.archive)
+        sys.stdout.buffer.write(reader.read(args.name))
+        reader.close()
+        return
+    for path in _archives(args.path):
+        reader = ArchiveReader(path)
+        if args.cmd == "ls":
+            for name in reader.names(args.prefix):
+                print(f"{path}\t{name}\t{reader.entries[name]['length']}")
+        else:
+            # <run>/debug/episode_XXX.rec -> <run>
+            out = args.out or os.path.dirname(os.path.dirname(os.path.abspath(path)))
+            print(f"{path}: {reader.extract(out, args.prefix)} files -> {out}")
+        reader.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+import argparse
+
+from src.rag.segment import jsonl_to_segment, segment_to_jsonl
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Convert between rag_store.jsonl and binary .ragseg.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    pack = sub.add_parser("pack", help="jsonl -> segment")
+    pack.add_argument("jsonl")
+    pack.add_argument("segment")
+    unpack = sub.add_parser("unpack", help="segment -> jsonl")
+    unpack.add_argument("segment")
+    unpack.add_argument("jsonl")
+    args = parser.parse_args()
+    if args.cmd == "pack":
+        count = jsonl_to_segment(args.jsonl, args.segment)
+    else:
+        count = segment_to_jsonl(args.segment, args.jsonl)
+    print(f"{args.cmd}: {count} entries")
+
+
+if __name__ == "__main__":
+    main()
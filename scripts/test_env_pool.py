@@ -0,0 +1,63 @@
+import copy
+import tempfile
+
+from scripts.test_vector_runner import CFG, TEMPLATE, FakeEnv, FakeModel, _specs, _strip_timings
+from src.agent.vector_runner import run_vectorized
+from src.env.pool import EnvPool, order_by_scene
+from src.rag.namespaces import RagNamespaces
+from src.utils.episodes import build_episode_spec
+
+
+class SceneEnv(FakeEnv):
+    """Counts scene loads the way ThorObjectNavEnv does with reuse_scene on."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.loaded_scene = None
+        self.reset_stats = {"cold": 0, "warm": 0, "cold_s": 0.0, "warm_s": 0.0}
+
+    def reset(self, scene=None, start_pose=None):
+        scene = scene or self.scene
+        if scene == self.loaded_scene:
+            self.reset_stats["warm"] += 1
+            self.reset_stats["warm_s"] += 0.1
+        else:
+            self.reset_stats["cold"] += 1
+            self.reset_stats["cold_s"] += 2.0
+        self.loaded_scene = scene
+        return super().reset(scene, start_pose)
+
+
+def test_order_by_scene_is_stable() -> None:
+    specs = _specs(6)
+    ordered = order_by_scene(specs)
+    assert [s["episode_id"] for s in ordered] == [0, 2, 4, 1, 3, 5]
+    assert sorted(ordered, key=lambda s: s["episode_id"]) == specs
+
+
+def test_scene_affinity_keeps_results_and_saves_loads() -> None:
+    cfg = copy.deepcopy(CFG)
+    cfg["run"]["scenes"] = ["FloorPlan1", "FloorPlan2", "FloorPlan3"]
+    specs = [build_episode_spec(cfg, None, idx) for idx in range(9)]
+    with tempfile.TemporaryDirectory() as tmp:
+        outcomes = {}
+        for affinity in (False, True):
+            pool = EnvPool([SceneEnv() for _ in range(2)], scene_affinity=affinity)
+            run_specs = order_by_scene(specs) if affinity else specs
+            results, _ = run_vectorized(
+                copy.deepcopy(CFG), pool, FakeModel(), TEMPLATE, RagNamespaces(f"{tmp}/{affinity}", CFG["rag"]),
+                f"{tmp}/{affinity}", run_specs,
+            )
+            outcomes[affinity] = ({r["summary"]["episode_id"]: _strip_timings(r) for r in results}, pool.stats())
+        assert outcomes[True][0] == outcomes[False][0]
+        plain, grouped = outcomes[False][1], outcomes[True][1]
+        assert grouped["scene_switches"] < plain["scene_switches"]
+        assert grouped["scene_switches"] + grouped["warm_resets"] == len(specs)
+        warm = grouped["warm_resets"]
+        assert grouped["time_saved_s"] == round(warm * 2.0 - warm * 0.1, 3)
+
+
+if __name__ == "__main__":
+    test_order_by_scene_is_stable()
+    test_scene_affinity_keeps_results_and_saves_loads()
+    print("env pool tests passed")
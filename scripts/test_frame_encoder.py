@@ -0,0 +1,105 @@
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+
+from src.utils.frame_encoder import FrameEncoder  # noqa: E402
+
+
+def _frame(seed):
+    return np.random.default_rng(seed).integers(0, 255, size=(8, 12, 3), dtype=np.uint8)
+
+
+def _read_rgb(path):
+    return cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB)
+
+
+def test_writes_png_and_scaled_jpg_frames():
+    with tempfile.TemporaryDirectory() as tmp:
+        frames = [_frame(k) for k in range(3)]
+        png = FrameEncoder(frames_dir=f"{tmp}/png")
+        jpg = FrameEncoder(frames_dir=f"{tmp}/jpg", image_format="jpg", jpeg_quality=80, scale=0.5)
+        for step_idx, frame in enumerate(frames):
+            assert png.submit(step_idx, frame, save_image=True)
+            jpg.submit(step_idx, frame, save_image=step_idx != 1)
+        png_stats, jpg_stats = png.close(), jpg.close()
+
+        assert sorted(os.listdir(f"{tmp}/png")) == ["step_00000.png", "step_00001.png", "step_00002.png"]
+        for step_idx, frame in enumerate(frames):
+            assert np.array_equal(_read_rgb(f"{tmp}/png/step_{step_idx:05d}.png"), frame)
+        assert sorted(os.listdir(f"{tmp}/jpg")) == ["step_00000.jpg", "step_00002.jpg"]
+        assert _read_rgb(f"{tmp}/jpg/step_00000.jpg").shape == (4, 6, 3)
+        assert png_stats["submitted"] == png_stats["images"] == 3
+        assert jpg_stats["submitted"] == 3 and jpg_stats["images"] == 2
+        assert png_stats["dropped"] == png_stats["unchanged"] == 0 and png_stats["encode_s"] > 0
+    with pytest.raises(ValueError):
+        FrameEncoder(image_format="bmp")
+
+
+def test_unchanged_frames_are_skipped_only_when_enabled():
+    frame = _frame(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        default = FrameEncoder(frames_dir=f"{tmp}/default")
+        skipping = FrameEncoder(frames_dir=f"{tmp}/skip", skip_unchanged=True)
+        for encoder in (default, skipping):
+            encoder.submit(0, frame, save_image=True)
+            encoder.submit(1, frame.copy(), save_image=True, collided=True)
+            # Without a collision an identical view is still written.
+            encoder.submit(2, frame.copy(), save_image=True)
+        default_stats, skip_stats = default.close(), skipping.close()
+
+        assert default_stats["images"] == 3 and default_stats["unchanged"] == 0
+        assert not os.path.exists(f"{tmp}/default/unchanged.jsonl")
+        assert skip_stats["images"] == 2 and skip_stats["unchanged"] == 1
+        assert sorted(os.listdir(f"{tmp}/skip")) == ["step_00000.png", "step_00002.png", "unchanged.jsonl"]
+        with open(f"{tmp}/skip/unchanged.jsonl", encoding="utf-8") as f:
+            assert [json.loads(line) for line in f] == [{"step_idx": 1, "same_as": 0}]
+
+
+def test_full_queue_drops_frames_and_counts_them():
+    with tempfile.TemporaryDirectory() as tmp:
+        encoder = FrameEncoder(frames_dir=tmp, maxsize=1, drop_when_full=True)
+        started, release = threading.Event(), threading.Event()
+        encode = encoder._encode
+
+        def slow_encode(*args):
+            started.set()
+            release.wait(5)
+            encode(*args)
+
+        encoder._encode = slow_encode
+        assert encoder.submit(0, _frame(0), save_image=True)
+        assert started.wait(5)
+        # The encoder thread holds step 0; step 1 fills the queue and step 2 is dropped.
+        assert encoder.submit(1, _frame(1), save_image=True)
+        assert not encoder.submit(2, _frame(2), save_image=True)
+        assert encoder.backlog == 1
+        release.set()
+        stats = encoder.close()
+        assert stats["submitted"] == 3 and stats["dropped"] == 1 and stats["images"] == 2
+        assert stats["max_backlog"] == 1
+        assert sorted(os.listdir(tmp)) == ["step_00000.png", "step_00001.png"]
+
+
+def test_encode_error_surfaces_on_submit_and_close():
+    with tempfile.TemporaryDirectory() as tmp:
+        encoder = FrameEncoder(frames_dir=tmp)
+        encoder.submit(0, np.zeros((8, 12, 5), dtype=np.uint8), save_image=True)  # not an RGB frame
+        with pytest.raises(RuntimeError) as failed:
+            encoder.close()
+        assert isinstance(failed.value.__cause__, cv2.error)
+        with pytest.raises(RuntimeError):
+            encoder.submit(1, _frame(1), save_image=True)
+
+
+if __name__ == "__main__":
+    test_writes_png_and_scaled_jpg_frames()
+    test_unchanged_frames_are_skipped_only_when_enabled()
+    test_full_queue_drops_frames_and_counts_them()
+    test_encode_error_surfaces_on_submit_and_close()
+    print("ok")
@@ -0,0 +1,76 @@
+import tempfile
+
+import numpy as np
+
+from src.main import compute_metrics
+from src.metrics.fold import MetricsFold
+from src.metrics.hallucinations import annotate_steps_for_eval, count_hallucinations
+from src.metrics.nav_metrics import summarize
+from src.utils.step_store import ColumnarStepWriter, load_columns
+
+
+def _steps(episode_id, n):
+    steps = []
+    for i in range(n):
+        steps.append({
+            "episode_id": episode_id,
+            "step_idx": i,
+            "scene": "FloorPlan1",
+            "target_object_type": "Mug",
+            "action": ["MoveAhead", "RotateLeft", "Stop"][i % 3],
+            "collision": i % 4 == 1,
+            "vlm_output": {"action": "MoveAhead", "source": "planner"},
+            "target_seen_claim": [None, True, False][i % 3],
+            "rag_hit_ids": list(range(i % 3)),
+            "env_meta_for_eval_only": {"target_visible": i % 2 == 0, "target_distance": None if i % 5 else 1.5,
+                                       "target_bbox": None, "frame_width": 300},
+            "loop_break_triggered": False,
+            "planner_input_token_estimate": 100 + i,
+            "timings": {"plan_vlm": 0.5, "env_step": 0.25},
+        })
+    annotate_steps_for_eval(steps)
+    return steps
+
+
+def test_fold_matches_batch_metrics() -> None:
+    summaries = []
+    for ep in range(7):
+        steps = _steps(ep, 5 + ep)
+        summaries.append({"episode_id": ep, "success": ep % 3 == 0, "steps": len(steps), "start_distance": 0.3 * ep,
+                          "overconfident_stop": ep % 2, "hallucinations": count_hallucinations(steps)})
+    fold = MetricsFold()
+    for summary in summaries:
+        fold.add(summary)
+    assert fold.nav() == summarize(summaries)
+    metrics = compute_metrics(iter(summaries), {"extra": 1})
+    assert metrics["nav"] == summarize(summaries)
+    expected_ph = sum(1 for ep in range(7) for s in _steps(ep, 5 + ep) if s["hallucinations"]["PH_Existence"])
+    assert metrics["hallucinations"]["PH_Existence"] == expected_ph
+    assert metrics["hallucinations"]["overconfident_stop"] == 3
+    assert metrics["extra"] == 1
+    assert compute_metrics([])["nav"] == summarize([])
+
+
+def test_columnar_store_round_trip() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ColumnarStepWriter(tmp, chunk_rows=4)
+        all_steps = []
+        for ep in range(3):
+            steps = _steps(ep, 5)
+            all_steps.extend(steps)
+            store.add(steps)
+        assert store.close() == {"rows": 15, "chunks": 4}
+        cols = load_columns(tmp, ["episode_id", "action", "target_distance", "PH_Existence", "target_seen_claim"])
+        assert set(cols) == {"episode_id", "action", "target_distance", "PH_Existence", "target_seen_claim"}
+        assert cols["episode_id"].tolist() == [s["episode_id"] for s in all_steps]
+        assert cols["action"].tolist() == [s["action"] for s in all_steps]
+        assert np.isnan(cols["target_distance"][1]) and cols["target_distance"][0] == np.float32(1.5)
+        assert cols["PH_Existence"].sum() == sum(s["hallucinations"]["PH_Existence"] for s in all_steps)
+        assert cols["target_seen_claim"].tolist()[:3] == [-1, 1, 0]
+        assert load_columns(f"{tmp}/missing", ["rag_hits"])["rag_hits"].shape == (0,)
+
+
+if __name__ == "__main__":
+    test_fold_matches_batch_metrics()
+    test_columnar_store_round_trip()
+    print("metrics tests passed")
@@ -0,0 +1,71 @@
+from src.env.poses import reset_controller, teleport_args
+from src.utils.episodes import extract_start_pose
+
+
+class FakeController:
+    """Tracks the camera pitch across resets, teleports and Look actions like ai2thor does."""
+
+    def __init__(self) -> None:
+        self.horizon = 0.0
+        self.actions = []
+
+    def reset(self, scene):
+        self.actions.append(("reset", scene))
+        self.horizon = 0.0
+        return "event"
+
+    def step(self, action, **kwargs):
+        self.actions.append((action, kwargs))
+        if action == "LookDown":
+            self.horizon += 30.0
+        elif action == "TeleportFull" and "horizon" in kwargs:
+            self.horizon = kwargs["horizon"]
+        return "event"
+
+
+EPISODE = {"agentPose": {"position": {"x": 1.0, "y": 0.9, "z": 2.0}, "rotation": 90, "horizon": 0}}
+
+
+def test_extract_start_pose_keeps_zero_horizon():
+    assert extract_start_pose(EPISODE)["horizon"] == 0
+    assert extract_start_pose({"agentPose": {"position": {}, "rotation": 0, "isStanding": False}})["standing"] is False
+
+
+def test_none_fields_do_not_override_defaults():
+    args = teleport_args({"position": {"x": 0}, "rotation": {"y": 0}, "horizon": None}, {"horizon": 0.0, "standing": True})
+    assert args["horizon"] == 0.0 and args["standing"] is True
+    assert "horizon" not in teleport_args({"position": {"x": 0}, "horizon": None})
+
+
+def test_warm_reset_levels_camera_after_tilted_episode():
+    controller = FakeController()
+    start_pose = extract_start_pose(EPISODE)
+    _, warm = reset_controller(controller, "FloorPlan1", start_pose, reuse_scene=True)
+    assert not warm
+    controller.step("LookDown")
+    controller.step("LookDown")
+    assert controller.horizon == 60.0
+
+    for pose in (start_pose, dict(start_pose, horizon=None)):
+        controller.step("LookDown")
+        _, warm = reset_controller(controller, "FloorPlan1", pose, "FloorPlan1", reuse_scene=True)
+        assert warm
+        assert controller.actions[-1][0] == "TeleportFull"
+        assert controller.horizon == 0.0
+
+
+def test_other_scene_or_reuse_off_loads_the_scene():
+    controller = FakeController()
+    pose = extract_start_pose(EPISODE)
+    _, warm = reset_controller(controller, "FloorPlan2", pose, "FloorPlan1", reuse_scene=True)
+    assert not warm and ("reset", "FloorPlan2") in controller.actions
+    _, warm = reset_controller(controller, "FloorPlan2", pose, "FloorPlan2", reuse_scene=False)
+    assert not warm
+
+
+if __name__ == "__main__":
+    test_extract_start_pose_keeps_zero_horizon()
+    test_none_fields_do_not_override_defaults()
+    test_warm_reset_levels_camera_after_tilted_episode()
+    test_other_scene_or_reuse_off_loads_the_scene()
+    print("ok")
@@ -0,0 +1,451 @@
+import re
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from src.vlm import qwen_vl_hf  # noqa: E402
+from src.vlm.qwen_vl_hf import ACTION_PREFIX, QwenVLHF  # noqa: E402
+
+SPECIALS = ["<|pad|>", "<|im_start|>", "<|im_end|>", "<|vision_start|>", "<|vision_end|>", "<|image_pad|>"]
+_SPECIAL_RE = re.compile("(" + "|".join(map(re.escape, SPECIALS)) + ")")
+VOCAB = 128 + len(SPECIALS)
+IMAGE_PAD = 128 + SPECIALS.index("<|image_pad|>")
+IM_END = 128 + SPECIALS.index("<|im_end|>")
+ACTIONS = ["MoveAhead", "RotateLeft", "Stop"]
+
+
+class FakeTokenizer:
+    """ASCII characters are tokens 0-127; each special token is one id after them."""
+
+    padding_side = "right"
+    pad_token_id = 128
+
+    def encode(self, text):
+        ids = []
+        for part in _SPECIAL_RE.split(text):
+            if part in SPECIALS:
+                ids.append(128 + SPECIALS.index(part))
+            else:
+                ids.extend(ord(c) % 128 for c in part)
+        return ids
+
+    def __call__(self, text, padding=False, add_special_tokens=True, return_tensors=None):
+        rows = [self.encode(t) for t in ([text] if isinstance(text, str) else text)]
+        if return_tensors is None:
+            return {"input_ids": rows[0] if isinstance(text, str) else rows}
+        width = max(len(r) for r in rows)
+        if not padding and any(len(r) != width for r in rows):
+            raise ValueError("rows of different lengths need padding")
+        ids, mask = [], []
+        for r in rows:
+            fill = [self.pad_token_id] * (width - len(r))
+            ids.append(fill + r if self.padding_side == "left" else r + fill)
+            ones, zeros = [1] * len(r), [0] * len(fill)
+            mask.append(zeros + ones if self.padding_side == "left" else ones + zeros)
+        return {"input_ids": torch.tensor(ids), "attention_mask": torch.tensor(mask)}
+
+
+class FakeImageProcessor:
+    merge_size = 1
+
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def __call__(self, images, return_tensors="pt"):
+        self.calls += 1
+        # Four patches per image, each carrying the frame's mean value.
+        return {
+            "pixel_values": torch.full((4, 1), float(images[0].mean())),
+            "image_grid_thw": torch.tensor([[1, 2, 2]]),
+        }
+
+
+class FakeProcessor:
+    def __init__(self) -> None:
+        self.tokenizer = FakeTokenizer()
+        self.image_processor = FakeImageProcessor()
+
+    def apply_chat_template(self, messages, add_generation_prompt=True):
+        text = ""
+        for message in messages:
+            body = "".join(
+                "<|vision_start|><|image_pad|><|vision_end|>" if part["type"] == "image" else part["text"]
+                for part in message["content"]
+            )
+            text += f"<|im_start|>{message['role']}\n{body}<|im_end|>\n"
+        return text + ("<|im_start|>assistant\n" if add_generation_prompt else "")
+
+    def batch_decode(self, sequences, skip_special_tokens=True):
+        return ["".join(chr(int(i)) for i in row if int(i) < 128) for row in sequences]
+
+
+class FakeCache:
+    """Running context sums per position; column 0 is the empty context."""
+
+    def __init__(self, rows: int) -> None:
+        self.states = torch.zeros(rows, 1, dtype=torch.long)
+
+    @property
+    def length(self) -> int:
+        return self.states.shape[1] - 1
+
+    def batch_repeat_interleave(self, repeats) -> None:
+        self.states = self.states.repeat_interleave(repeats, dim=0)
+
+    def crop(self, length) -> None:
+        self.states = self.states[:, : length + 1]
+
+
+class TinyModel:
+    """A bigram model conditioned on a running sum of the unmasked context.
+
+    Image pad tokens add their patch's pixel value, so they need
+    `pixel_values` in the same call. The cache carries the sums and is
+    extended in place, like HF's; a wrongly expanded or cropped cache, or a
+    padding token leaking into the context, changes the logits. Explicit
+    `position_ids` are checked against the attention mask's positions.
+    """
+
+    def __init__(self, seed: int = 0) -> None:
+        gen = torch.Generator().manual_seed(seed)
+        self.bigram = torch.randn(VOCAB, VOCAB, generator=gen)
+        self.context = torch.randn(97, VOCAB, generator=gen)
+        # Never predicts image tokens, which would need pixels of their own.
+        self.bigram[:, IMAGE_PAD] = -1e4
+        self.generation_config = SimpleNamespace(eos_token_id=IM_END)
+        self.rope_deltas = None
+        self.forwards = []
+
+    def to(self, device):
+        return self
+
+    def eval(self):
+        return self
+
+    def get_rope_index(self, input_ids, image_grid_thw=None, attention_mask=None):
+        mask = attention_mask if attention_mask is not None else torch.ones_like(input_ids)
+        pos = (mask.cumsum(-1) - 1).clamp(min=0)
+        deltas = pos.max(-1, keepdim=True).values + 1 - input_ids.shape[1]
+        return pos.unsqueeze(0).expand(3, -1, -1), deltas
+
+    def __call__(self, input_ids, attention_mask=None, past_key_values=None, position_ids=None,
+                 pixel_values=None, image_grid_thw=None, logits_to_keep=0, **kwargs):
+        rows, steps = input_ids.shape
+        self.forwards.append((rows, steps, pixel_values is not None))
+        cache = past_key_values if past_key_values is not None else FakeCache(rows)
+        past = cache.length
+        if attention_mask is None:
+            attention_mask = torch.ones(rows, past + steps, dtype=torch.long)
+        mask = attention_mask[:, past : past + steps]
+        if position_ids is not None:
+            expected = (attention_mask.cumsum(-1) - 1)[:, past:]
+            real = mask.bool()
+            assert torch.equal(position_ids[0][real], expected[real])
+        tokens = input_ids.clone()
+        image = input_ids == IMAGE_PAD
+        if bool(image.any()):
+            assert pixel_values is not None, "image tokens without pixel_values"
+            tokens[image] += pixel_values.view(-1).round().long()
+        state = cache.states[:, -1]
+        states = []
+        for t in range(steps):
+            state = state + tokens[:, t] * mask[:, t]
+            states.append(state)
+        states = torch.stack(states, dim=1)
+        cache.states = torch.cat([cache.states, states], dim=1)
+        logits = self.bigram[input_ids] + self.context[states % 97]
+        if logits_to_keep:
+            logits = logits[:, -logits_to_keep:]
+        return SimpleNamespace(logits=logits, past_key_values=cache)
+
+    def generate(self, input_ids, attention_mask, max_new_tokens, pixel_values=None, image_grid_thw=None,
+                 past_key_values=None, return_dict_in_generate=False, logits_processor=None, **kwargs):
+        """Greedy decoding (also for `do_sample`) that feeds only what the cache lacks.
+
+        Like HF: without a cache the M-RoPE deltas come from the prompt, with
+        one positions are `cache_position + rope_deltas` and `pixel_values`
+        are dropped.
+        """
+        ids, mask, cache = input_ids, attention_mask, past_key_values
+        if cache is None:
+            _, self.rope_deltas = self.get_rope_index(ids, image_grid_thw, mask)
+        scores = []
+        for _ in range(max_new_tokens):
+            past = cache.length if cache is not None else 0
+            if past == 0:
+                position_ids, _ = self.get_rope_index(ids, image_grid_thw, mask)
+            else:
+                position_ids = (torch.arange(past, ids.shape[1]) + self.rope_deltas).unsqueeze(0).expand(3, -1, -1)
+            out = self(ids[:, past:], mask, past_key_values=cache, position_ids=position_ids,
+                       pixel_values=pixel_values if past == 0 else None)
+            cache = out.past_key_values
+            logits = out.logits[:, -1]
+            for processor in logits_processor or []:
+                logits = processor(ids, logits)
+            scores.append(logits)
+            ids = torch.cat([ids, logits.argmax(-1, keepdim=True)], dim=1)
+            mask = torch.cat([mask, torch.ones_like(mask[:, :1])], dim=1)
+        if not return_dict_in_generate:
+            return ids
+        return SimpleNamespace(sequences=ids, scores=tuple(scores), past_key_values=cache)
+
+    def compute_transition_scores(self, sequences, scores, normalize_logits=False):
+        logits = torch.stack(scores, dim=1)
+        if normalize_logits:
+            logits = torch.log_softmax(logits, dim=-1)
+        return logits.gather(-1, sequences[:, -len(scores):, None]).squeeze(-1)
+
+
+def _vlm(precision="fp32", **kwargs):
+    """A QwenVLHF on the fakes; `precision=None` uses the constructor default."""
+    loaded = {}
+
+    def load_model(path, **kwargs):
+        loaded.update(kwargs)
+        return TinyModel()
+
+    saved = qwen_vl_hf.AutoProcessor.from_pretrained, qwen_vl_hf.AutoModelForVision2Seq.from_pretrained
+    qwen_vl_hf.AutoProcessor.from_pretrained = lambda path, **kwargs: FakeProcessor()
+    qwen_vl_hf.AutoModelForVision2Seq.from_pretrained = load_model
+    try:
+        if precision is not None:
+            kwargs["precision"] = precision
+        vlm = QwenVLHF("tiny", device="cpu", **kwargs)
+    finally:
+        qwen_vl_hf.AutoProcessor.from_pretrained, qwen_vl_hf.AutoModelForVision2Seq.from_pretrained = saved
+    return vlm, loaded
+
+
+def _frames():
+    return [np.full((4, 4, 3), 3, dtype=np.uint8), np.full((4, 4, 3), 5, dtype=np.uint8)]
+
+
+def _full_row_logprobs(vlm, frame, prompt):
+    """The old scoring: one unpadded image + prompt + continuation row per action."""
+    text = vlm._chat_text(prompt)
+    out = {}
+    for name in ACTIONS:
+        inputs = vlm._prepare([frame], [text + ACTION_PREFIX + name])
+        n = len(vlm.processor.tokenizer(ACTION_PREFIX + name, add_special_tokens=False)["input_ids"])
+        logits = vlm.model(**inputs).logits[0]
+        logprobs = torch.log_softmax(logits[-n - 1 : -1], dim=-1)
+        out[name] = float(logprobs.gather(-1, inputs["input_ids"][0, -n:, None]).sum())
+    return out
+
+
+def test_score_actions_batch_matches_full_rows_with_one_prefill():
+    vlm, _ = _vlm()
+    frames, prompts = _frames(), ["Find the mug.", "Where is the apple? Think first."]
+    expected = [_full_row_logprobs(vlm, frame, prompt) for frame, prompt in zip(frames, prompts)]
+    vlm.model.forwards.clear()
+    results = vlm.score_actions_batch(frames, prompts, ACTIONS)
+
+    # One prefill of both prompts with the images, one pass over the continuations.
+    assert vlm.model.forwards[0][:1] == (2,) and vlm.model.forwards[0][2]
+    assert vlm.model.forwards[1] == (2 * len(ACTIONS), len(ACTION_PREFIX + "RotateLeft"), False)
+    assert len(vlm.model.forwards) == 2
+    for (candidates, debug), ref in zip(results, expected):
+        got = {c["action"]: c["logprob"] for c in candidates}
+        assert got.keys() == ref.keys()
+        for name in ACTIONS:
+            assert abs(got[name] - ref[name]) < 1e-4
+        assert candidates[0]["action"] == max(ref, key=ref.get)
+        assert abs(sum(c["confidence"] for c in candidates) - 1.0) < 1e-5
+        assert debug["full_text"] == ACTION_PREFIX + candidates[0]["action"]
+    single = vlm.score_actions(frames[1], prompts[1], ACTIONS)[0]
+    assert [c["action"] for c in single] == [c["action"] for c in results[1][0]]
+
+
+def test_generate_batch_matches_per_item_generate():
+    vlm, _ = _vlm()
+    frames, prompts = _frames(), ["Find the mug.", "Where is the apple? Think first."]
+    inputs = vlm._prepare(frames, [vlm._chat_text(prompt) for prompt in prompts])
+    ids, mask = inputs["input_ids"], inputs["attention_mask"]
+    # Left padding: the shorter prompt is padded in front, every row ends at its last prompt token.
+    assert mask[0, 0] == 0 and bool(mask[:, -1].all())
+    assert bool((ids[mask == 0] == vlm.processor.tokenizer.pad_token_id).all())
+    # The single image pad expands to one token per merged patch (a 2x2 grid, merge size 1).
+    assert (ids == IMAGE_PAD).sum(dim=1).tolist() == [4, 4]
+    assert inputs["pixel_values"].shape[0] == 8 and inputs["image_grid_thw"].shape == (2, 3)
+
+    batched = vlm.generate_batch(frames, prompts, max_new_tokens=6)
+    assert len(batched) == 2
+    for frame, prompt, (text, debug) in zip(frames, prompts, batched):
+        assert text == vlm.generate(frame, prompt, max_new_tokens=6)
+        assert debug["batch_size"] == 2
+    assert vlm.generate_batch([], []) == []
+
+
+def test_generate_candidates_batch_prefills_once_and_matches_generate():
+    vlm, _ = _vlm()
+    frames, prompts, n = _frames(), ["Find the mug.", "Where is the apple? Think first."], 3
+    expected = []
+    for frame, prompt in zip(frames, prompts):
+        inputs = vlm._prepare([frame], [vlm._chat_text(prompt)])
+        out = vlm.model.generate(**inputs, max_new_tokens=6, output_scores=True, return_dict_in_generate=True)
+        token_lp = vlm.model.compute_transition_scores(out.sequences, out.scores, normalize_logits=True)
+        ids = out.sequences[0, inputs["input_ids"].shape[1]:].tolist()
+        length = ids.index(IM_END) + 1 if IM_END in ids else len(ids)
+        expected.append((vlm.generate(frame, prompt, max_new_tokens=6), float(token_lp[0, :length].sum()), length))
+    vlm.model.forwards.clear()
+    results = vlm.generate_candidates_batch(frames, prompts, n, max_new_tokens=6)
+
+    # One prefill of both prompts (all but the last token) with the images; decoding then feeds n rows per request.
+    width = vlm._prepare(frames, [vlm._chat_text(p) for p in prompts])["input_ids"].shape[1]
+    assert vlm.model.forwards[0] == (2, width - 1, True)
+    assert all(rows == 2 * n and steps == 1 and not pixels for rows, steps, pixels in vlm.model.forwards[1:])
+    assert len(results) == 2
+    for (candidates, debug), (text, logprob, length) in zip(results, expected):
+        # Greedy fakes: every sample of a request is that request's generate output, in request order.
+        assert [c["text"] for c in candidates] == [text] * n
+        for cand in candidates:
+            assert abs(cand["logprob"] - logprob) < 1e-4 and cand["tokens"] == length
+            assert 0.0 <= cand["latency_s"] <= debug["latency_s"]
+        assert abs(sum(c["confidence"] for c in candidates) - 1.0) < 1e-6
+        assert debug["full_text"] == text and debug["n_candidates"] == n and debug["batch_size"] == 2
+    assert expected[0][0] != expected[1][0]
+    single = vlm.generate_candidates(frames[1], prompts[1], n, max_new_tokens=6)[0]
+    assert [c["text"] for c in single] == [expected[1][0]] * n
+
+
+def test_generate_chained_reuses_the_first_turn_and_matches_a_fresh_generate():
+    vlm, _ = _vlm()
+    frame, first_prompt = _frames()[0], "Name the landmarks."
+    prompt_len = len(vlm._prepare([frame], [vlm._chat_text(first_prompt)])["input_ids"][0])
+
+    def make_followup(answer):
+        return f"Landmarks: {answer!r}. Pick the action."
+
+    # Second pass: the first answer opens with a special token that decoding drops, so the
+    # re-templated conversation diverges right after the prompt and the cache is cropped there.
+    for skipped_first_token in (False, True):
+        if skipped_first_token:
+            vlm.model.bigram[ord("\n"), 128 + SPECIALS.index("<|vision_end|>")] = 1e3
+        vlm.model.forwards.clear()
+        (first, _), (second, debug) = vlm.generate_chained(
+            frame, first_prompt, make_followup, first_max_new_tokens=5, max_new_tokens=6
+        )
+        first_forwards = len(vlm.model.forwards)
+        assert first == vlm.generate(frame, first_prompt, max_new_tokens=5)
+
+        messages = [
+            {"role": "user", "content": [{"type": "image"}, {"type": "text", "text": first_prompt}]},
+            {"role": "assistant", "content": [{"type": "text", "text": first}]},
+            {"role": "user", "content": [{"type": "text", "text": make_followup(first)}]},
+        ]
+        inputs = vlm._prepare([frame], [vlm.processor.apply_chat_template(messages, add_generation_prompt=True)])
+        fresh = vlm.processor.batch_decode(vlm.model.generate(**inputs, max_new_tokens=6))[0]
+        assert second == vlm._extract_assistant(fresh)
+
+        # The image and first prompt are not fed again; the second turn prefills only past the reused tokens.
+        reused = debug["kv_reused_tokens"]
+        assert (reused == prompt_len) if skipped_first_token else (reused == prompt_len + 4)
+        assert vlm.model.forwards[5] == (1, debug["input_tokens"] - reused, False)
+        assert first_forwards == 5 + 6
+    assert vlm.generate_chained(frame, first_prompt, lambda answer: None)[1] is None
+
+
+def test_preprocess_runs_the_image_processor_once_per_frame_object():
+    vlm, _ = _vlm()
+    image_processor = vlm.processor.image_processor
+    frame = _frames()[0]
+    # The landmark and planner calls of one step share event.frame.
+    landmarks = vlm.generate(frame, "Name the landmarks.", max_new_tokens=3)
+    vlm.generate(frame, f"Landmarks: {landmarks}. Pick the action.", max_new_tokens=3)
+    assert image_processor.calls == 1
+    assert (vlm.preprocess_stats["hits"], vlm.preprocess_stats["misses"]) == (1, 1)
+    assert vlm.preprocess_stats["seconds"] > 0
+
+    # The next step's frame is a new array, even with the same pixels.
+    vlm.generate(frame.copy(), "Name the landmarks.", max_new_tokens=3)
+    assert image_processor.calls == 2 and vlm.preprocess_stats["misses"] == 2
+
+    frames = [np.full((4, 4, 3), k, dtype=np.uint8) for k in range(qwen_vl_hf.PIXEL_CACHE_SIZE)]
+    for f in frames:
+        vlm.preprocess(f)
+    assert len(vlm._pixel_cache) == qwen_vl_hf.PIXEL_CACHE_SIZE
+    calls = image_processor.calls
+    vlm.preprocess(frames[-1])
+    assert image_processor.calls == calls
+    # The 16 newer frames evicted `frame` and its copy; frames[0] is still cached.
+    vlm.preprocess(frames[0])
+    vlm.preprocess(frame)
+    assert image_processor.calls == calls + 1
+    assert len(vlm._pixel_cache) == qwen_vl_hf.PIXEL_CACHE_SIZE
+    assert vlm.preprocess_stats["hits"] == 3
+    assert vlm.preprocess_stats["misses"] == 2 + qwen_vl_hf.PIXEL_CACHE_SIZE + 1
+
+
+def test_prefix_cached_generate_matches_uncached_generate():
+    vlm, _ = _vlm(prefix_cache_size=1)
+    prefix = "Allowed: MoveAhead, Stop.\nRules: explore first.\n"
+    frames, prompts = _frames(), ["Target: mug", "Target: apple\nRecent: MoveAhead"]
+    vlm.prefix_cache_size = 0
+    expected = [vlm.generate(frame, prompt, max_new_tokens=6, prefix=prefix) for frame, prompt in zip(frames, prompts)]
+    vlm.prefix_cache_size = 1
+    plen = len(vlm.processor.tokenizer.encode(vlm._chat_text(prompts[0], prefix).split("<|vision_start|>")[0]))
+    for frame, prompt, ref in zip(frames, prompts, expected):
+        vlm.model.forwards.clear()
+        assert vlm.generate(frame, prompt, max_new_tokens=6, prefix=prefix) == ref
+    # The second call copies the cached prefix and prefills only the image and the rest of the prompt.
+    total = len(vlm._prepare([frames[1]], [vlm._chat_text(prompts[1], prefix)])["input_ids"][0])
+    assert vlm.model.forwards[0] == (1, total - 1 - plen, True)
+    assert vlm.prefix_cache_stats == {"hits": 1, "misses": 1, "bypassed": 0}
+
+
+def test_planner_prompt_splits_off_the_prefix_only_with_prefix_cache():
+    import yaml
+
+    from src.main import planner_prompt
+
+    with open("configs/prompt.yaml", "r", encoding="utf-8") as f:
+        prompt_cfg = yaml.safe_load(f)
+    vlm, _ = _vlm()
+    for size in (0, 2):
+        template, prefix = planner_prompt(prompt_cfg, {"model": {"prefix_cache": size}})
+        text = vlm._chat_text(template.format(target="mug", trajectory="(none)", rag_snippets="(none)"), prefix)
+        assert text.count("Return one line only") == 1 and text.count("Rules:") == 1
+        image = text.index("<|vision_start|>")
+        if size:
+            assert prefix and text.index("Rules:") < image < text.index("Target: mug")
+        else:
+            # The baseline layout: the image, then the whole single template.
+            assert template == prompt_cfg["planner"]["template"] and prefix == ""
+            assert image < text.index("Target: mug") < text.index("Rules:")
+
+
+def test_default_precision_loads_fp32_like_the_baseline():
+    import yaml
+
+    from src import main as main_mod
+
+    vlm, loaded = _vlm(precision=None)
+    assert vlm.precision == "fp32" and loaded["torch_dtype"] is torch.float32
+    assert _vlm("auto")[1]["torch_dtype"] == "auto"
+    with open("configs/run.yaml", "r", encoding="utf-8") as f:
+        assert yaml.safe_load(f)["model"]["precision"] == "fp32"
+
+    built = {}
+    saved = qwen_vl_hf.QwenVLHF
+    qwen_vl_hf.QwenVLHF = lambda path, device, **kwargs: built.update(kwargs)
+    try:
+        main_mod.load_model({"model": {"local_path": "tiny", "device": "cpu"}})
+    finally:
+        qwen_vl_hf.QwenVLHF = saved
+    assert built["precision"] == "fp32"
+
+
+if __name__ == "__main__":
+    test_score_actions_batch_matches_full_rows_with_one_prefill()
+    test_generate_batch_matches_per_item_generate()
+    test_generate_candidates_batch_prefills_once_and_matches_generate()
+    test_generate_chained_reuses_the_first_turn_and_matches_a_fresh_generate()
+    test_preprocess_runs_the_image_processor_once_per_frame_object()
+    test_prefix_cached_generate_matches_uncached_generate()
+    test_planner_prompt_splits_off_the_prefix_only_with_prefix_cache()
+    test_default_precision_loads_fp32_like_the_baseline()
+    print("ok")
@@ -0,0 +1,86 @@
+import tempfile
+
+import numpy as np
+
+from src.vlm.response_cache import CachedVLM, ResponseCache
+
+
+class CountingModel:
+    def __init__(self, precision: str = "fp32") -> None:
+        self.requests = 0
+        self.preprocessed = 0
+        self.prefix_cache_size = 0
+        self.precision = precision
+        self.device = "cpu"
+
+    def preprocess(self, frame):
+        self.preprocessed += 1
+
+    def generate_with_debug(self, frame, prompt, max_new_tokens=256, prefix=None):
+        self.requests += 1
+        text = f"ACTION={prompt}{int(frame.sum())}"
+        return text, {"full_text": text}
+
+    def generate_batch(self, frames, prompts, max_new_tokens=256, prefix=None):
+        return [self.generate_with_debug(f, p, max_new_tokens) for f, p in zip(frames, prompts)]
+
+
+def _frames(n):
+    return [np.full((4, 4, 3), i, dtype=np.uint8) for i in range(n)]
+
+
+def test_cached_calls_replay_and_batch_forwards_misses() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        inner = CountingModel()
+        model = CachedVLM(inner, ResponseCache(tmp, 1 << 20), "model-a")
+        frames = _frames(3)
+        first = model.generate_with_debug(frames[0], "p")
+        assert model.generate_with_debug(frames[0], "p") == first
+        assert inner.requests == 1
+        batch = model.generate_batch(frames, ["p", "p", "p"])
+        assert batch[0] == first and inner.requests == 3
+        assert model.generate(frames[1], "p", max_new_tokens=8) == batch[1][0]
+        assert inner.requests == 4  # max_new_tokens is part of the key
+        assert model.prefix_cache_size == 0
+
+        reopened = CachedVLM(CountingModel(), ResponseCache(tmp, 1 << 20), "model-a")
+        assert reopened.generate_batch(frames, ["p", "p", "p"]) == batch
+        assert reopened.model.requests == 0
+        assert reopened.cache.stats()["hits"] == 3
+        other = CachedVLM(CountingModel(), ResponseCache(tmp, 1 << 20), "model-b")
+        other.generate_with_debug(frames[0], "p")
+        assert other.model.requests == 1
+
+
+def test_load_options_key_and_preprocess_is_deferred() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        frames = _frames(2)
+        fp32 = CachedVLM(CountingModel("fp32"), ResponseCache(tmp, 1 << 20), "model-a")
+        fp32.generate_batch(frames, ["p", "p"])
+        bf16 = CachedVLM(CountingModel("bf16"), ResponseCache(tmp, 1 << 20), "model-a")
+        bf16.generate_batch(frames, ["p", "p"])
+        assert bf16.model.requests == 2  # another precision never replays fp32 answers
+
+        replay = CachedVLM(CountingModel("fp32"), ResponseCache(tmp, 1 << 20), "model-a")
+        for frame in frames:
+            replay.preprocess(frame)
+            replay.generate_with_debug(frame, "p")
+        assert replay.model.requests == 0 and replay.model.preprocessed == 0
+
+
+def test_cache_evicts_least_recently_used() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ResponseCache(tmp, 200)
+        for i in range(10):
+            cache.put(f"{i:064x}", {"text": "x" * 40})
+        stats = cache.stats()
+        assert stats["bytes"] <= 200 and stats["evicted"] > 0
+        assert cache.get(f"{9:064x}") is not None
+        assert cache.get(f"{0:064x}") is None
+
+
+if __name__ == "__main__":
+    test_cached_calls_replay_and_batch_forwards_misses()
+    test_load_options_key_and_preprocess_is_deferred()
+    test_cache_evicts_least_recently_used()
+    print("response cache tests passed")
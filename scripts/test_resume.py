@@ -0,0 +1,224 @@
+import copy
+import json
+import os
+import sys
+import tempfile
+import threading
+
+import src.main as main_mod
+from scripts.test_vector_runner import CFG, TEMPLATE, FakeEnv, FakeModel, _specs
+from src.main import compute_metrics, run_local
+from src.utils.resume import prompt_path
+from src.utils.step_store import load_columns
+
+
+class CrashingEnv(FakeEnv):
+    """Raises mid-episode once `crash_after` steps have been taken in total."""
+
+    def __init__(self, crash_after=None) -> None:
+        super().__init__()
+        self.crash_after = crash_after
+        self.total = 0
+
+    def step(self, action):
+        self.total += 1
+        if self.crash_after is not None and self.total > self.crash_after:
+            raise RuntimeError("unity crashed")
+        return super().step(action)
+
+    def close(self) -> None:
+        pass
+
+
+class RunModel(FakeModel):
+    prefix_cache_size = 0
+    preprocess_stats = {}
+
+
+def _cfg():
+    cfg = copy.deepcopy(CFG)
+    cfg["rag"] = dict(cfg["rag"], scope="global", capacity=4, eviction="lru")
+    return cfg
+
+
+def _run(out, specs, crash_after=None, resume=False, cfg=None):
+    main_mod.make_env = lambda cfg, scene, log: CrashingEnv(crash_after)
+    main_mod.load_model = lambda cfg: RunModel()
+    os.makedirs(out, exist_ok=True)
+    return run_local(cfg or _cfg(), specs, out, TEMPLATE, resume=resume)
+
+
+def _lines(path):
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    return [{k: v for k, v in r.items() if k not in ("timings", "frame_encoder")} for r in records]
+
+
+def test_resume_matches_uninterrupted_run() -> None:
+    specs = _specs(5)
+    make_env, load_model = main_mod.make_env, main_mod.load_model
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            full, full_extra = _run(f"{tmp}/full", specs)
+
+            out = f"{tmp}/crashed"
+            try:
+                _run(out, specs, crash_after=40)
+            except RuntimeError:
+                pass
+            else:
+                raise AssertionError("expected the run to crash")
+            with open(f"{out}/steps.jsonl", "a", encoding="utf-8") as f:
+                f.write('{"episode_id": 4, "step_')  # torn tail
+            resumed, extra = _run(out, specs, resume=True)
+            assert "resume" not in extra
+            with open(f"{out}/resume.jsonl", encoding="utf-8") as f:
+                stats = [json.loads(line) for line in f]
+            assert len(stats) == 1 and 0 < stats[0]["completed"] < len(specs)
+            assert stats[0]["dropped_lines"]["steps.jsonl"] >= 2 and stats[0]["rag_missing_episodes"] == 0
+
+            assert compute_metrics(resumed) == compute_metrics(full)
+            for name in ("steps.jsonl", "steps_eval.jsonl", "episode_meta.jsonl", "episode_summary.jsonl"):
+                assert _lines(f"{out}/{name}") == _lines(f"{tmp}/full/{name}"), name
+            with open(f"{out}/rag_store.jsonl", encoding="utf-8") as a, open(f"{tmp}/full/rag_store.jsonl") as b:
+                assert a.read() == b.read()
+            assert extra["rag"] == full_extra["rag"]
+            cols, full_cols = load_columns(f"{out}/step_columns"), load_columns(f"{tmp}/full/step_columns")
+            assert all((cols[name] == full_cols[name]).all() for name in ("episode_id", "action", "collision"))
+            with open(f"{out}/checkpoint.json", encoding="utf-8") as f:
+                assert json.load(f)["completed"] == [0, 1, 2, 3, 4]
+            assert not os.path.exists(f"{out}/checkpoint.json.tmp")
+    finally:
+        main_mod.make_env, main_mod.load_model = make_env, load_model
+
+
+def test_resume_without_a_checkpoint_uses_the_episode_summaries() -> None:
+    specs = _specs(5)
+    # Per-episode RAG, so nothing is lost without the checkpointed store.
+    cfg = copy.deepcopy(CFG)
+    make_env, load_model = main_mod.make_env, main_mod.load_model
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            full, _ = _run(f"{tmp}/full", specs, cfg=cfg)
+            for layout in ("killed_before_checkpoint", "older_run"):
+                out = f"{tmp}/{layout}"
+                try:
+                    _run(out, specs, crash_after=40, cfg=cfg)
+                except RuntimeError:
+                    pass
+                os.remove(f"{out}/checkpoint.json")
+                if layout == "older_run":
+                    # Older runs rewrote episode_summary.json after each episode, without hallucination counts.
+                    with open(f"{out}/episode_summary.jsonl", encoding="utf-8") as f:
+                        episodes = [json.loads(line) for line in f]
+                    for episode in episodes:
+                        episode.pop("hallucinations")
+                    with open(f"{out}/episode_summary.json", "w", encoding="utf-8") as f:
+                        json.dump({"episodes": episodes}, f)
+                    os.remove(f"{out}/episode_summary.jsonl")
+                resumed, _ = _run(out, specs, resume=True, cfg=cfg)
+                with open(f"{out}/resume.jsonl", encoding="utf-8") as f:
+                    stats = json.loads(f.readline())
+                # Finished episodes are kept, not run again.
+                assert 0 < stats["completed"] < len(specs) and stats["rag_missing_episodes"] == stats["completed"]
+                assert compute_metrics(resumed) == compute_metrics(full), layout
+                for name in ("steps.jsonl", "steps_eval.jsonl", "episode_summary.jsonl"):
+                    assert _lines(f"{out}/{name}") == _lines(f"{tmp}/full/{name}"), (layout, name)
+    finally:
+        main_mod.make_env, main_mod.load_model = make_env, load_model
+
+
+class FailingCloseWriter(main_mod.AsyncWriter):
+    def close(self) -> None:
+        super().close()
+        raise OSError("disk full")
+
+
+def test_writer_close_error_does_not_mask_episode_error() -> None:
+    saved = main_mod.make_env, main_mod.load_model, main_mod.AsyncWriter
+    main_mod.AsyncWriter = FailingCloseWriter
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            try:
+                _run(f"{tmp}/crashed", _specs(2), crash_after=5)
+            except RuntimeError as exc:
+                assert str(exc) == "unity crashed"
+            else:
+                raise AssertionError("expected the episode error")
+            try:
+                _run(f"{tmp}/clean", _specs(2))
+            except OSError as exc:
+                assert str(exc) == "disk full"
+            else:
+                raise AssertionError("expected the close error")
+    finally:
+        main_mod.make_env, main_mod.load_model, main_mod.AsyncWriter = saved
+
+
+class ClosingEnv(CrashingEnv):
+    instances = []
+
+    def __init__(self, crash_after=None) -> None:
+        super().__init__(crash_after)
+        self.closed = False
+        ClosingEnv.instances.append(self)
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def test_episode_error_still_closes_envs_and_the_reset_pool() -> None:
+    saved = main_mod.make_env, main_mod.load_model
+    main_mod.make_env = lambda cfg, scene, log: ClosingEnv(crash_after=5)
+    main_mod.load_model = lambda cfg: RunModel()
+    ClosingEnv.instances = []
+    cfg = dict(_cfg(), pipeline={"prefetch_reset": True})
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            try:
+                run_local(cfg, _specs(3), tmp, TEMPLATE)
+            except RuntimeError as exc:
+                assert str(exc) == "unity crashed"
+            else:
+                raise AssertionError("expected the episode error")
+    finally:
+        main_mod.make_env, main_mod.load_model = saved
+    # One controller runs the episode, the second one takes the prefetched reset.
+    assert len(ClosingEnv.instances) == 2 and all(env.closed for env in ClosingEnv.instances)
+    assert not [t for t in threading.enumerate() if t.name.startswith("ThreadPoolExecutor")]
+
+
+def test_resume_reads_the_prompt_saved_in_the_run_dir() -> None:
+    assert prompt_path("configs/run.yaml", None) == os.path.join("configs", "prompt.yaml")
+    with tempfile.TemporaryDirectory() as run_dir:
+        # A run saved without its prompt falls back to the one beside --config.
+        assert prompt_path("configs/run.yaml", run_dir) == os.path.join("configs", "prompt.yaml")
+        try:
+            prompt_path(None, run_dir)
+        except FileNotFoundError as exc:
+            assert "--config" in str(exc)
+        else:
+            raise AssertionError("expected a missing prompt to need --config")
+        with open(os.path.join(run_dir, "prompt.yaml"), "w", encoding="utf-8") as f:
+            f.write("planner: {}\n")
+        assert prompt_path(None, run_dir) == os.path.join(run_dir, "prompt.yaml")
+        assert prompt_path("configs/run.yaml", run_dir) == os.path.join(run_dir, "prompt.yaml")
+    argv = sys.argv
+    sys.argv = ["src.main"]
+    try:
+        main_mod.main()
+    except SystemExit as exc:
+        assert exc.code == 2
+    else:
+        raise AssertionError("expected --config or --resume to be required")
+    finally:
+        sys.argv = argv
+
+
+if __name__ == "__main__":
+    test_resume_matches_uninterrupted_run()
+    test_resume_without_a_checkpoint_uses_the_episode_summaries()
+    test_writer_close_error_does_not_mask_episode_error()
+    test_episode_error_still_closes_envs_and_the_reset_pool()
+    test_resume_reads_the_prompt_saved_in_the_run_dir()
+    print("resume tests passed")
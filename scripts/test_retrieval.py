@@ -0,0 +1,209 @@
+import json
+import random
+import tempfile
+
+from src.rag.retrieval import retrieve, similarity, tokenize
+from src.rag.segment import jsonl_to_segment, segment_to_jsonl
+from src.rag.sparse_index import SparseIndex
+from src.rag.store import RagStore
+
+WORDS = ["chair", "table", "mug", "sofa", "lamp", "kitchen", "bedroom", "none"]
+
+
+def _random_store(path: str, n: int, seed: int = 0, backend: str = "index") -> RagStore:
+    rng = random.Random(seed)
+    store = RagStore(path, backend=backend)
+    for _ in range(n):
+        kind = rng.choice(["PLACE", "LOC", "DIR"])
+        words = rng.sample(WORDS, rng.randint(0, 3))
+        store.upsert(f"{kind}: " + ", ".join(words), {"type": kind})
+    return store
+
+
+def test_indexed_retrieve_matches_full_scan() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        store = _random_store(f"{tmp}/rag_store.jsonl", 300)
+        rng = random.Random(1)
+        for _ in range(50):
+            lmks = ", ".join(rng.sample(WORDS, rng.randint(0, 3))) or "none"
+            query = f"target=mug lmk={lmks}"
+            for types in ([], ["PLACE"], ["PLACE", "LOC"]):
+                for top_k in (1, 3, 10):
+                    expected = retrieve(store.all(), query, top_k, types)
+                    assert store.retrieve(query, top_k, types) == expected
+
+
+def test_sparse_backend_matches_indexed() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        indexed = _random_store(f"{tmp}/a/rag_store.jsonl", 300)
+        sparse = _random_store(f"{tmp}/b/rag_store.jsonl", 300, backend="sparse")
+        rng = random.Random(2)
+        queries = [
+            "target=mug lmk=" + (", ".join(rng.sample(WORDS, rng.randint(0, 3))) or "none")
+            for _ in range(40)
+        ]
+        for types in ([], ["PLACE"], ["PLACE", "LOC"], ["MISSING"]):
+            for top_k in (1, 3, 10):
+                expected = [indexed.retrieve(q, top_k, types) for q in queries]
+                assert sparse.retrieve_batch(queries, top_k, types) == expected
+                assert sparse.retrieve(queries[0], top_k, types) == expected[0]
+
+def test_sparse_scores_match_similarity_across_removals() -> None:
+    index = SparseIndex()
+    texts = {}
+    rng = random.Random(4)
+    for step in range(300):
+        if texts and rng.random() < 0.3:
+            entry_id = rng.choice(sorted(texts))
+            index.remove(entry_id)
+            del texts[entry_id]
+        else:
+            # Repeated and fresh words, so counts exceed 1 and freed columns get reused.
+            words = [rng.choice(WORDS) if rng.random() < 0.6 else f"w{rng.randint(0, 30)}"
+                     for _ in range(rng.randint(0, 4))]
+            texts[step] = "PLACE: " + ", ".join(words)
+            index.add(step, texts[step], "PLACE")
+        if step % 25 == 0:
+            queries = ["mug mug chair w3", "", "nothing known", "place " + rng.choice(WORDS)]
+            scores = index.score_batch(queries)
+            for row, entry_id in enumerate(index.row_ids.tolist()):
+                if index.alive[row]:
+                    for q, query in enumerate(queries):
+                        assert scores[q, row] == similarity(query, texts[entry_id])
+
+
+def test_reload_rebuilds_index() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = f"{tmp}/rag_store.jsonl"
+        store = _random_store(path, 50)
+        reloaded = RagStore(path)
+        query = "target=mug lmk=chair, lamp"
+        assert reloaded.retrieve(query, 3, ["PLACE"]) == store.retrieve(query, 3, ["PLACE"])
+
+
+def test_upsert_dedupes_and_compacts() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = f"{tmp}/rag_store.jsonl"
+        store = RagStore(path)
+        for step in range(5):
+            store.upsert("LOC: none", {"type": "LOC"}, step=step)
+        store.upsert("LOC: none", {"type": "PLACE"}, step=5)
+        assert len(store.all()) == 2
+        assert store.all()[0]["metadata"]["hits"] == 5
+        assert store.all()[0]["metadata"]["last_seen_step"] == 4
+        store.compact()
+        reloaded = RagStore(path)
+        assert [e["metadata"]["hits"] for e in reloaded.all()] == [5, 1]
+
+
+def test_load_folds_legacy_duplicates() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = f"{tmp}/rag_store.jsonl"
+        with open(path, "w", encoding="utf-8") as f:
+            for idx in range(4):
+                f.write(json.dumps({"id": idx, "text": "DIR: target_rel=unknown", "metadata": {"type": "DIR"}}) + "\n")
+        store = RagStore(path)
+        assert len(store.all()) == 1
+        assert store.all()[0]["metadata"]["hits"] == 4
+        assert store.upsert("LOC: kitchen", {"type": "LOC"})["id"] == 4
+
+
+def test_segment_matches_jsonl_store() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        source = _random_store(f"{tmp}/src/rag_store.jsonl", 300)
+        source.compact()
+        jsonl_to_segment(source.path, f"{tmp}/base.ragseg")
+        mounted = RagStore(f"{tmp}/run/rag_store.jsonl", base_path=f"{tmp}/base.ragseg")
+        rng = random.Random(3)
+        for _ in range(30):
+            query = "target=mug lmk=" + ", ".join(rng.sample(WORDS, rng.randint(0, 3)))
+            for types in ([], ["LOC"]):
+                assert mounted.retrieve(query, 5, types) == source.retrieve(query, 5, types)
+        existing = source.all()[0]
+        assert mounted.upsert(existing["text"], existing["metadata"])["id"] == existing["id"]
+        assert mounted.all() == []
+        segment_to_jsonl(f"{tmp}/base.ragseg", f"{tmp}/roundtrip.jsonl")
+        assert RagStore(f"{tmp}/roundtrip.jsonl").all() == source.all()
+
+
+def test_capacity_evicts_by_policy() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in ("index", "sparse"):
+            lru = RagStore(f"{tmp}/{backend}/lru.jsonl", backend=backend, capacity=2, eviction="lru")
+            lru.upsert("PLACE: chair", {"type": "PLACE"})
+            lru.upsert("PLACE: table", {"type": "PLACE"})
+            assert [e["text"] for e in lru.retrieve("lmk=chair", 1, [])] == ["PLACE: chair"]
+            lru.upsert("PLACE: sofa", {"type": "PLACE"})
+            assert sorted(e["text"] for e in lru.all()) == ["PLACE: chair", "PLACE: sofa"]
+            assert [e["text"] for e in lru.retrieve("lmk=table", 3, [])] == ["PLACE: chair", "PLACE: sofa"]
+
+            lfu = RagStore(f"{tmp}/{backend}/lfu.jsonl", backend=backend, capacity=2, eviction="lfu")
+            for _ in range(3):
+                lfu.upsert("LOC: kitchen", {"type": "LOC"})
+            lfu.upsert("LOC: bedroom", {"type": "LOC"})
+            lfu.upsert("LOC: hall", {"type": "LOC"})
+            assert sorted(e["text"] for e in lfu.all()) == ["LOC: hall", "LOC: kitchen"]
+            lfu.compact()
+            assert len(RagStore(lfu.path).all()) == 2
+
+
+class ScanEvictStore(RagStore):
+    """Picks every victim with a full scan of the scores, as eviction used to."""
+
+    def _score(self, entry):
+        hits = entry["metadata"].get("hits", 1)
+        if self.eviction == "lfu":
+            return hits
+        if self.eviction == "recency":
+            return hits * self.recency_decay ** (self.clock - self._last_seen.get(entry["id"], 0))
+        return self._last_retrieved.get(entry["id"], 0)
+
+    def _evict(self, keep=None):
+        if self.capacity is None:
+            return
+        while len(self._by_id) > self.capacity:
+            self._drop(min((e for e in self.entries if e is not keep), key=lambda e: (self._score(e), e["id"])))
+
+
+def test_heap_eviction_matches_full_scan_and_prunes_vocab() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        for policy in ("lru", "lfu", "recency"):
+            for backend in ("index", "sparse"):
+                stores = [
+                    cls(f"{tmp}/{policy}/{backend}/{i}.jsonl", backend=backend, capacity=6, eviction=policy,
+                        recency_decay=0.9)
+                    for i, cls in enumerate((RagStore, ScanEvictStore))
+                ]
+                rng = random.Random(3)
+                for step in range(400):
+                    if rng.random() < 0.6:
+                        # Mostly fresh words, so evicted entries take their terms with them.
+                        words = [rng.choice(WORDS) if rng.random() < 0.5 else f"w{rng.randint(0, 40)}"
+                                 for _ in range(rng.randint(1, 3))]
+                        kind = rng.choice(["PLACE", "LOC"])
+                        for store in stores:
+                            store.upsert(f"{kind}: " + ", ".join(words), {"type": kind}, step=step)
+                    else:
+                        query = "target=mug lmk=" + ", ".join(rng.sample(WORDS, 2))
+                        expected = retrieve(stores[0].all(), query, 2, [])
+                        heap_hits, scan_hits = (s.retrieve(query, 2, []) for s in stores)
+                        assert heap_hits == scan_hits == expected
+                    assert stores[0].all() == stores[1].all()
+                assert stores[0].evicted == stores[1].evicted > 0
+                assert len(stores[0]._heap) <= 2 * len(stores[0].all()) + 64
+                if backend == "sparse":
+                    live = {tok for e in stores[0].all() for tok in tokenize(e["text"])}
+                    assert set(stores[0].index.vocab) == live
+
+
+if __name__ == "__main__":
+    test_indexed_retrieve_matches_full_scan()
+    test_sparse_backend_matches_indexed()
+    test_sparse_scores_match_similarity_across_removals()
+    test_reload_rebuilds_index()
+    test_segment_matches_jsonl_store()
+    test_capacity_evicts_by_policy()
+    test_heap_eviction_matches_full_scan_and_prunes_vocab()
+    test_upsert_dedupes_and_compacts()
+    test_load_folds_legacy_duplicates()
+    print("retrieval tests passed")
@@ -0,0 +1,117 @@
+import json
+import os
+import tempfile
+from types import SimpleNamespace
+
+import src.main as main_mod
+from scripts.test_resume import CrashingEnv, RunModel, _lines
+from scripts.test_vector_runner import CFG, TEMPLATE, _specs
+from src.main import compute_metrics, run_local, run_sharded
+from src.utils.shards import _merge_jsonl, merge_shard_outputs, shard_dir, shard_specs
+from src.utils.step_store import COLUMNS, ColumnarStepWriter, load_columns
+
+
+class InlinePool:
+    """Stands in for the spawn pool: runs the shard jobs one after another in this process."""
+
+    def __init__(self, processes) -> None:
+        self.processes = processes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+    def map(self, fn, jobs):
+        return [fn(job) for job in jobs]
+
+
+def _write_jsonl(path, records):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def _step(episode_id, step_idx):
+    return {"episode_id": episode_id, "step_idx": step_idx, "action": f"a{episode_id}{step_idx}"}
+
+
+def test_shard_specs_is_a_deterministic_round_robin() -> None:
+    specs = _specs(7)
+    shards = shard_specs(specs, 3)
+    assert [[s["episode_id"] for s in chunk] for chunk in shards] == [[0, 3, 6], [1, 4], [2, 5]]
+    assert shard_specs(_specs(7), 3) == shards
+    assert sorted(s["episode_id"] for chunk in shards for s in chunk) == list(range(7))
+    assert shard_dir("out", 1) == os.path.join("out", "shards", "shard_01")
+
+
+def test_merge_orders_interleaved_shards_by_episode_and_step() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        dirs = [shard_dir(tmp, 0), shard_dir(tmp, 1)]
+        # Episodes 0, 2, 4 ran in shard 0 and 1, 3 in shard 1, each in its own completion order.
+        shard_steps = [
+            [_step(2, 0), _step(2, 1), _step(0, 0), _step(0, 1), _step(0, 2), _step(4, 0)],
+            [_step(1, 0), _step(3, 0), _step(3, 1), _step(1, 1)],
+        ]
+        for d, steps in zip(dirs, shard_steps):
+            _write_jsonl(os.path.join(d, "steps_eval.jsonl"), steps)
+            ids = sorted({s["episode_id"] for s in steps}, reverse=True)
+            _write_jsonl(os.path.join(d, "episode_summary.jsonl"), [{"episode_id": i} for i in ids])
+            with open(os.path.join(d, "episode_summary.json"), "w", encoding="utf-8") as f:
+                json.dump({"episodes": [{"episode_id": i} for i in ids]}, f)
+            writer = ColumnarStepWriter(os.path.join(d, "step_columns"), chunk_rows=4)
+            writer.add(steps)
+            writer.close()
+        with open(os.path.join(dirs[1], "steps_eval.jsonl"), "a", encoding="utf-8") as f:
+            f.write("\n")
+
+        episodes = merge_shard_outputs(tmp, dirs)
+        assert [ep["episode_id"] for ep in episodes] == [0, 1, 2, 3, 4]
+        expected = sorted((s for steps in shard_steps for s in steps), key=lambda s: (s["episode_id"], s["step_idx"]))
+        assert _lines(os.path.join(tmp, "steps_eval.jsonl")) == expected
+        assert _lines(os.path.join(tmp, "episode_summary.jsonl")) == [{"episode_id": i} for i in range(5)]
+        with open(os.path.join(tmp, "episode_summary.json"), encoding="utf-8") as f:
+            assert json.load(f)["episodes"] == episodes
+        cols = load_columns(os.path.join(tmp, "step_columns"))
+        assert set(cols) == set(COLUMNS)
+        assert list(zip(cols["episode_id"], cols["step_idx"])) == [(s["episode_id"], s["step_idx"]) for s in expected]
+        assert list(cols["action"]) == [s["action"] for s in expected]
+        # Missing shard files are skipped; the merge returns the number of lines written.
+        assert _merge_jsonl([os.path.join(d, "steps.jsonl") for d in dirs], os.path.join(tmp, "steps.jsonl")) == 0
+
+
+def test_run_sharded_matches_a_single_process_run() -> None:
+    specs = _specs(5)
+    saved = main_mod.make_env, main_mod.load_model, main_mod.multiprocessing
+    main_mod.make_env = lambda cfg, scene, log: CrashingEnv()
+    main_mod.load_model = lambda cfg: RunModel()
+    main_mod.multiprocessing = SimpleNamespace(get_context=lambda method: SimpleNamespace(Pool=InlinePool))
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(f"{tmp}/single")
+            single, _ = run_local(CFG, specs, f"{tmp}/single", TEMPLATE)
+            sharded, extra = run_sharded(CFG, specs, f"{tmp}/sharded", TEMPLATE, 2)
+            assert len(extra["shards"]) == 2
+
+            assert compute_metrics(sharded) == compute_metrics(single)
+            for name in ("steps.jsonl", "steps_eval.jsonl", "episode_meta.jsonl", "episode_summary.jsonl"):
+                assert _lines(f"{tmp}/sharded/{name}") == _lines(f"{tmp}/single/{name}"), name
+            for run in ("single", "sharded"):
+                with open(f"{tmp}/{run}/episode_summary.json", encoding="utf-8") as f:
+                    episodes = json.load(f)["episodes"]
+                assert [ep["episode_id"] for ep in episodes] == [0, 1, 2, 3, 4]
+            cols = load_columns(f"{tmp}/sharded/step_columns")
+            single_cols = load_columns(f"{tmp}/single/step_columns")
+            for name in ("episode_id", "step_idx", "action", "collision", "target_visible"):
+                assert (cols[name] == single_cols[name]).all(), name
+    finally:
+        main_mod.make_env, main_mod.load_model, main_mod.multiprocessing = saved
+
+
+if __name__ == "__main__":
+    test_shard_specs_is_a_deterministic_round_robin()
+    test_merge_orders_interleaved_shards_by_episode_and_step()
+    test_run_sharded_matches_a_single_process_run()
+    print("shard tests passed")
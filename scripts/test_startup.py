@@ -0,0 +1,104 @@
+import subprocess
+import sys
+import threading
+import time
+
+from src.utils.startup import is_ithor_scene, start_concurrently, validate_config, validate_specs
+
+
+def test_importing_main_is_lazy() -> None:
+    code = (
+        "import sys, src.main; "
+        "print(','.join(m for m in ('torch', 'transformers', 'ai2thor', 'cv2') if m in sys.modules))"
+    )
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == ""
+
+
+def test_validation_reports_problems_up_front() -> None:
+    cfg = {
+        "run": {"num_episodes": 2, "episodes_file": "/nonexistent/episodes.json"},
+        "model": {"local_path": "/nonexistent/model", "action_decoding": "beam"},
+        "agent": {"action_space": ["MoveAhead", "Jump"]},
+        "rag": {"scope": "room"},
+        "headless": {},
+    }
+    problems = validate_config(cfg)
+    assert len(problems) == 5
+    assert validate_config({"run": {}}) == [
+        "missing section: model", "missing section: agent", "missing section: rag", "missing section: headless"
+    ]
+    assert is_ithor_scene("FloorPlan1") and is_ithor_scene("FloorPlan430_physics")
+    assert not is_ithor_scene("FloorPlan31") and not is_ithor_scene("Kitchen1")
+    specs = [{"episode_id": 0, "scene": "FloorPlan2", "target": "Mug"},
+             {"episode_id": 1, "scene": "FloorPlan99", "target": ""}]
+    assert len(validate_specs(specs)) == 2
+
+
+def test_start_concurrently_overlaps_and_fails_fast() -> None:
+    timings = {}
+    start = time.perf_counter()
+    results = start_concurrently({"a": lambda: time.sleep(0.2) or 1, "b": lambda: time.sleep(0.2) or 2}, timings)
+    assert results == {"a": 1, "b": 2}
+    assert time.perf_counter() - start < 0.35
+    assert set(timings) == {"a", "b"}
+
+    release = threading.Event()
+
+    def broken():
+        raise RuntimeError("unity failed")
+
+    start = time.perf_counter()
+    try:
+        start_concurrently({"slow": lambda: release.wait(5), "env": broken}, {})
+    except RuntimeError as exc:
+        assert str(exc) == "unity failed"
+    else:
+        raise AssertionError("expected the env failure")
+    assert time.perf_counter() - start < 1.0
+    release.set()
+
+
+def test_failed_startup_releases_the_other_jobs_results() -> None:
+    closed = []
+    cleanup = {"env": closed.append, "model": closed.append}
+    timings = {}
+    release = threading.Event()
+
+    def model_fails_after_envs():
+        while "env" not in timings:  # set once the env result is recorded
+            time.sleep(0.01)
+        raise RuntimeError("no checkpoint")
+
+    try:
+        start_concurrently({"model": model_fails_after_envs, "env": lambda: "env-ready"}, timings, cleanup)
+    except RuntimeError:
+        pass
+    assert closed == ["env-ready"]
+
+    def slow_env():
+        release.wait(5)
+        return "env-late"
+
+    def broken():
+        raise RuntimeError("no checkpoint")
+
+    closed.clear()
+    try:
+        start_concurrently({"env": slow_env, "model": broken}, {}, cleanup)
+    except RuntimeError:
+        pass
+    assert closed == []
+    release.set()
+    deadline = time.perf_counter() + 5
+    while not closed and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    assert closed == ["env-late"]
+
+
+if __name__ == "__main__":
+    test_importing_main_is_lazy()
+    test_validation_reports_problems_up_front()
+    test_start_concurrently_overlaps_and_fails_fast()
+    test_failed_startup_releases_the_other_jobs_results()
+    print("startup tests passed")
@@ -0,0 +1,80 @@
+import copy
+import json
+import os
+import tempfile
+
+import src.main as main_mod
+from scripts.test_resume import CrashingEnv, RunModel
+from scripts.test_vector_runner import CFG, TEMPLATE, _specs
+from src.main import compute_metrics, run_local, run_sweep
+from src.utils.sweep import expand_grid, load_sweep
+
+
+def _cfg(num_envs=1):
+    cfg = copy.deepcopy(CFG)
+    cfg["run"]["num_envs"] = num_envs
+    cfg["rag"] = dict(cfg["rag"], scope="global")
+    return cfg
+
+
+def test_grid_expansion() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = f"{tmp}/sweep.yaml"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("grid:\n  rag.top_k: [1, 3]\n  rag.memory_types_enabled: [[PLACE], [PLACE, LOC]]\n"
+                    "  agent.history_k: [2, 6, 8]\n")
+        variants = expand_grid(_cfg(), load_sweep(path))
+        assert len(variants) == 12
+        overrides, cfg = variants[1]
+        assert overrides == {"rag.top_k": 1, "rag.memory_types_enabled": ["PLACE"], "agent.history_k": 6}
+        assert cfg["rag"]["top_k"] == 1 and cfg["agent"]["history_k"] == 6
+        assert CFG["agent"]["history_k"] == 6 and CFG["rag"]["top_k"] == 3
+        for bad in ("grid:\n  model.device: [cpu, cuda]\n", "grid:\n  rag.top_k: []\n",
+                    "grid:\n  agent.action_space: [[Stop]]\n"):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(bad)
+            try:
+                load_sweep(path)
+            except ValueError:
+                continue
+            raise AssertionError(bad)
+
+
+def test_sweep_matches_separate_runs() -> None:
+    specs = _specs(4)
+    grid = {"rag.top_k": [1, 3], "agent.history_k": [2, 6]}
+    make_env, load_model = main_mod.make_env, main_mod.load_model
+    main_mod.make_env = lambda cfg, scene, log: CrashingEnv()
+    models = []
+    main_mod.load_model = lambda cfg: models.append(RunModel()) or models[-1]
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for num_envs in (1, 3):
+                out = f"{tmp}/sweep_{num_envs}"
+                os.makedirs(out)
+                rows = run_sweep(_cfg(num_envs), expand_grid(_cfg(num_envs), grid), specs, out, TEMPLATE)
+                assert [row["variant"] for row in rows] == ["v00", "v01", "v02", "v03"]
+                with open(f"{out}/sweep.json", encoding="utf-8") as f:
+                    sweep = json.load(f)
+                assert sweep["vector"]["max_batch"] == num_envs
+                with open(f"{out}/sweep_table.md", encoding="utf-8") as f:
+                    assert len(f.read().splitlines()) == 2 + len(rows)
+            assert len(models) == 2  # one model per sweep, not per variant
+
+            for row, (_, variant_cfg) in zip(rows, expand_grid(_cfg(), grid)):
+                single = f"{tmp}/single_{row['variant']}"
+                os.makedirs(single)
+                summaries, _ = run_local(variant_cfg, specs, single, TEMPLATE)
+                with open(f"{tmp}/sweep_1/variants/{row['variant']}/metrics.json", encoding="utf-8") as f:
+                    metrics = json.load(f)
+                expected = compute_metrics(summaries)
+                assert metrics["nav"] == expected["nav"]
+                assert metrics["hallucinations"] == expected["hallucinations"]
+    finally:
+        main_mod.make_env, main_mod.load_model = make_env, load_model
+
+
+if __name__ == "__main__":
+    test_grid_expansion()
+    test_sweep_matches_separate_runs()
+    print("sweep tests passed")
@@ -0,0 +1,296 @@
+import copy
+import json
+import os
+import tempfile
+from types import SimpleNamespace
+
+import numpy as np
+
+from src.agent.loop import run_episode
+from src.agent.selector import select_action, vote_candidates
+from src.agent.vector_runner import run_vectorized
+from src.rag.namespaces import RagNamespaces
+from src.utils.episodes import apply_episode, build_episode_spec
+from src.utils.archive import ArchiveReader
+from src.utils.logging import AsyncWriter
+
+CFG = {
+    "run": {"max_steps": 12, "success_distance": 1.0, "scenes": ["FloorPlan1", "FloorPlan2"],
+            "target_objects": ["mug", "chair", "apple"]},
+    "agent": {"history_k": 6, "action_space": ["MoveAhead", "RotateLeft", "RotateRight", "LookUp", "LookDown", "Stop"],
+              "safe_fallback": "RotateRight"},
+    "rag": {"mode": "retrieve", "top_k": 3, "memory_types_enabled": ["PLACE", "LOC"], "scope": "episode"},
+    "logging": {},
+}
+TEMPLATE = "Target: {target}\nRecent: {trajectory}\nRAG: {rag_snippets}\n"
+
+
+class FakeEnv:
+    width = 8
+    height = 8
+
+    def __init__(self) -> None:
+        self.scene = "FloorPlan1"
+        self.t = 0
+
+    def _event(self, success: bool = True):
+        frame = np.full((self.height, self.width, 3), self.t % 255, dtype=np.uint8)
+        objects = [{"objectType": "Mug", "visible": self.t >= 5, "distance": 0.5, "boundingBox": None}]
+        return SimpleNamespace(frame=frame, metadata={"lastActionSuccess": success, "objects": objects})
+
+    def reset(self, scene=None, start_pose=None):
+        self.scene = scene or self.scene
+        self.t = 0
+        return self._event()
+
+    def step(self, action):
+        self.t += 1
+        return self._event(success=self.t % 4 != 0)
+
+    def get_frame(self, event):
+        return event.frame
+
+    def list_visible(self, event, target, fields=None):
+        for obj in event.metadata["objects"]:
+            if obj["visible"] and obj["objectType"].lower() == target.lower():
+                return {"target_visible": True, "target_bbox": None, "target_distance": obj["distance"]}
+        return {"target_visible": False, "target_bbox": None, "target_distance": None}
+
+
+class FakeModel:
+    """Deterministic answers keyed on frame content and prompt, plus call accounting."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.batch_sizes = []
+
+    def _answer(self, frame, prompt):
+        t = int(frame[0, 0, 0])
+        if prompt.startswith("Target:") and "LMK=" in prompt:
+            return f"LMK=chair, lamp{t % 3}; SEEN={'yes' if t >= 5 else 'no'}; LOC=kitchen"
+        if t >= 6 and "mug" in prompt:
+            return "ACTION=Stop"
+        return "ACTION=" + ["MoveAhead", "RotateLeft", "MoveAhead", "LookDown"][t % 4]
+
+    def preprocess(self, frame):
+        return {"pixel_values": frame}
+
+    def generate_with_debug(self, frame, prompt, max_new_tokens=256, prefix=None):
+        self.calls += 1
+        text = self._answer(frame, prompt)
+        return text, {"full_text": text}
+
+    def generate_batch(self, frames, prompts, max_new_tokens=256, prefix=None):
+        self.calls += 1
+        self.batch_sizes.append(len(frames))
+        return [(self._answer(f, p), {"full_text": self._answer(f, p)}) for f, p in zip(frames, prompts)]
+
+    def score_actions_batch(self, frames, prompts, actions, prefix=None):
+        self.calls += 1
+        results = []
+        for frame, prompt in zip(frames, prompts):
+            best = self._answer(frame, prompt).split("=", 1)[1]
+            candidates = [{"action": a, "logprob": 0.0 if a == best else -5.0,
+                           "confidence": 0.9 if a == best else 0.02} for a in actions]
+            results.append((candidates, {"full_text": f"ACTION={best}"}))
+        return results
+
+    def generate_candidates_batch(self, frames, prompts, n, max_new_tokens=256, prefix=None):
+        self.calls += 1
+        results = []
+        for frame, prompt in zip(frames, prompts):
+            best = self._answer(frame, prompt)
+            texts = [best, "ACTION=RotateRight", best, "no action"][:n]
+            candidates = [{"text": t, "logprob": -1.0, "confidence": 1.0 / n, "latency_s": 0.0} for t in texts]
+            results.append((candidates, {"full_text": texts[0]}))
+        return results
+
+    def generate_candidates(self, frame, prompt, n, max_new_tokens=256, prefix=None):
+        return self.generate_candidates_batch([frame], [prompt], n, max_new_tokens, prefix)[0]
+
+    def score_actions(self, frame, prompt, actions, prefix=None):
+        return self.score_actions_batch([frame], [prompt], actions, prefix)[0]
+
+    def generate_chained(self, frame, first_prompt, make_followup, first_max_new_tokens=32, max_new_tokens=256):
+        self.calls += 1
+        first = self._answer(frame, first_prompt)
+        followup = make_followup(first)
+        if followup is None:
+            return (first, {}), None
+        second = self._answer(frame, followup)
+        return (first, {}), (second, {"full_text": second})
+
+
+def _strip_timings(result):
+    summary = {k: v for k, v in result["summary"].items() if k != "timings"}
+    steps = [{k: v for k, v in step.items() if k != "timings"} for step in result["steps"]]
+    return {"steps": steps, "summary": summary}
+
+
+def _specs(n):
+    return [build_episode_spec(CFG, None, idx) for idx in range(n)]
+
+
+def test_vectorized_matches_sequential() -> None:
+    specs = _specs(5)
+    with tempfile.TemporaryDirectory() as tmp:
+        seq_model = FakeModel()
+        seq_ns = RagNamespaces(f"{tmp}/seq", CFG["rag"])
+        expected = {}
+        for spec in specs:
+            cfg = apply_episode(copy.deepcopy(CFG), spec)
+            result = run_episode(cfg, FakeEnv(), seq_model, TEMPLATE, seq_ns.get(spec["scene"], spec["episode_id"]),
+                                 f"{tmp}/seq", episode_id=spec["episode_id"], scene=spec["scene"])
+            seq_ns.release(spec["scene"], spec["episode_id"])
+            expected[spec["episode_id"]] = result
+
+        vec_model = FakeModel()
+        started = []
+        results, stats = run_vectorized(
+            CFG, [FakeEnv() for _ in range(3)], vec_model, TEMPLATE, RagNamespaces(f"{tmp}/vec", CFG["rag"]),
+            f"{tmp}/vec", specs, on_start=lambda spec: started.append(spec["episode_id"]),
+        )
+        assert sorted(started) == [0, 1, 2, 3, 4]
+        assert {r["summary"]["episode_id"]: _strip_timings(r) for r in results} == {
+            k: _strip_timings(v) for k, v in expected.items()
+        }
+        assert stats["max_batch"] == 3
+        assert vec_model.calls < seq_model.calls
+
+
+def test_pipelined_io_writes_same_logs() -> None:
+    spec = _specs(1)[0]
+    outputs = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for enabled in (False, True):
+            cfg = apply_episode(copy.deepcopy(CFG), spec)
+            cfg["pipeline"] = {"enabled": enabled}
+            cfg["logging"] = {"debug_save_vlm_raw": True, "debug_save_rag_hits": True}
+            out = f"{tmp}/{enabled}"
+            ns = RagNamespaces(out, cfg["rag"])
+            result = run_episode(cfg, FakeEnv(), FakeModel(), TEMPLATE, ns.get(spec["scene"], 0), out, scene=spec["scene"])
+            assert ("io_busy" in result["summary"]["timings"]) == enabled
+            with open(f"{out}/steps.jsonl", encoding="utf-8") as f:
+                outputs[enabled] = [_strip_timings({"steps": [json.loads(line)], "summary": {}}) for line in f]
+            with open(f"{out}/debug/rag_hits/step_00003.json", encoding="utf-8") as f:
+                outputs[(enabled, "hits")] = f.read()
+    assert outputs[True] == outputs[False]
+    assert outputs[(True, "hits")] == outputs[(False, "hits")]
+
+
+def test_async_writer_logs_match_direct_writes() -> None:
+    spec = _specs(1)[0]
+    outputs = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for buffered in (False, True):
+            cfg = apply_episode(copy.deepcopy(CFG), spec)
+            cfg["logging"] = {"debug_save_vlm_raw": True, "debug_save_rag_hits": True}
+            out = f"{tmp}/{buffered}"
+            writer = AsyncWriter(max_batch=4) if buffered else None
+            ns = RagNamespaces(out, cfg["rag"])
+            run_episode(cfg, FakeEnv(), FakeModel(), TEMPLATE, ns.get(spec["scene"], 0), out,
+                        scene=spec["scene"], writer=writer)
+            if writer is not None:
+                writer.close()
+                assert writer.stats["records"] > writer.stats["batches"] >= 1
+                assert writer.stats["fsyncs"] >= 1
+            with open(f"{out}/steps.jsonl", encoding="utf-8") as f:
+                outputs[buffered] = [_strip_timings({"steps": [json.loads(line)], "summary": {}}) for line in f]
+            with open(f"{out}/debug/rag_hits/step_00003.json", encoding="utf-8") as f:
+                outputs[(buffered, "hits")] = f.read()
+        assert outputs[True] == outputs[False]
+        assert outputs[(True, "hits")] == outputs[(False, "hits")]
+
+        writer = AsyncWriter()
+        path = f"{tmp}/mixed.txt"
+        writer.append(path, "a\n")
+        writer.write_file(path, "reset\n")
+        writer.append_jsonl(path, [{"x": 1}, {"x": 2}])
+        writer.flush()
+        with open(path, encoding="utf-8") as f:
+            assert f.read() == 'reset\n{"x": 1}\n{"x": 2}\n'
+        writer.close()
+
+
+def test_debug_archive_round_trips_debug_files() -> None:
+    spec = _specs(1)[0]
+    with tempfile.TemporaryDirectory() as tmp:
+        for archive in (False, True):
+            cfg = apply_episode(copy.deepcopy(CFG), spec)
+            cfg["logging"] = {"debug_save_vlm_raw": True, "debug_save_rag_hits": True, "archive": archive}
+            cfg["pipeline"] = {"enabled": archive}
+            out = f"{tmp}/{archive}"
+            ns = RagNamespaces(out, cfg["rag"])
+            run_episode(cfg, FakeEnv(), FakeModel(), TEMPLATE, ns.get(spec["scene"], 0), out, scene=spec["scene"])
+        assert not os.path.exists(f"{tmp}/True/debug/vlm_raw")
+        reader = ArchiveReader(f"{tmp}/True/debug/episode_000.rec")
+        names = reader.names()
+        assert "debug/rag_hits/step_00003.json" in reader and "debug/lmk_raw/episode_000/step_00000.txt" in names
+        with open(f"{tmp}/False/debug/rag_hits/step_00003.json", encoding="utf-8") as f:
+            assert reader.read_text("debug/rag_hits/step_00003.json") == f.read()
+        assert reader.extract(f"{tmp}/unpacked") == len(names)
+        for name in names:
+            with open(f"{tmp}/unpacked/{name}", encoding="utf-8") as a, open(f"{tmp}/False/{name}", encoding="utf-8") as b:
+                assert a.read() == b.read()
+        reader.close()
+        with open(f"{tmp}/True/debug/episode_000.rec.idx", "a", encoding="utf-8") as f:
+            f.write('{"name": "torn", "offs')
+        assert ArchiveReader(f"{tmp}/True/debug/episode_000.rec").names() == names
+
+
+def test_fused_mode_matches_two_calls() -> None:
+    spec = _specs(1)[0]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for fused in (False, True):
+            cfg = apply_episode(copy.deepcopy(CFG), spec)
+            cfg["model"] = {"fused_lmk_plan": fused}
+            out = f"{tmp}/{fused}"
+            model = FakeModel()
+            ns = RagNamespaces(out, cfg["rag"])
+            result = run_episode(cfg, FakeEnv(), model, TEMPLATE, ns.get(spec["scene"], 0), out, scene=spec["scene"],
+                                 prompt_prefix="Allowed Actions: MoveAhead, RotateLeft\n")
+            results[fused] = (_strip_timings(result), model.calls)
+    assert results[True][0] == results[False][0]
+    assert results[True][1] < results[False][1]
+
+
+def test_score_mode_matches_generate() -> None:
+    specs = _specs(3)
+    actions = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for decoding in ("generate", "score", "candidates"):
+            cfg = copy.deepcopy(CFG)
+            cfg["model"] = {"action_decoding": decoding, "n_candidates": 4}
+            out = f"{tmp}/{decoding}"
+            results, _ = run_vectorized(cfg, [FakeEnv() for _ in range(2)], FakeModel(), TEMPLATE,
+                                        RagNamespaces(out, cfg["rag"]), out, specs)
+            actions[decoding] = {r["summary"]["episode_id"]: [s["action"] for s in r["steps"]] for r in results}
+            scored = [s for r in results for s in r["steps"] if s["vlm_output"].get("candidates")]
+            assert bool(scored) == (decoding != "generate")
+    assert actions["score"] == actions["generate"]
+    assert actions["candidates"] == actions["generate"]
+
+
+def test_candidate_voting() -> None:
+    candidates = [
+        {"action": "RotateLeft", "confidence": 0.4},
+        {"action": "MoveAhead", "confidence": 0.35},
+        {"action": "MoveAhead", "confidence": 0.25},
+        {"action": None, "confidence": 0.9},
+    ]
+    votes = vote_candidates(candidates)
+    assert select_action(votes, "RotateRight") == "MoveAhead"
+    assert [v["votes"] for v in votes if v["action"] == "MoveAhead"] == [2]
+    assert select_action(vote_candidates([{"action": "Fly", "confidence": 1.0}]), "RotateRight") == "RotateRight"
+
+
+if __name__ == "__main__":
+    test_vectorized_matches_sequential()
+    test_pipelined_io_writes_same_logs()
+    test_async_writer_logs_match_direct_writes()
+    test_debug_archive_round_trips_debug_files()
+    test_fused_mode_matches_two_calls()
+    test_score_mode_matches_generate()
+    test_candidate_voting()
+    print("vector runner tests passed")
@@ -0,0 +1,47 @@
+from scripts.bench_list_visible import legacy_list_visible, synthetic_metadata
+from src.env.visibility import TARGET_FIELDS, ObjectIndex
+
+
+def test_index_matches_linear_scan() -> None:
+    events = synthetic_metadata(steps=50, num_objects=60, seed=1)
+    index = ObjectIndex(events[0]["objects"])
+    for metadata in events:
+        objects = metadata["objects"]
+        assert index.fits(objects)
+        for target in ("Mug", "mug", "STOVEBURNER", "Television"):
+            expected = legacy_list_visible(metadata, target)
+            assert index.lookup(objects, target, TARGET_FIELDS + ("visible",)) == expected
+            assert index.lookup(objects, target) == {k: expected[k] for k in TARGET_FIELDS}
+    assert "visible" not in index.lookup(events[0]["objects"], "Mug")
+
+
+def test_index_detects_changed_object_list() -> None:
+    objects = synthetic_metadata(steps=1, num_objects=20, seed=2)[0]["objects"]
+    index = ObjectIndex(objects)
+    target = objects[3]["objectType"]
+    assert not index.fits(objects[:-1])
+    swapped = list(objects)
+    swapped[3] = dict(objects[3], objectId="Other|99")
+    assert not index.fits(swapped)
+    try:
+        index.lookup(objects, target, ("target_color",))
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("unknown field accepted")
+
+
+def test_other_scene_with_same_object_count_rebuilds() -> None:
+    kitchen = [{"objectId": f"Cabinet|{i}", "objectType": "Cabinet", "visible": True} for i in range(10)]
+    bedroom = [{"objectId": f"Bed|{i}", "objectType": "Bed", "visible": i == 4} for i in range(10)]
+    index = ObjectIndex(kitchen)
+    assert "bed" not in index.rows
+    assert not index.fits(bedroom)
+    assert ObjectIndex(bedroom).lookup(bedroom, "Bed")["target_visible"] is True
+
+
+if __name__ == "__main__":
+    test_index_matches_linear_scan()
+    test_index_detects_changed_object_list()
+    test_other_scene_with_same_object_count_rebuilds()
+    print("visibility tests passed")
@@ -3,247 +3,381 @@ import json
 import os
 import re
 from collections import deque
-from typing import Deque, Dict, List
+from typing import TYPE_CHECKING, Deque, Dict, List, Optional
 
-from ..env.thor_objectnav_env import ThorObjectNavEnv
+from ..env.visibility import TARGET_FIELDS
 from ..rag.memory_types import build_dir, build_loc, build_place
-from ..rag.retrieval import retrieve
 from ..rag.store import RagStore
 from ..vlm.parsing import parse_action_line, safe_fallback
 from ..vlm.prompt_builder import build_prompt
-from ..vlm.qwen_vl_hf import QwenVLHF
 from .action_space import ACTIONS, make_action
+from .selector import select_action, vote_candidates
 from .trajectory import Trajectory
-from ..utils.images import save_frame
-from ..utils.logging import append_jsonl
-
-
-def run_episode(
-    cfg: Dict,
-    env: ThorObjectNavEnv,
-    model: QwenVLHF,
-    prompt_tmpl: str,
-    rag_store: RagStore,
-    output_dir: str,
-    episode_id: int = 0,
-    scene: str = "",
-    start_pose: Dict = None,
-) -> Dict:
-    traj = Trajectory(history_k=cfg["agent"]["history_k"])
-    max_steps = cfg["run"]["max_steps"]
-    action_space = cfg["agent"]["action_space"]
-    safe_fallback_action = cfg["agent"]["safe_fallback"]
-    rag_cfg = cfg["rag"]
-    rag_types = rag_cfg.get("memory_types_enabled", [])
-    rag_top_k = rag_cfg.get("top_k", 3)
-    log_cfg = cfg.get("logging", {})
-    save_frames = bool(log_cfg.get("save_frames", False))
-    frame_stride = int(log_cfg.get("frame_stride", 1))
-    save_video = bool(log_cfg.get("save_video", False))
-    debug_save_vlm_raw = bool(log_cfg.get("debug_save_vlm_raw", False))
-    debug_save_rag_hits = bool(log_cfg.get("debug_save_rag_hits", False))
-    debug_save_env_meta_full = bool(log_cfg.get("debug_save_env_meta_full", False))
-    frames_dir = os.path.join(output_dir, "frames", f"episode_{episode_id:03d}")
-    video_dir = os.path.join(output_dir, "videos")
-    debug_dir = os.path.join(output_dir, "debug")
-    steps_path = os.path.join(output_dir, "steps.jsonl")
-    vlm_raw_dir = os.path.join(debug_dir, "vlm_raw")
-    lmk_raw_dir = os.path.join(debug_dir, "lmk_raw", f"episode_{episode_id:03d}")
-    rag_hits_dir = os.path.join(debug_dir, "rag_hits")
-    env_meta_dir = os.path.join(debug_dir, "env_meta")
-    if save_frames:
-        os.makedirs(frames_dir, exist_ok=True)
-    if debug_save_vlm_raw:
-        os.makedirs(vlm_raw_dir, exist_ok=True)
-        os.makedirs(lmk_raw_dir, exist_ok=True)
-    if debug_save_rag_hits:
-        os.makedirs(rag_hits_dir, exist_ok=True)
-    if debug_save_env_meta_full:
-        os.makedirs(env_meta_dir, exist_ok=True)
-    video_writer = None
-    if save_video:
-        os.makedirs(video_dir, exist_ok=True)
-        video_path = os.path.join(video_dir, f"episode_{episode_id:03d}.mp4")
-        import cv2
-
-        fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-        video_writer = cv2.VideoWriter(video_path, fourcc, 10, (env.width, env.height))
-
-    if scene:
-        event = env.reset(scene=scene, start_pose=start_pose)
-    else:
-        event = env.reset(env.scene, start_pose=start_pose)
-    target_object_type = cfg.get("target_object_type", cfg["target"])
-    target_prompt = cfg.get("target_prompt", cfg["target"])
-    start_visible = env.list_visible(event, target_object_type)
-    start_distance = start_visible.get("target_distance")
-    if start_distance is None:
-        start_distance = float(cfg["run"].get("success_distance", 1.0))
-    steps: List[Dict] = []
-    collisions = 0
-    overconfident_stop = 0
-    failed_move_ahead = 0
-    last_actions: Deque[str] = deque(maxlen=8)
-    last_collisions: Deque[bool] = deque(maxlen=8)
-    turn_toggle = False
-
-    def turn_bias(actions: List[str]) -> str:
-        left = actions.count("RotateLeft")
-        right = actions.count("RotateRight")
-        if left == right:
-            return "neutral"
-        return "left" if left > right else "right"
-
-    def truncate_snippet(text: str) -> str:
-        lines = [line.strip() for line in text.splitlines() if line.strip()]
-        snippet = "\n".join(lines[:2])
-        return snippet[:220]
-
-    def extract_lmk_list(raw_text: str) -> List[str]:
-        match = re.search(r"LMK\s*[:=]\s*(.*)", raw_text, re.IGNORECASE)
-        if not match:
-            return []
-        payload = match.group(1).splitlines()[0].strip()
-        if ";" in payload:
-            payload = payload.split(";", 1)[0].strip()
-        if not payload or payload.lower() == "none":
-            return []
-        items = [item.strip() for item in payload.split(",") if item.strip()]
-        return items[:5]
-
-    def extract_seen_flag(raw_text: str):
-        match = re.search(r"SEEN\s*[:=]\s*(yes|no|true|false)", raw_text, re.IGNORECASE)
-        if not match:
-            return None
-        val = match.group(1).lower()
-        return val in ("yes", "true")
-
-    def extract_loc(raw_text: str) -> str:
-        match = re.search(r"LOC\s*[:=]\s*([^;\\n]+)", raw_text, re.IGNORECASE)
-        if not match:
-            return ""
-        loc = match.group(1).strip()
-        return loc if loc.lower() != "none" else ""
-
-    stoplist = {
-    }
-
-    def normalize_lmk(text: str) -> str:
-        cleaned = re.sub(r"\\s*\\(.*?\\)\\s*", "", text)
-        cleaned = re.sub(r"[^a-zA-Z0-9\\s]", "", cleaned)
-        return cleaned.strip().lower()
-
-    def is_stop_lmk(text: str) -> bool:
-        norm = normalize_lmk(text)
-        if not norm:
-            return True
-        if norm in stoplist:
-            return True
-        if norm.endswith((" wall", " floor", " ceiling", " baseboard")):
-            return True
-        return False
-    def format_rag_snippets_merged(hits: List[Dict]) -> List[str]:
-        place_payload = None 
-        loc_payload = None
-        rest = []
-
-        for h in hits:
-            t = (h.get("text") or "").strip()
-            if t.startswith("PLACE:") and place_payload is None:
-                p = t.replace("PLACE:", "", 1).strip()
-                if p.lower() != "none":
-                    place_payload = p
-                continue
-            if t.startswith("LOC:") and loc_payload is None:
-                l = t.replace("LOC:", "", 1).strip()
-                if l.lower() != "none":
-                    loc_payload = l
-                continue
-            rest.append(t)
-
-        snippets = []
-
-        if place_payload and loc_payload:
-            snippets.append(
-                f"Memory: In {loc_payload}, these landmarks are near each other: {place_payload}."
-            )
-        elif place_payload:
-            snippets.append(
-                f"Memory: these landmarks are near each other: {place_payload}."
-            )
-        elif loc_payload:
-            snippets.append(
-                f"Memory: location hint is {loc_payload}."
+from ..utils.archive import DebugArchive
+from ..utils.frame_encoder import FrameEncoder
+from ..utils.logging import AsyncWriter
+from ..utils.pipeline import BackgroundWorker, StageTimer
+
+if TYPE_CHECKING:
+    from ..env.thor_objectnav_env import ThorObjectNavEnv
+    from ..vlm.qwen_vl_hf import QwenVLHF
+
+LMK_MAX_NEW_TOKENS = 32
+PLANNER_MAX_NEW_TOKENS = 256
+
+
+def turn_bias(actions: List[str]) -> str:
+    left = actions.count("RotateLeft")
+    right = actions.count("RotateRight")
+    if left == right:
+        return "neutral"
+    return "left" if left > right else "right"
+
+
+def truncate_snippet(text: str) -> str:
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    snippet = "\n".join(lines[:2])
+    return snippet[:220]
+
+
+def extract_lmk_list(raw_text: str) -> List[str]:
+    match = re.search(r"LMK\s*[:=]\s*(.*)", raw_text, re.IGNORECASE)
+    if not match:
+        return []
+    payload = match.group(1).splitlines()[0].strip()
+    if ";" in payload:
+        payload = payload.split(";", 1)[0].strip()
+    if not payload or payload.lower() == "none":
+        return []
+    items = [item.strip() for item in payload.split(",") if item.strip()]
+    return items[:5]
+
+
+def extract_seen_flag(raw_text: str):
+    match = re.search(r"SEEN\s*[:=]\s*(yes|no|true|false)", raw_text, re.IGNORECASE)
+    if not match:
+        return None
+    val = match.group(1).lower()
+    return val in ("yes", "true")
+
+
+def extract_loc(raw_text: str) -> str:
+    match = re.search(r"LOC\s*[:=]\s*([^;\\n]+)", raw_text, re.IGNORECASE)
+    if not match:
+        return ""
+    loc = match.group(1).strip()
+    return loc if loc.lower() != "none" else ""
+
+
+stoplist = {
+}
+
+
+def normalize_lmk(text: str) -> str:
+    cleaned = re.sub(r"\\s*\\(.*?\\)\\s*", "", text)
+    cleaned = re.sub(r"[^a-zA-Z0-9\\s]", "", cleaned)
+    return cleaned.strip().lower()
+
+
+def is_stop_lmk(text: str) -> bool:
+    norm = normalize_lmk(text)
+    if not norm:
+        return True
+    if norm in stoplist:
+        return True
+    if norm.endswith((" wall", " floor", " ceiling", " baseboard")):
+        return True
+    return False
+
+
+def format_rag_snippets_merged(hits: List[Dict]) -> List[str]:
+    place_payload = None
+    loc_payload = None
+    rest = []
+
+    for h in hits:
+        t = (h.get("text") or "").strip()
+        if t.startswith("PLACE:") and place_payload is None:
+            p = t.replace("PLACE:", "", 1).strip()
+            if p.lower() != "none":
+                place_payload = p
+            continue
+        if t.startswith("LOC:") and loc_payload is None:
+            l = t.replace("LOC:", "", 1).strip()
+            if l.lower() != "none":
+                loc_payload = l
+            continue
+        rest.append(t)
+
+    snippets = []
+
+    if place_payload and loc_payload:
+        snippets.append(
+            f"Memory: In {loc_payload}, these landmarks are near each other: {place_payload}."
+        )
+    elif place_payload:
+        snippets.append(
+            f"Memory: these landmarks are near each other: {place_payload}."
+        )
+    elif loc_payload:
+        snippets.append(
+            f"Memory: location hint is {loc_payload}."
+        )
+
+    for t in rest:
+        snippets.append(format_rag_snippet(t))
+
+    return snippets
+
+
+def format_rag_snippet(text: str) -> str:
+    if text.startswith("PLACE:"):
+        payload = text.replace("PLACE:", "", 1).strip()
+        return f"Memory: these landmarks are near each other: {payload}."
+    if text.startswith("LOC:"):
+        payload = text.replace("LOC:", "", 1).strip()
+        return f"Memory: location hint is {payload}."
+    if text.startswith("DIR:"):
+        payload = text.replace("DIR:", "", 1).strip()
+        return f"Memory: {payload}."
+    return truncate_snippet(text)
+
+
+def _write_text(path: str, text: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def _append_text(path: str, text: str) -> None:
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(text)
+
+
+def build_lmk_prompt(target_prompt: str) -> str:
+    return (
+        f"Target: {target_prompt}. "
+        "List up to 5 prominent objects you can see in the image, "
+        "and a short location hint (e.g., kitchen, bedroom). "
+        "and target object visibility."
+        "Return exactly one line: "
+        "LMK=<comma-separated objects or none>; SEEN=<yes/no>; LOC=<short location or none>"
+    )
+
+
+class EpisodeRunner:
+    """One episode as a step-wise state machine, independent of the model.
+
+    Each step is `observe()` -> landmark prompt (None unless rag.mode is
+    retrieve), `plan(lmk_raw)` -> planner prompt (None when a loop-breaker
+    fires), `act(raw, vlm_debug)`. `run_episode` answers the prompts with one
+    model call at a time; `vector_runner` batches them across environments.
+
+    With `pipeline.enabled`, frame/video encoding and every file write run on
+    a background thread while the next step proceeds. Records are serialized
+    on the caller's thread first, so later mutation (e.g. eval annotation)
+    cannot leak into the files. With a shared `writer` (`AsyncWriter`), text
+    logs go to its buffered thread instead. `timer` holds per-stage
+    wall-clock seconds.
+    """
+
+    def __init__(
+        self,
+        cfg: Dict,
+        env: "ThorObjectNavEnv",
+        prompt_tmpl: str,
+        rag_store: RagStore,
+        output_dir: str,
+        episode_id: int = 0,
+        scene: str = "",
+        start_pose: Dict = None,
+        prompt_prefix: str = "",
+        writer: Optional[AsyncWriter] = None,
+    ) -> None:
+        self.cfg = cfg
+        self.writer = writer
+        self.env = env
+        self.prompt_tmpl = prompt_tmpl
+        self.prompt_prefix = prompt_prefix
+        self.rag_store = rag_store
+        self.episode_id = episode_id
+        self.scene = scene
+        self.start_pose = start_pose
+        self.traj = Trajectory(history_k=cfg["agent"]["history_k"])
+        self.max_steps = cfg["run"]["max_steps"]
+        self.action_space = cfg["agent"]["action_space"]
+        self.safe_fallback_action = cfg["agent"]["safe_fallback"]
+        # Actions offered to `score_actions` when model.action_decoding is "score".
+        self.candidate_actions = [a for a in self.action_space if a in ACTIONS]
+        self.rag_cfg = cfg["rag"]
+        self.rag_types = self.rag_cfg.get("memory_types_enabled", [])
+        self.rag_top_k = self.rag_cfg.get("top_k", 3)
+        log_cfg = cfg.get("logging", {})
+        self.save_frames = bool(log_cfg.get("save_frames", False))
+        self.frame_stride = int(log_cfg.get("frame_stride", 1))
+        save_video = bool(log_cfg.get("save_video", False))
+        self.debug_save_vlm_raw = bool(log_cfg.get("debug_save_vlm_raw", False))
+        self.debug_save_rag_hits = bool(log_cfg.get("debug_save_rag_hits", False))
+        self.debug_save_env_meta_full = bool(log_cfg.get("debug_save_env_meta_full", False))
+        # The full visible-object list is only built when it is dumped.
+        self.visible_fields = TARGET_FIELDS + ("visible",) if self.debug_save_env_meta_full else TARGET_FIELDS
+        self.frames_dir = os.path.join(output_dir, "frames", f"episode_{episode_id:03d}")
+        video_dir = os.path.join(output_dir, "videos")
+        debug_dir = os.path.join(output_dir, "debug")
+        self.steps_path = os.path.join(output_dir, "steps.jsonl")
+        self.vlm_raw_dir = os.path.join(debug_dir, "vlm_raw")
+        self.lmk_raw_dir = os.path.join(debug_dir, "lmk_raw", f"episode_{episode_id:03d}")
+        self.rag_hits_dir = os.path.join(debug_dir, "rag_hits")
+        self.env_meta_dir = os.path.join(debug_dir, "env_meta")
+        self.output_dir = output_dir
+        debug_any = self.debug_save_vlm_raw or self.debug_save_rag_hits or self.debug_save_env_meta_full
+        # logging.archive packs frames and debug dumps into debug/episode_XXX.rec
+        # (same relative names, see utils/archive.py) instead of one file each.
+        self.archive = None
+        if log_cfg.get("archive") and (self.save_frames or debug_any):
+            self.archive = DebugArchive(os.path.join(debug_dir, f"episode_{episode_id:03d}.rec"))
+        else:
+            if self.debug_save_vlm_raw:
+                os.makedirs(self.vlm_raw_dir, exist_ok=True)
+                os.makedirs(self.lmk_raw_dir, exist_ok=True)
+            if self.debug_save_rag_hits:
+                os.makedirs(self.rag_hits_dir, exist_ok=True)
+            if self.debug_save_env_meta_full:
+                os.makedirs(self.env_meta_dir, exist_ok=True)
+        self.timer = StageTimer()
+        pipeline_cfg = cfg.get("pipeline", {}) or {}
+        self.io = BackgroundWorker(f"episode_{episode_id:03d}_io") if pipeline_cfg.get("enabled") else None
+        # Frames and video are encoded on the encoder's own thread.
+        self.encoder = None
+        if self.save_frames or save_video:
+            self.encoder = FrameEncoder(
+                frames_dir=self.frames_dir if self.save_frames else None,
+                video_path=os.path.join(video_dir, f"episode_{episode_id:03d}.mp4") if save_video else None,
+                archive=self.archive,
+                archive_root=output_dir,
+                image_format=log_cfg.get("frame_format", "png"),
+                jpeg_quality=log_cfg.get("jpeg_quality", 90),
+                scale=log_cfg.get("frame_scale", 1.0),
+                codec=log_cfg.get("video_codec", "mp4v"),
+                fps=log_cfg.get("video_fps", 10),
+                skip_unchanged=bool(log_cfg.get("skip_unchanged_frames", False)),
+                maxsize=int(log_cfg.get("encoder_queue", 64)),
+                drop_when_full=bool(log_cfg.get("drop_frames_when_full", False)),
             )
 
-        for t in rest:
-            snippets.append(format_rag_snippet(t))
-
-        return snippets
-
-
-    def format_rag_snippet(text: str) -> str:
-        if text.startswith("PLACE:"):
-            payload = text.replace("PLACE:", "", 1).strip()
-            return f"Memory: these landmarks are near each other: {payload}."
-        if text.startswith("LOC:"):
-            payload = text.replace("LOC:", "", 1).strip()
-            return f"Memory: location hint is {payload}."
-        if text.startswith("DIR:"):
-            payload = text.replace("DIR:", "", 1).strip()
-            return f"Memory: {payload}."
-        return truncate_snippet(text)
-    for step_idx in range(max_steps):
-        frame = env.get_frame(event)
-        if save_frames and step_idx % max(1, frame_stride) == 0:
-            save_frame(os.path.join(frames_dir, f"step_{step_idx:05d}.png"), frame)
-        if video_writer is not None:
-            import cv2
-
-            video_writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
-        current_lmks = []
-        lmk_seen = None
-        lmk_raw = ""
-        lmk_preview = ""
-        query = f"target={target_prompt} lmk=none"
-        rag_snippets = []
-        rag_hit_ids = []
-        rag_hits = []
-        if rag_cfg.get("mode") == "retrieve":
-            lmk_prompt = (
-                f"Target: {target_prompt}. "
-                "List up to 5 prominent objects you can see in the image, "
-                "and a short location hint (e.g., kitchen, bedroom). "
-                "and target object visibility."
-                "Return exactly one line: "
-                "LMK=<comma-separated objects or none>; SEEN=<yes/no>; LOC=<short location or none>"
-            )
-            lmk_raw, _ = model.generate_with_debug(frame, lmk_prompt, max_new_tokens=32)
-            lmk_preview = lmk_raw[:120]
-            lmk_seen = extract_seen_flag(lmk_raw)
-            lmk_loc = extract_loc(lmk_raw)
+        self.target_object_type = cfg.get("target_object_type", cfg["target"])
+        self.target_prompt = cfg.get("target_prompt", cfg["target"])
+        self.steps: List[Dict] = []
+        self.collisions = 0
+        self.overconfident_stop = 0
+        self.failed_move_ahead = 0
+        self.last_actions: Deque[str] = deque(maxlen=8)
+        self.last_collisions: Deque[bool] = deque(maxlen=8)
+        self.turn_toggle = False
+        self.event = None
+        self.frame = None
+        self.step_idx = 0
+        self.action: Optional[str] = None
+        self.done = False
+        self.visible_info: Dict = {}
+        self.start_distance = None
+
+    @property
+    def finished(self) -> bool:
+        return self.done or self.step_idx >= self.max_steps
+
+    def _io(self, fn, *args) -> None:
+        with self.timer.stage("io_submit" if self.io is not None else "io"):
+            if self.io is not None:
+                self.io.submit(fn, *args)
+            else:
+                fn(*args)
+
+    def _write(self, path: str, text: str) -> None:
+        if self.archive is not None:
+            self._io(self.archive.add_text, os.path.relpath(path, self.output_dir), text)
+            return
+        if self.writer is None:
+            self._io(_write_text, path, text)
+            return
+        with self.timer.stage("io_submit"):
+            self.writer.write_file(path, text)
+
+    def _append(self, path: str, text: str) -> None:
+        if self.writer is None:
+            self._io(_append_text, path, text)
+            return
+        with self.timer.stage("io_submit"):
+            self.writer.append(path, text)
+
+    def start(self, initial_event=None) -> None:
+        """Reset the env, or adopt `initial_event` from a reset already done elsewhere."""
+        if initial_event is not None:
+            self.event = initial_event
+        elif self.scene:
+            self.event = self.env.reset(scene=self.scene, start_pose=self.start_pose)
+        else:
+            self.event = self.env.reset(self.env.scene, start_pose=self.start_pose)
+        self.visible_info = self.env.list_visible(self.event, self.target_object_type)
+        self.start_distance = self.visible_info.get("target_distance")
+        if self.start_distance is None:
+            self.start_distance = float(self.cfg["run"].get("success_distance", 1.0))
+
+    def observe(self) -> Optional[str]:
+        """Grab the frame for this step; return the landmark prompt if RAG retrieval is on."""
+        step_idx = self.step_idx
+        with self.timer.stage("get_frame"):
+            frame = self.env.get_frame(self.event)
+        self.frame = frame
+        if self.encoder is not None:
+            with self.timer.stage("frame_submit"):
+                self.encoder.submit(
+                    step_idx,
+                    frame,
+                    save_image=self.save_frames and step_idx % max(1, self.frame_stride) == 0,
+                    collided=bool(self.last_collisions and self.last_collisions[-1]),
+                )
+        self.current_lmks: List[str] = []
+        self.lmk_seen = None
+        self.lmk_loc = ""
+        self.lmk_preview = ""
+        self.query = f"target={self.target_prompt} lmk=none"
+        self.rag_snippets: List[str] = []
+        self.rag_hit_ids: List = []
+        self.rag_hits: List[Dict] = []
+        self.prompt = None
+        if self.rag_cfg.get("mode") == "retrieve":
+            return build_lmk_prompt(self.target_prompt)
+        return None
+
+    def plan(self, lmk_raw: Optional[str] = None) -> Optional[str]:
+        """Consume the landmark answer; return the planner prompt, or None on a loop-break."""
+        step_idx = self.step_idx
+        if lmk_raw is not None:
+            self.lmk_preview = lmk_raw[:120]
+            self.lmk_seen = extract_seen_flag(lmk_raw)
+            self.lmk_loc = extract_loc(lmk_raw)
             lmks = [item for item in extract_lmk_list(lmk_raw) if not is_stop_lmk(item)]
             seen = set()
-            current_lmks = []
             for item in lmks:
                 key = item.lower()
                 if key in seen:
                     continue
                 seen.add(key)
-                current_lmks.append(item)
-                if len(current_lmks) >= 5:
+                self.current_lmks.append(item)
+                if len(self.current_lmks) >= 5:
                     break
-            if current_lmks:
-                query = f"target={target_prompt} lmk={', '.join(current_lmks)}"
-            if debug_save_vlm_raw:
-                lmk_path = os.path.join(lmk_raw_dir, f"step_{step_idx:05d}.txt")
-                with open(lmk_path, "w", encoding="utf-8") as f:
-                    f.write(lmk_raw)
-            hits = retrieve(rag_store.all(), query, rag_top_k, rag_types)
-            rag_snippets = format_rag_snippets_merged(hits)
-            rag_hit_ids = [h.get("id") for h in hits]
-            rag_hits = hits
-
+            if self.current_lmks:
+                self.query = f"target={self.target_prompt} lmk={', '.join(self.current_lmks)}"
+            if self.debug_save_vlm_raw:
+                lmk_path = os.path.join(self.lmk_raw_dir, f"step_{step_idx:05d}.txt")
+                self._write(lmk_path, lmk_raw)
+            with self.timer.stage("retrieve"):
+                hits = self.rag_store.retrieve(self.query, self.rag_top_k, self.rag_types)
+            self.rag_snippets = format_rag_snippets_merged(hits)
+            self.rag_hit_ids = [h.get("id") for h in hits]
+            self.rag_hits = hits
+
+        last_actions = self.last_actions
         loop_break_action = None
         if len(last_actions) >= 4 and all(a == "RotateLeft" for a in list(last_actions)[-4:]):
             loop_break_action = "RotateRight"
@@ -255,34 +389,60 @@ def run_episode(
                 "LookUp",
                 "LookDown",
             }.issubset(set(tail)):
-                loop_break_action = "RotateLeft" if turn_toggle else "RotateRight"
-                turn_toggle = not turn_toggle
+                loop_break_action = "RotateLeft" if self.turn_toggle else "RotateRight"
+                self.turn_toggle = not self.turn_toggle
         moveahead_recent = [
             c
-            for a, c in zip(list(last_actions), list(last_collisions))
+            for a, c in zip(list(last_actions), list(self.last_collisions))
             if a == "MoveAhead"
         ]
         if len(moveahead_recent) >= 3 and all(moveahead_recent[-3:]):
-            loop_break_action = "RotateLeft" if turn_toggle else "RotateRight"
-            turn_toggle = not turn_toggle
+            loop_break_action = "RotateLeft" if self.turn_toggle else "RotateRight"
+            self.turn_toggle = not self.turn_toggle
 
+        self.loop_break_action = loop_break_action
         if loop_break_action:
-            action = loop_break_action
+            return None
+        self.prompt = build_prompt(
+            self.prompt_tmpl,
+            self.target_prompt,
+            self.action_space,
+            self.traj.summary(),
+            self.rag_snippets,
+        )
+        return self.prompt
+
+    def act(self, raw: str = "", vlm_debug: Optional[Dict] = None, candidates: Optional[List[Dict]] = None) -> bool:
+        """Apply the planner answer (ignored on a loop-break); return True once the episode ends.
+
+        With `candidates` (scored actions, or sampled answers with `text`,
+        each carrying `confidence`) the action is voted through
+        `select_action` instead of parsed from `raw`.
+        """
+        step_idx = self.step_idx
+        vlm_debug = vlm_debug or {}
+        if self.loop_break_action:
+            action = self.loop_break_action
             raw = ""
             vlm_output = {"action": action, "source": "loop_breaker"}
             loop_break_triggered = True
             planner_input_token_estimate = 0
         else:
-            prompt = build_prompt(
-                prompt_tmpl, target_prompt, action_space, traj.summary(), rag_snippets
-            )
-            planner_input_token_estimate = len(prompt.split())
-            raw, vlm_debug = model.generate_with_debug(frame, prompt)
-            parsed_action = parse_action_line(raw)
-            if parsed_action is None:
-                parsed_action = safe_fallback(safe_fallback_action)
-            action = parsed_action if parsed_action in ACTIONS else safe_fallback_action
-            vlm_output = {"action": action, "source": "planner"}
+            planner_input_token_estimate = len(self.prompt_prefix.split()) + len(self.prompt.split())
+            if candidates is not None:
+                for cand in candidates:
+                    if "action" not in cand:
+                        cand["action"] = parse_action_line(cand.get("text", ""))
+                action = select_action(vote_candidates(candidates), self.safe_fallback_action)
+                raw = next((c["text"] for c in candidates if c["action"] == action and "text" in c), raw)
+                raw = raw or f"ACTION={action}"
+                vlm_output = {"action": action, "source": "planner", "candidates": candidates}
+            else:
+                parsed_action = parse_action_line(raw)
+                if parsed_action is None:
+                    parsed_action = safe_fallback(self.safe_fallback_action)
+                action = parsed_action if parsed_action in ACTIONS else self.safe_fallback_action
+                vlm_output = {"action": action, "source": "planner"}
             loop_break_triggered = False
 
         if step_idx < 30:
@@ -294,73 +454,74 @@ def run_episode(
         if action == "Stop":
             done = True
         else:
-            event = env.step(action_dict)
+            with self.timer.stage("env_step"):
+                self.event = self.env.step(action_dict)
             done = False
+        event = self.event
 
-        visible_info = env.list_visible(event, target_object_type)
+        with self.timer.stage("list_visible"):
+            visible_info = self.env.list_visible(event, self.target_object_type, fields=self.visible_fields)
 
         last_success = bool(event.metadata.get("lastActionSuccess", True)) if not done else True
         collision = not last_success
         if collision:
-            collisions += 1
+            self.collisions += 1
         if action == "MoveAhead" and not last_success:
-            failed_move_ahead += 1
-        traj.add(action, last_success, collision, {"t": step_idx})
-        last_actions.append(action)
-        last_collisions.append(collision)
+            self.failed_move_ahead += 1
+        self.traj.add(action, last_success, collision, {"t": step_idx})
+        self.last_actions.append(action)
+        self.last_collisions.append(collision)
 
         memory_updates = []
+        rag_types = self.rag_types
         if "PLACE" in rag_types:
-            text = build_place(current_lmks)
-            rag_store.upsert(text, {"type": "PLACE"})
+            text = build_place(self.current_lmks)
+            self.rag_store.upsert(text, {"type": "PLACE", "episode_id": self.episode_id}, step=step_idx)
             memory_updates.append({"type": "PLACE", "text": text})
         if "LOC" in rag_types:
-            text = build_loc(lmk_loc)
-            rag_store.upsert(text, {"type": "LOC"})
+            text = build_loc(self.lmk_loc)
+            self.rag_store.upsert(text, {"type": "LOC", "episode_id": self.episode_id}, step=step_idx)
             memory_updates.append({"type": "LOC", "text": text})
         if "DIR" in rag_types:
             text = build_dir("unknown")
-            rag_store.upsert(text, {"type": "DIR"})
+            self.rag_store.upsert(text, {"type": "DIR", "episode_id": self.episode_id}, step=step_idx)
             memory_updates.append({"type": "DIR", "text": text})
 
         raw_preview = raw[:200]
         raw_hash = hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
         raw_full = None
-        if debug_save_vlm_raw:
+        if self.debug_save_vlm_raw:
             raw_full = vlm_debug.get("full_text", raw)
-            raw_path = os.path.join(vlm_raw_dir, f"step_{step_idx:05d}.txt")
-            with open(raw_path, "w", encoding="utf-8") as f:
-                f.write(raw_full)
-        if debug_save_rag_hits:
-            hits_path = os.path.join(rag_hits_dir, f"step_{step_idx:05d}.json")
-            with open(hits_path, "w", encoding="utf-8") as f:
-                json.dump(rag_hits, f, indent=2)
-        if debug_save_env_meta_full:
-            meta_path = os.path.join(env_meta_dir, f"step_{step_idx:05d}.json")
-            with open(meta_path, "w", encoding="utf-8") as f:
-                json.dump(visible_info, f, indent=2)
+            raw_path = os.path.join(self.vlm_raw_dir, f"step_{step_idx:05d}.txt")
+            self._write(raw_path, raw_full)
+        if self.debug_save_rag_hits:
+            hits_path = os.path.join(self.rag_hits_dir, f"step_{step_idx:05d}.json")
+            self._write(hits_path, json.dumps(self.rag_hits, indent=2))
+        if self.debug_save_env_meta_full:
+            meta_path = os.path.join(self.env_meta_dir, f"step_{step_idx:05d}.json")
+            self._write(meta_path, json.dumps(visible_info, indent=2))
 
         step_record = {
             "step_idx": step_idx,
-            "episode_id": episode_id,
-            "scene": env.scene,
-            "target_object_type": target_object_type,
-            "target_prompt": target_prompt,
+            "episode_id": self.episode_id,
+            "scene": self.env.scene,
+            "target_object_type": self.target_object_type,
+            "target_prompt": self.target_prompt,
             "action": action,
             "collision": collision,
             "vlm_output": vlm_output,
             "vlm_raw_preview": raw_preview,
             "vlm_raw_hash": raw_hash,
-            "lmk_preview": lmk_preview,
-            "lmk_list": current_lmks,
-            "target_seen_claim": lmk_seen,
-            "target_loc_claim": lmk_loc,
-            "rag_hit_ids": rag_hit_ids,
+            "lmk_preview": self.lmk_preview,
+            "lmk_list": self.current_lmks,
+            "target_seen_claim": self.lmk_seen,
+            "target_loc_claim": self.lmk_loc,
+            "rag_hit_ids": self.rag_hit_ids,
             "env_meta_for_eval_only": {
                 "target_visible": visible_info.get("target_visible"),
                 "target_bbox": visible_info.get("target_bbox"),
                 "target_distance": visible_info.get("target_distance"),
-                "frame_width": frame.shape[1],
+                "frame_width": self.frame.shape[1],
             },
             "memory_updates": memory_updates,
             "loop_break_triggered": loop_break_triggered,
@@ -368,35 +529,142 @@ def run_episode(
         }
         if raw_full is not None:
             step_record["vlm_raw"] = raw_full
-        steps.append(step_record)
-        append_jsonl(steps_path, [step_record])
-
-        if done:
-            break
+        step_record["timings"] = self.timer.next_step()
+        self.steps.append(step_record)
+        self._append(self.steps_path, json.dumps(step_record) + "\n")
+
+        self.action = action
+        self.visible_info = visible_info
+        self.done = done
+        self.step_idx += 1
+        return self.finished
+
+    def finish(self) -> Dict:
+        encoder_stats = None
+        if self.encoder is not None:
+            encoder_stats = self.encoder.close()
+            self.encoder = None
+        if self.archive is not None:
+            self._io(self.archive.close)
+            self.archive = None
+        timings = self.timer.totals()
+        if self.io is not None:
+            timings["io_wait"] = round(self.io.close(), 6)
+            timings["io_busy"] = round(self.io.busy_s, 6)
+            self.io = None
+
+        action = self.action
+        visible_info = self.visible_info
+        success = False
+        success_distance = float(self.cfg["run"].get("success_distance", 1.0))
+        if action == "Stop" and visible_info.get("target_visible"):
+            distance = visible_info.get("target_distance")
+            if distance is None:
+                success = True
+            else:
+                success = distance <= success_distance
+        if action == "Stop" and not success:
+            self.overconfident_stop += 1
+        episode_summary = {
+            "success": success,
+            "steps": len(self.steps),
+            "episode_id": self.episode_id,
+            "scene": self.env.scene,
+            "target_object_type": self.target_object_type,
+            "target_prompt": self.target_prompt,
+            "collisions": self.collisions,
+            "failed_move_ahead": self.failed_move_ahead,
+            "overconfident_stop": self.overconfident_stop,
+            "start_distance": self.start_distance,
+            "timings": timings,
+        }
+        if encoder_stats is not None:
+            episode_summary["frame_encoder"] = encoder_stats
+        return {"steps": self.steps, "summary": episode_summary}
 
-    if video_writer is not None:
-        video_writer.release()
 
-    success = False
-    success_distance = float(cfg["run"].get("success_distance", 1.0))
-    if action == "Stop" and visible_info.get("target_visible"):
-        distance = visible_info.get("target_distance")
-        if distance is None:
-            success = True
+def run_episode(
+    cfg: Dict,
+    env: "ThorObjectNavEnv",
+    model: "QwenVLHF",
+    prompt_tmpl: str,
+    rag_store: RagStore,
+    output_dir: str,
+    episode_id: int = 0,
+    scene: str = "",
+    start_pose: Dict = None,
+    initial_event=None,
+    prompt_prefix: str = "",
+    writer: Optional[AsyncWriter] = None,
+) -> Dict:
+    runner = EpisodeRunner(
+        cfg,
+        env,
+        prompt_tmpl,
+        rag_store,
+        output_dir,
+        episode_id=episode_id,
+        scene=scene,
+        start_pose=start_pose,
+        prompt_prefix=prompt_prefix,
+        writer=writer,
+    )
+    runner.start(initial_event)
+    model_cfg = cfg.get("model", {})
+    decoding = model_cfg.get("action_decoding", "generate")
+    n_candidates = int(model_cfg.get("n_candidates", 1))
+    fused = bool(model_cfg.get("fused_lmk_plan", False)) and decoding == "generate"
+
+    def fused_followup(lmk_raw: str) -> Optional[str]:
+        # The second turn comes after the image, so the static prefix is inlined.
+        prompt = runner.plan(lmk_raw)
+        return None if prompt is None else prompt_prefix + prompt
+    while not runner.finished:
+        lmk_prompt = runner.observe()
+        # Pixel tensors are cached per frame; both VLM calls of the step reuse them.
+        # Behind a response cache this is a no-op and only misses preprocess.
+        with runner.timer.stage("preprocess"):
+            model.preprocess(runner.frame)
+        if fused and lmk_prompt is not None:
+            # One image encode/prefill serves both turns; retrieval runs between them.
+            with runner.timer.stage("fused_vlm"):
+                _, planned = model.generate_chained(
+                    runner.frame,
+                    lmk_prompt,
+                    fused_followup,
+                    first_max_new_tokens=LMK_MAX_NEW_TOKENS,
+                    max_new_tokens=PLANNER_MAX_NEW_TOKENS,
+                )
+            if planned is None:
+                runner.act()
+            else:
+                runner.act(*planned)
+            continue
+        lmk_raw = None
+        if lmk_prompt is not None:
+            with runner.timer.stage("lmk_vlm"):
+                lmk_raw, _ = model.generate_with_debug(
+                    runner.frame, lmk_prompt, max_new_tokens=LMK_MAX_NEW_TOKENS
+                )
+        prompt = runner.plan(lmk_raw)
+        if prompt is None:
+            runner.act()
+        elif decoding == "score":
+            with runner.timer.stage("plan_vlm"):
+                candidates, vlm_debug = model.score_actions(
+                    runner.frame, prompt, runner.candidate_actions, prefix=prompt_prefix
+                )
+            runner.act(vlm_debug.get("full_text", ""), vlm_debug, candidates=candidates)
+        elif decoding == "candidates":
+            with runner.timer.stage("plan_vlm"):
+                candidates, vlm_debug = model.generate_candidates(
+                    runner.frame, prompt, n_candidates, max_new_tokens=PLANNER_MAX_NEW_TOKENS, prefix=prompt_prefix
+                )
+            runner.act(vlm_debug.get("full_text", ""), vlm_debug, candidates=candidates)
         else:
-            success = distance <= success_distance
-    if action == "Stop" and not success:
-        overconfident_stop += 1
-    episode_summary = {
-        "success": success,
-        "steps": len(steps),
-        "episode_id": episode_id,
-        "scene": env.scene,
-        "target_object_type": target_object_type,
-        "target_prompt": target_prompt,
-        "collisions": collisions,
-        "failed_move_ahead": failed_move_ahead,
-        "overconfident_stop": overconfident_stop,
-        "start_distance": start_distance,
-    }
-    return {"steps": steps, "summary": episode_summary}
+            with runner.timer.stage("plan_vlm"):
+                raw, vlm_debug = model.generate_with_debug(
+                    runner.frame, prompt, max_new_tokens=PLANNER_MAX_NEW_TOKENS, prefix=prompt_prefix
+                )
+            runner.act(raw, vlm_debug)
+    return runner.finish()
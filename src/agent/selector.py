@@ -3,6 +3,18 @@ from typing import Dict, List
 from .action_space import ACTIONS
 
 
+def vote_candidates(candidates: List[Dict]) -> List[Dict]:
+    """Merge candidates naming the same action, summing their confidence."""
+    votes: Dict[str, Dict] = {}
+    for cand in candidates:
+        action = cand.get("action")
+        if action not in votes:
+            votes[action] = {"action": action, "confidence": 0.0, "votes": 0}
+        votes[action]["confidence"] += float(cand.get("confidence", 0.0))
+        votes[action]["votes"] += 1
+    return list(votes.values())
+
+
 def select_action(candidates: List[Dict], fallback: str) -> str:
     valid = [c for c in candidates if c.get("action") in ACTIONS]
     if not valid:
@@ -0,0 +1,160 @@
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Callable, Deque, Dict, List, Optional, Tuple
+
+from ..env.pool import EnvPool
+from ..rag.namespaces import RagNamespaces
+from ..utils.episodes import apply_episode
+from ..utils.logging import AsyncWriter
+from .action_space import ACTIONS
+from .loop import LMK_MAX_NEW_TOKENS, PLANNER_MAX_NEW_TOKENS, EpisodeRunner
+
+if TYPE_CHECKING:
+    from ..vlm.qwen_vl_hf import QwenVLHF
+
+
+def run_vectorized(
+    cfg: Dict,
+    envs: List,
+    model: "QwenVLHF",
+    prompt_tmpl: str,
+    rag_namespaces: Optional[RagNamespaces],
+    output_dir: str,
+    specs: List[Dict],
+    on_start: Optional[Callable[[Dict], None]] = None,
+    on_result: Optional[Callable[[Dict, Dict], None]] = None,
+    prompt_prefix: str = "",
+    writer: Optional[AsyncWriter] = None,
+    spec_context: Optional[Callable[[Dict], Tuple[Dict, RagNamespaces, str]]] = None,
+) -> Tuple[List[Dict], Dict]:
+    """Drive one episode per env in lockstep, batching VLM calls across envs.
+
+    Every tick, each active env contributes its landmark prompt to one
+    `model.generate_batch` call and then its planner prompt to a second one
+    (generated, scored or sampled according to `model.action_decoding`).
+    An env whose episode ends immediately starts the next pending spec (with
+    an `EnvPool` set to scene affinity, preferably one in the scene it has
+    loaded), so episodes of different lengths do not leave slots idle. Each env keeps its
+    own `EpisodeRunner` (trajectory, loop-breaker state, steps list).
+
+    `spec_context(spec)`, if given, returns the (cfg, rag_namespaces,
+    output_dir) for that spec, so episodes of different config variants can
+    share the envs and the batches. Model-level settings always come from `cfg`.
+
+    Returns (results in completion order, batching stats).
+    """
+    pool = envs if isinstance(envs, EnvPool) else EnvPool(envs)
+    pending: Deque[Dict] = deque(specs)
+    slots: List[Optional[Tuple[Dict, EpisodeRunner]]] = [None] * len(pool)
+    results: List[Dict] = []
+    stats = {"ticks": 0, "vlm_batches": 0, "vlm_requests": 0, "max_batch": 0}
+    model_cfg = cfg.get("model", {})
+    decoding = model_cfg.get("action_decoding", "generate")
+    n_candidates = int(model_cfg.get("n_candidates", 1))
+    actions = [a for a in cfg["agent"]["action_space"] if a in ACTIONS]
+
+    def context(spec: Dict) -> Tuple[Dict, RagNamespaces, str]:
+        if spec_context is not None:
+            return spec_context(spec)
+        return cfg, rag_namespaces, output_dir
+
+    def launch(slot: int) -> None:
+        while pending:
+            idx = pool.next_spec(slot, pending)
+            spec = pending[idx]
+            del pending[idx]
+            spec_cfg, namespaces, spec_dir = context(spec)
+            episode_cfg = apply_episode(dict(spec_cfg), spec)
+            if on_start is not None:
+                on_start(spec)
+            runner = EpisodeRunner(
+                episode_cfg,
+                pool[slot],
+                prompt_tmpl,
+                namespaces.get(spec["scene"], spec["episode_id"]),
+                spec_dir,
+                episode_id=spec["episode_id"],
+                scene=spec["scene"],
+                start_pose=spec["start_pose"],
+                prompt_prefix=prompt_prefix,
+                writer=writer,
+            )
+            runner.start()
+            if not runner.finished:
+                slots[slot] = (spec, runner)
+                return
+            complete(spec, runner)
+        slots[slot] = None
+
+    def complete(spec: Dict, runner: EpisodeRunner) -> None:
+        result = runner.finish()
+        context(spec)[1].release(spec["scene"], spec["episode_id"])
+        results.append(result)
+        if on_result is not None:
+            on_result(spec, result)
+
+    def batch(requests: List[Tuple[int, str]], stage: str, call: Callable) -> Dict[int, Tuple]:
+        if not requests:
+            return {}
+        frames = [slots[slot][1].frame for slot, _ in requests]
+        prompts = [prompt for _, prompt in requests]
+        start = time.perf_counter()
+        outputs = call(frames, prompts)
+        elapsed = time.perf_counter() - start
+        for slot, _ in requests:
+            slots[slot][1].timer.add(stage, elapsed)
+        stats["vlm_batches"] += 1
+        stats["vlm_requests"] += len(requests)
+        stats["max_batch"] = max(stats["max_batch"], len(requests))
+        return {slot: out for (slot, _), out in zip(requests, outputs)}
+
+    def lmk_call(frames: List, prompts: List[str]) -> List:
+        return model.generate_batch(frames, prompts, max_new_tokens=LMK_MAX_NEW_TOKENS)
+
+    def plan_call(frames: List, prompts: List[str]) -> List:
+        if decoding == "score":
+            return model.score_actions_batch(frames, prompts, actions, prefix=prompt_prefix)
+        if decoding == "candidates":
+            return model.generate_candidates_batch(
+                frames, prompts, n_candidates, max_new_tokens=PLANNER_MAX_NEW_TOKENS, prefix=prompt_prefix
+            )
+        return model.generate_batch(frames, prompts, max_new_tokens=PLANNER_MAX_NEW_TOKENS, prefix=prompt_prefix)
+
+    for slot in range(len(pool)):
+        launch(slot)
+
+    while any(slots):
+        stats["ticks"] += 1
+        active = [slot for slot, item in enumerate(slots) if item is not None]
+        lmk_requests = []
+        for slot in active:
+            runner = slots[slot][1]
+            lmk_prompt = runner.observe()
+            with runner.timer.stage("preprocess"):
+                model.preprocess(runner.frame)
+            if lmk_prompt is not None:
+                lmk_requests.append((slot, lmk_prompt))
+        lmk_outputs = batch(lmk_requests, "lmk_vlm", lmk_call)
+
+        plan_requests = []
+        for slot in active:
+            lmk_raw = lmk_outputs[slot][0] if slot in lmk_outputs else None
+            prompt = slots[slot][1].plan(lmk_raw)
+            if prompt is not None:
+                plan_requests.append((slot, prompt))
+        plan_outputs = batch(plan_requests, "plan_vlm", plan_call)
+
+        for slot in active:
+            spec, runner = slots[slot]
+            if slot in plan_outputs and decoding != "generate":
+                candidates, vlm_debug = plan_outputs[slot]
+                finished = runner.act(vlm_debug.get("full_text", ""), vlm_debug, candidates=candidates)
+            elif slot in plan_outputs:
+                raw, vlm_debug = plan_outputs[slot]
+                finished = runner.act(raw, vlm_debug)
+            else:
+                finished = runner.act()
+            if finished:
+                complete(spec, runner)
+                launch(slot)
+    return results, stats
@@ -0,0 +1,72 @@
+from typing import Dict, Iterator, List, Optional
+
+
+def order_by_scene(specs: List[Dict]) -> List[Dict]:
+    """Group specs by scene (scenes in order of first appearance, specs stable within one)."""
+    groups: Dict[str, List[Dict]] = {}
+    for spec in specs:
+        groups.setdefault(spec["scene"], []).append(spec)
+    return [spec for group in groups.values() for spec in group]
+
+
+class EnvPool:
+    """The run's controllers, kept warm across episodes.
+
+    Indexes like the plain list of envs it wraps. With `scene_affinity`,
+    `next_spec` lets a free env take the pending episode in the scene it
+    already has loaded (else one in a scene no other env holds), so with
+    `reuse_scene` on the envs that episode starts with a teleport instead of
+    a scene load. `stats()` sums the envs' cold (scene load) and warm
+    (teleport only) resets and estimates the time the warm ones saved.
+    """
+
+    def __init__(self, envs: List, scene_affinity: bool = False) -> None:
+        self.envs = envs
+        self.scene_affinity = scene_affinity
+
+    def __len__(self) -> int:
+        return len(self.envs)
+
+    def __getitem__(self, idx: int):
+        return self.envs[idx]
+
+    def __iter__(self) -> Iterator:
+        return iter(self.envs)
+
+    def next_spec(self, slot: int, pending: List[Dict]) -> Optional[int]:
+        """Index into `pending` of the spec env `slot` should run next."""
+        if not pending:
+            return None
+        if not self.scene_affinity:
+            return 0
+        loaded = getattr(self.envs[slot], "loaded_scene", None)
+        for idx, spec in enumerate(pending):
+            if spec["scene"] == loaded:
+                return idx
+        # Otherwise move to a scene no other env holds, so envs split the scenes between them.
+        held = {getattr(env, "loaded_scene", None) for k, env in enumerate(self.envs) if k != slot}
+        for idx, spec in enumerate(pending):
+            if spec["scene"] not in held:
+                return idx
+        return 0
+
+    def stats(self) -> Dict:
+        totals = {"cold": 0, "warm": 0, "cold_s": 0.0, "warm_s": 0.0}
+        for env in self.envs:
+            for key, value in (getattr(env, "reset_stats", None) or {}).items():
+                totals[key] += value
+        saved = None
+        if totals["cold"] and totals["warm"]:
+            saved = totals["warm"] * totals["cold_s"] / totals["cold"] - totals["warm_s"]
+        return {
+            "envs": len(self.envs),
+            "scene_switches": totals["cold"],
+            "warm_resets": totals["warm"],
+            "cold_reset_s": round(totals["cold_s"], 3),
+            "warm_reset_s": round(totals["warm_s"], 3),
+            "time_saved_s": None if saved is None else round(saved, 3),
+        }
+
+    def close(self) -> None:
+        for env in self.envs:
+            env.close()
@@ -0,0 +1,45 @@
+from typing import Any, Dict, Optional, Tuple
+
+# What `Initialize` leaves the agent with; a teleport-only reset has to restore it explicitly.
+INITIAL_POSE = {"horizon": 0.0, "standing": True}
+
+
+def teleport_args(start_pose: Dict[str, Any], defaults: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """`TeleportFull` kwargs for `start_pose`; None fields fall back to `defaults` or are left out."""
+    pose = dict(defaults or {})
+    pose.update({key: value for key, value in start_pose.items() if value is not None})
+    args = {"action": "TeleportFull", "forceAction": True}
+    for key in ("position", "rotation", "horizon", "standing"):
+        if pose.get(key) is not None:
+            args[key] = pose[key]
+    return args
+
+
+def can_reuse_scene(scene: str, loaded_scene: Optional[str], start_pose: Optional[Dict[str, Any]]) -> bool:
+    return (
+        scene == loaded_scene
+        and bool(start_pose)
+        and start_pose.get("position") is not None
+        and start_pose.get("rotation") is not None
+    )
+
+
+def reset_controller(
+    controller: Any,
+    scene: str,
+    start_pose: Optional[Dict[str, Any]],
+    loaded_scene: Optional[str] = None,
+    reuse_scene: bool = False,
+) -> Tuple[Any, bool]:
+    """Put the agent at `start_pose` in `scene`; return (event, whether the scene load was skipped).
+
+    With `reuse_scene` and `scene` already loaded, only teleports (navigation
+    never changes object state); otherwise resets, initializes and teleports.
+    """
+    if reuse_scene and can_reuse_scene(scene, loaded_scene, start_pose):
+        return controller.step(**teleport_args(start_pose, INITIAL_POSE)), True
+    event = controller.reset(scene)
+    controller.step(action="Initialize", gridSize=0.25, agentMode="default")
+    if start_pose:
+        event = controller.step(**teleport_args(start_pose))
+    return event, False
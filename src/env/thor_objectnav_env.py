@@ -1,8 +1,15 @@
-from typing import Any, Dict, List, Optional
+import time
+from typing import Any, Dict, Iterable, List, Optional
 
 from ai2thor.controller import Controller
 
 from .headless import apply_graphics_env, configure_headless, start_xvfb
+from .poses import reset_controller
+from .visibility import TARGET_FIELDS, ObjectIndex
+
+
+def _reset_counters() -> Dict[str, float]:
+    return {"cold": 0, "warm": 0, "cold_s": 0.0, "warm_s": 0.0}
 
 
 class ThorObjectNavEnv:
@@ -20,8 +27,16 @@ class ThorObjectNavEnv:
         use_xvfb: bool = False,
         xvfb_display: str = ":99",
         graphics_cfg: Optional[Dict] = None,
+        reuse_scene: bool = False,
     ) -> None:
         self.scene = scene
+        # With reuse_scene, a reset into the scene that is already loaded only teleports the
+        # agent (navigation actions never change object state). Needs a start position.
+        self.reuse_scene = reuse_scene
+        self.loaded_scene: Optional[str] = None
+        self.reset_stats = _reset_counters()
+        # Dropped on every scene load and rebuilt whenever the objectIds change.
+        self._object_index: Optional[ObjectIndex] = None
         self.width = width
         self.height = height
         self.seed = seed
@@ -85,30 +100,21 @@ class ThorObjectNavEnv:
             unity_log_file=self.unity_log_file,
         )
         self.reset(scene)
+        # The constructor's load is startup, not an episode reset.
+        self.reset_stats = _reset_counters()
 
     def reset(self, scene: Optional[str] = None, start_pose: Optional[Dict[str, Any]] = None) -> Any:
+        start = time.perf_counter()
         if scene:
             self.scene = scene
-        event = self.controller.reset(self.scene)
-        self.controller.step(action="Initialize", gridSize=0.25, agentMode="default")
-        if start_pose:
-            position = start_pose.get("position")
-            rotation = start_pose.get("rotation")
-            horizon = start_pose.get("horizon")
-            standing = start_pose.get("standing")
-            teleport_args = {
-                "action": "TeleportFull",
-                "forceAction": True,
-            }
-            if position is not None:
-                teleport_args["position"] = position
-            if rotation is not None:
-                teleport_args["rotation"] = rotation
-            if horizon is not None:
-                teleport_args["horizon"] = horizon
-            if standing is not None:
-                teleport_args["standing"] = standing
-            event = self.controller.step(**teleport_args)
+        event, warm = reset_controller(self.controller, self.scene, start_pose, self.loaded_scene, self.reuse_scene)
+        if not warm:
+            self.loaded_scene = self.scene
+            # A new scene has a new object list; never look it up in the old index.
+            self._object_index = None
+        kind = "warm" if warm else "cold"
+        self.reset_stats[kind] += 1
+        self.reset_stats[f"{kind}_s"] += time.perf_counter() - start
         return event
 
     def step(self, action: Dict[str, Any]) -> Any:
@@ -125,21 +131,9 @@ class ThorObjectNavEnv:
         if self._xvfb_proc is not None:
             self._xvfb_proc.terminate()
 
-    def list_visible(self, event: Any, target: str) -> Dict[str, Any]:
+    def list_visible(self, event: Any, target: str, fields: Iterable[str] = TARGET_FIELDS) -> Dict[str, Any]:
+        """`fields` of the target lookup; add "visible" for the list of every visible object."""
         objects = event.metadata.get("objects", [])
-        visible = [o for o in objects if o.get("visible")]
-        target_visible = False
-        target_bbox = None
-        target_distance = None
-        for obj in visible:
-            if obj.get("objectType", "").lower() == target.lower():
-                target_visible = True
-                target_bbox = obj.get("boundingBox")
-                target_distance = obj.get("distance")
-                break
-        return {
-            "visible": visible,
-            "target_visible": target_visible,
-            "target_bbox": target_bbox,
-            "target_distance": target_distance,
-        }
+        if self._object_index is None or not self._object_index.fits(objects):
+            self._object_index = ObjectIndex(objects)
+        return self._object_index.lookup(objects, target, fields)
@@ -0,0 +1,68 @@
+from operator import itemgetter
+from typing import Any, Dict, Iterable, List, Optional
+
+# Fields `list_visible` returns unless the caller asks for more; "visible" adds every visible object.
+TARGET_FIELDS = ("target_visible", "target_bbox", "target_distance")
+
+# objectType -> lookup key. iTHOR has about a hundred object types, so this stays tiny.
+_TYPE_KEYS: Dict[str, str] = {}
+_OBJECT_ID = itemgetter("objectId")
+
+
+def type_key(object_type: str) -> str:
+    key = _TYPE_KEYS.get(object_type)
+    if key is None:
+        key = _TYPE_KEYS[object_type] = object_type.lower()
+    return key
+
+
+class ObjectIndex:
+    """Rows of `metadata["objects"]` per lowercased objectType.
+
+    Navigation never adds, removes or reorders a scene's objects, so the
+    index built from one event serves every later event of the same scene:
+    a lookup reads only the target type's rows (usually one to three) instead
+    of scanning and lowercasing the whole list. `fits` compares the event's
+    full objectId list with the indexed one and the caller rebuilds on a
+    mismatch.
+    """
+
+    def __init__(self, objects: List[Dict]) -> None:
+        self.size = len(objects)
+        self.ids = [obj.get("objectId") for obj in objects]
+        self.rows: Dict[str, List[int]] = {}
+        for row, obj in enumerate(objects):
+            self.rows.setdefault(type_key(obj.get("objectType", "")), []).append(row)
+
+    def fits(self, objects: List[Dict]) -> bool:
+        if len(objects) != self.size:
+            return False
+        try:
+            return list(map(_OBJECT_ID, objects)) == self.ids
+        except KeyError:
+            return False
+
+    def first_visible(self, objects: List[Dict], target: str) -> Optional[Dict]:
+        """The first visible object of type `target` in list order, like a linear scan."""
+        for row in self.rows.get(type_key(target), ()):
+            obj = objects[row]
+            if obj.get("visible"):
+                return obj
+        return None
+
+    def lookup(self, objects: List[Dict], target: str, fields: Iterable[str] = TARGET_FIELDS) -> Dict[str, Any]:
+        obj = self.first_visible(objects, target)
+        info: Dict[str, Any] = {}
+        for field in fields:
+            if field == "target_visible":
+                info[field] = obj is not None
+            elif field == "target_bbox":
+                info[field] = obj.get("boundingBox") if obj is not None else None
+            elif field == "target_distance":
+                info[field] = obj.get("distance") if obj is not None else None
+            elif field == "visible":
+                # Built only for callers that ask for it (full env-meta debug dumps).
+                info[field] = [o for o in objects if o.get("visible")]
+            else:
+                raise KeyError(f"unknown list_visible field: {field}")
+        return info
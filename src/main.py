@@ -1,17 +1,31 @@
 import argparse
-import json
+import multiprocessing
 import os
+import shutil
 import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Tuple
+
 import yaml
 
 from .agent.loop import run_episode
-from .env.thor_objectnav_env import ThorObjectNavEnv
-from .rag.store import RagStore
-from .metrics.nav_metrics import summarize
-from .metrics.hallucinations import annotate_steps_for_eval
-from .utils.logging import append_jsonl, ensure_dir, write_json
-from .utils.episodes import load_episodes, pick_episode, extract_start_pose
-from .vlm.qwen_vl_hf import QwenVLHF
+from .agent.vector_runner import run_vectorized
+from .env.pool import EnvPool, order_by_scene
+from .rag.namespaces import RagNamespaces
+from .metrics.fold import MetricsFold
+from .metrics.hallucinations import annotate_steps_for_eval, count_hallucinations
+from .utils.jsonl import load_jsonl
+from .utils.logging import AsyncWriter, append_jsonl, ensure_dir, write_json
+from .utils.resume import PROMPT, RESUME_LOG, prepare_resume, prompt_path, restore_rag, write_checkpoint
+from .utils.shards import merge_shard_outputs, shard_dir, shard_specs
+from .utils.step_store import ColumnarStepWriter
+from .utils.sweep import expand_grid, format_table, load_sweep, variant_label
+from .utils.episodes import apply_episode, build_episode_spec, load_episodes
+from .utils.startup import start_concurrently, validate_config, validate_specs
+from .vlm.response_cache import CachedVLM, ResponseCache
+
+if TYPE_CHECKING:
+    from .env.thor_objectnav_env import ThorObjectNavEnv
 
 
 def load_yaml(path: str) -> dict:
@@ -19,31 +33,13 @@ def load_yaml(path: str) -> dict:
         return yaml.safe_load(f)
 
 
-def main() -> None:
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--config", required=True)
-    parser.add_argument("--sweep", default=None)
-    args = parser.parse_args()
-
-    cfg = load_yaml(args.config)
-    run_id = f"run_{int(time.time())}"
-    output_dir = os.path.join(cfg["run"]["output_dir"], run_id)
-    ensure_dir(output_dir)
-    write_json(os.path.join(output_dir, "config.yaml"), cfg)
-
-    model = QwenVLHF(cfg["model"]["local_path"], cfg["model"]["device"])
-    unity_log = os.path.join(output_dir, "unity_player.log")
-
-    episodes = load_episodes(cfg)
-    if episodes is None and not cfg["run"].get("allow_fallback", False):
-        raise RuntimeError("No episodes found. Set run.dataset or run.episodes_file, or allow_fallback=true.")
-    if episodes:
-        initial_scene, _, _ = pick_episode(episodes, 0)
-    else:
-        initial_scene = cfg["run"]["scenes"][0]
+def make_env(cfg: Dict, scene: str, unity_log: str) -> "ThorObjectNavEnv":
+    # ai2thor (and torch/transformers in load_model) are imported only when needed,
+    # so config and episode problems are reported without paying for them.
+    from .env.thor_objectnav_env import ThorObjectNavEnv
 
-    env = ThorObjectNavEnv(
-        scene=initial_scene,
+    return ThorObjectNavEnv(
+        scene=scene,
         headless=cfg["headless"]["enabled"],
         use_cloud=cfg["headless"].get("use_cloud", False),
         server_timeout=cfg["headless"].get("server_timeout", 300.0),
@@ -52,76 +48,456 @@ def main() -> None:
         use_xvfb=cfg["headless"].get("use_xvfb", False),
         xvfb_display=cfg["headless"].get("xvfb_display", ":99"),
         graphics_cfg=cfg.get("graphics", {}),
+        reuse_scene=bool((cfg.get("env_pool") or {}).get("reuse_scene", False)),
+    )
+
+
+def load_model(cfg: Dict):
+    from .vlm.qwen_vl_hf import QwenVLHF
+
+    model = QwenVLHF(
+        cfg["model"]["local_path"],
+        cfg["model"]["device"],
+        prefix_cache_size=int(cfg["model"].get("prefix_cache", 0) or 0),
+        precision=cfg["model"].get("precision", "fp32"),
+        num_threads=cfg["model"].get("num_threads"),
     )
-    rag_store = RagStore(os.path.join(output_dir, "rag_store.jsonl"))
-
-    prompt_cfg = load_yaml(os.path.join(os.path.dirname(args.config), "prompt.yaml"))
-    prompt_tmpl = prompt_cfg["planner"]["template"]
-
-    episode_summaries = []
-    all_steps = []
-    for idx in range(cfg["run"]["num_episodes"]):
-        if episodes:
-            scene, target, ep = pick_episode(episodes, idx)
-            cfg["target"] = target
-            cfg["target_object_type"] = target
-            cfg["target_prompt"] = str(target).lower()
-            cfg["episode_meta"] = ep
-            start_pose = extract_start_pose(ep)
+    cache_cfg = cfg["model"].get("response_cache") or {}
+    if cache_cfg.get("enabled"):
+        cache = ResponseCache(cache_cfg.get("dir", "outputs/vlm_cache"), int(cache_cfg.get("max_mb", 2048)) << 20)
+        model = CachedVLM(model, cache, cfg["model"]["local_path"])
+    return model
+
+
+def planner_prompt(prompt_cfg: Dict, cfg: Dict) -> Tuple[str, str]:
+    """(template, prefix) for the planner.
+
+    The static prefix is split off and sent before the image only when
+    `model.prefix_cache` can reuse it; otherwise the single `template` is used as is.
+    """
+    planner = prompt_cfg["planner"]
+    if int(cfg["model"].get("prefix_cache", 0) or 0) > 0 and planner.get("prefix"):
+        return planner["prefix_template"], planner["prefix"]
+    return planner["template"], ""
+
+
+def episode_record(cfg: Dict, spec: Dict) -> Dict:
+    return {
+        "episode_id": spec["episode_id"],
+        "scene": spec["scene"],
+        "target": spec["target"],
+        "start_pose": spec["start_pose"],
+        "seed": cfg["run"].get("seed"),
+        "split": cfg["run"].get("split"),
+        "dataset": cfg["run"].get("dataset"),
+    }
+
+
+def start_model_and_envs(
+    cfg: Dict, specs: List[Dict], output_dir: str, num_envs: int, startup: Dict
+) -> Tuple[object, EnvPool]:
+    """Load the model while `num_envs` controllers start; write `startup.json`."""
+    wall = time.perf_counter()
+    initial_scene = specs[0]["scene"] if specs else cfg["run"]["scenes"][0]
+
+    def start_envs() -> List:
+        envs: List = []
+        try:
+            for i in range(num_envs):
+                log = os.path.join(output_dir, "unity_player.log" if i == 0 else f"unity_player_{i}.log")
+                envs.append(make_env(cfg, initial_scene, log))
+        except BaseException:
+            EnvPool(envs).close()
+            raise
+        return envs
+
+    # If either job fails, controllers that did start are closed instead of left running.
+    started = start_concurrently(
+        {"model_load": lambda: load_model(cfg), "env_start": start_envs},
+        startup,
+        cleanup={"env_start": lambda envs: EnvPool(envs).close()},
+    )
+    startup["model_env_wall"] = round(time.perf_counter() - wall, 3)
+    write_json(os.path.join(output_dir, "startup.json"), startup)
+    scene_affinity = bool((cfg.get("env_pool") or {}).get("scene_affinity", False))
+    return started["model_load"], EnvPool(started["env_start"], scene_affinity)
+
+
+def _close(close: Callable[[], Any], in_flight: bool) -> Any:
+    """Call `close`; while another exception propagates, drop its error instead of masking that one."""
+    try:
+        return close()
+    except Exception:
+        if not in_flight:
+            raise
+        return None
+
+
+def model_stats(model) -> Dict:
+    stats: Dict = {}
+    if model.prefix_cache_size > 0:
+        stats["prefix_cache"] = dict(model.prefix_cache_stats)
+    stats["preprocess"] = {k: round(v, 6) for k, v in model.preprocess_stats.items()}
+    if isinstance(model, CachedVLM):
+        stats["response_cache"] = model.cache.stats()
+    return stats
+
+
+def run_local(
+    cfg: Dict,
+    specs: List[Dict],
+    output_dir: str,
+    prompt_tmpl: str,
+    prompt_prefix: str = "",
+    startup: Optional[Dict] = None,
+    resume: bool = False,
+) -> Tuple[List[Dict], Dict]:
+    """Run `specs` in this process; return (episode summaries, extra metrics).
+
+    The model loads while the controllers start; seconds per startup phase
+    (plus any passed in `startup`) are written to `startup.json`.
+
+    After every episode `checkpoint.json` records the RAG state. With
+    `resume`, `output_dir` is rolled back to the episodes whose summaries are
+    in `episode_summary.jsonl`, the RAG state is restored from the
+    checkpoint (if any) and only the unfinished episodes of `specs` run;
+    the resume stats are appended to `resume.jsonl`.
+    """
+    startup = dict(startup or {})
+    extra: Dict = {}
+    episode_summaries: List[Dict] = []
+    if (cfg.get("env_pool") or {}).get("scene_affinity"):
+        # Same-scene episodes back to back; summaries are still keyed and sorted by episode id.
+        specs = order_by_scene(specs)
+    rag_state = None
+    if resume:
+        rag_state, episode_summaries, specs, resume_stats = prepare_resume(output_dir, specs)
+        append_jsonl(os.path.join(output_dir, RESUME_LOG), resume_stats)
+    completed: List[int] = [summary["episode_id"] for summary in episode_summaries]
+    num_envs = max(1, int(cfg["run"].get("num_envs", 1)))
+    # A second controller lets the next episode's reset overlap the current episode.
+    prefetch = bool((cfg.get("pipeline") or {}).get("prefetch_reset")) and num_envs == 1 and len(specs) > 1
+    model, envs = start_model_and_envs(cfg, specs, output_dir, num_envs + int(prefetch), startup)
+    rag_namespaces = RagNamespaces(output_dir, cfg["rag"])
+    if resume:
+        restore_rag(rag_namespaces, rag_state, specs)
+
+    # Rebuilt from the finished episodes on resume, so the chunks match an uninterrupted run.
+    shutil.rmtree(os.path.join(output_dir, "step_columns"), ignore_errors=True)
+    step_columns = ColumnarStepWriter(os.path.join(output_dir, "step_columns"))
+    if resume and os.path.exists(os.path.join(output_dir, "steps_eval.jsonl")):
+        step_columns.add(load_jsonl(os.path.join(output_dir, "steps_eval.jsonl")))
+
+    log_cfg = cfg.get("logging", {})
+    writer = AsyncWriter(fsync_interval_s=float(log_cfg.get("fsync_interval_s", 5.0)))
+
+    def on_start(spec: Dict) -> None:
+        writer.append_jsonl(os.path.join(output_dir, "episode_meta.jsonl"), episode_record(cfg, spec))
+
+    def on_result(spec: Dict, result: Dict) -> None:
+        annotate_steps_for_eval(result["steps"])
+        result["summary"]["hallucinations"] = count_hallucinations(result["steps"])
+        episode_summaries.append(result["summary"])
+        # Steps go to disk here and are not kept; metrics fold over the summaries.
+        step_columns.add(result["steps"])
+        writer.append_jsonl(os.path.join(output_dir, "steps_eval.jsonl"), result["steps"])
+        # One line per finished episode; the sorted episode_summary.json is written once at the end.
+        writer.append_jsonl(os.path.join(output_dir, "episode_summary.jsonl"), result["summary"])
+        # The checkpoint must never get ahead of the episode's logs.
+        writer.flush()
+        completed.append(spec["episode_id"])
+        write_checkpoint(output_dir, completed, rag_namespaces.state())
+
+    reset_pool: Optional[ThreadPoolExecutor] = None
+    in_flight = True
+    try:
+        if num_envs > 1:
+            _, extra["vector"] = run_vectorized(
+                cfg,
+                envs,
+                model,
+                prompt_tmpl,
+                rag_namespaces,
+                output_dir,
+                specs,
+                on_start=on_start,
+                on_result=on_result,
+                prompt_prefix=prompt_prefix,
+                writer=writer,
+            )
         else:
-            target = cfg["run"]["target_objects"][idx % len(cfg["run"]["target_objects"])]
-            scene = cfg["run"]["scenes"][idx % len(cfg["run"]["scenes"])]
-            cfg["target"] = target
-            cfg["target_object_type"] = target
-            cfg["target_prompt"] = str(target).lower()
-            cfg.pop("episode_meta", None)
-            start_pose = None
-        episode_rec = {
-            "episode_id": idx,
-            "scene": scene,
-            "target": target,
-            "start_pose": start_pose,
-            "seed": cfg["run"].get("seed"),
-            "split": cfg["run"].get("split"),
-            "dataset": cfg["run"].get("dataset"),
-        }
-        append_jsonl(os.path.join(output_dir, "episode_meta.jsonl"), episode_rec)
-        result = run_episode(
+            reset_pool = ThreadPoolExecutor(max_workers=1) if prefetch else None
+            next_reset = None
+            reset_wait = 0.0
+            for i, spec in enumerate(specs):
+                env = envs[i % len(envs)]
+                initial_event = None
+                if next_reset is not None:
+                    start = time.perf_counter()
+                    initial_event = next_reset.result()
+                    reset_wait += time.perf_counter() - start
+                    next_reset = None
+                if reset_pool is not None and i + 1 < len(specs):
+                    upcoming = specs[i + 1]
+                    next_reset = reset_pool.submit(
+                        envs[(i + 1) % len(envs)].reset, upcoming["scene"], upcoming["start_pose"]
+                    )
+                apply_episode(cfg, spec)
+                on_start(spec)
+                rag_store = rag_namespaces.get(spec["scene"], spec["episode_id"])
+                result = run_episode(
+                    cfg,
+                    env,
+                    model,
+                    prompt_tmpl,
+                    rag_store,
+                    output_dir,
+                    episode_id=spec["episode_id"],
+                    scene=spec["scene"],
+                    start_pose=spec["start_pose"],
+                    initial_event=initial_event,
+                    prompt_prefix=prompt_prefix,
+                    writer=writer,
+                )
+                rag_namespaces.release(spec["scene"], spec["episode_id"])
+                on_result(spec, result)
+            if reset_pool is not None:
+                extra["pipeline"] = {"prefetched_resets": len(specs) - 1, "reset_wait_s": round(reset_wait, 6)}
+        in_flight = False
+    finally:
+        if reset_pool is not None:
+            # Waits for a prefetched reset still running on a controller about to be closed.
+            reset_pool.shutdown()
+        # Flushes and fsyncs whatever was queued, also when an episode raised.
+        _close(writer.close, in_flight)
+        step_columns_stats = _close(step_columns.close, in_flight)
+        _close(envs.close, in_flight)
+    episode_summaries.sort(key=lambda ep: ep["episode_id"])
+    write_json(os.path.join(output_dir, "episode_summary.json"), {"episodes": episode_summaries})
+    extra["writer"] = dict(writer.stats)
+    extra["step_columns"] = step_columns_stats
+    extra["rag"] = rag_namespaces.stats()
+    extra.update(model_stats(model))
+    extra["env_pool"] = envs.stats()
+    return episode_summaries, extra
+
+
+def _shard_worker(job: Tuple[Dict, List[Dict], str, str, str, bool]) -> Dict:
+    cfg, specs, out_dir, prompt_tmpl, prompt_prefix, resume = job
+    ensure_dir(out_dir)
+    _, extra = run_local(cfg, specs, out_dir, prompt_tmpl, prompt_prefix, resume=resume)
+    return extra
+
+
+def run_sharded(
+    cfg: Dict,
+    specs: List[Dict],
+    output_dir: str,
+    prompt_tmpl: str,
+    num_workers: int,
+    prompt_prefix: str = "",
+    resume: bool = False,
+) -> Tuple[List[Dict], Dict]:
+    """Run shards of `specs` in `num_workers` processes, each with its own model,
+    env, RAG store and `shards/shard_XX/` outputs, then merge them by episode id.
+    With `resume`, every shard resumes from its own checkpoint."""
+    shards = [chunk for chunk in shard_specs(specs, num_workers) if chunk]
+    dirs = [shard_dir(output_dir, k) for k in range(len(shards))]
+    jobs = [(cfg, chunk, d, prompt_tmpl, prompt_prefix, resume) for chunk, d in zip(shards, dirs)]
+    # spawn: CUDA and the Unity controller do not survive fork.
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(processes=len(jobs)) as pool:
+        shard_extra = pool.map(_shard_worker, jobs)
+    episode_summaries = merge_shard_outputs(output_dir, dirs)
+    return episode_summaries, {"shards": shard_extra}
+
+
+def run_sweep(
+    cfg: Dict,
+    variants: List[Tuple[Dict, Dict]],
+    specs: List[Dict],
+    output_dir: str,
+    prompt_tmpl: str,
+    prompt_prefix: str = "",
+    startup: Optional[Dict] = None,
+) -> List[Dict]:
+    """Run every (overrides, config) variant over `specs` with one model and one env pool.
+
+    Episodes are queued spec by spec, one per variant, and driven by
+    `run_vectorized`, so `run.num_envs` slots batch VLM calls across
+    variants. Each variant gets its own RAG stores and a full run layout
+    (logs, `episode_summary.json`, `metrics.json`) under `variants/vXX/`.
+    Returns one comparison row per variant.
+    """
+    startup = dict(startup or {})
+    num_envs = max(1, int(cfg["run"].get("num_envs", 1)))
+    if (cfg.get("env_pool") or {}).get("scene_affinity"):
+        specs = order_by_scene(specs)
+    model, envs = start_model_and_envs(cfg, specs, output_dir, num_envs, startup)
+    log_cfg = cfg.get("logging", {})
+    writer = AsyncWriter(fsync_interval_s=float(log_cfg.get("fsync_interval_s", 5.0)))
+
+    runs: List[Dict] = []
+    for idx, (overrides, variant_cfg) in enumerate(variants):
+        out_dir = os.path.join(output_dir, "variants", f"v{idx:02d}")
+        ensure_dir(out_dir)
+        write_json(os.path.join(out_dir, "config.yaml"), variant_cfg)
+        runs.append({
+            "variant": f"v{idx:02d}",
+            "label": variant_label(overrides),
+            "overrides": overrides,
+            "cfg": variant_cfg,
+            "dir": out_dir,
+            "rag": RagNamespaces(out_dir, variant_cfg["rag"]),
+            "step_columns": ColumnarStepWriter(os.path.join(out_dir, "step_columns")),
+            "summaries": [],
+        })
+    jobs = [dict(spec, variant=idx) for spec in specs for idx in range(len(runs))]
+
+    def spec_context(spec: Dict) -> Tuple[Dict, RagNamespaces, str]:
+        run = runs[spec["variant"]]
+        return run["cfg"], run["rag"], run["dir"]
+
+    def on_start(spec: Dict) -> None:
+        run = runs[spec["variant"]]
+        writer.append_jsonl(os.path.join(run["dir"], "episode_meta.jsonl"), episode_record(run["cfg"], spec))
+
+    def on_result(spec: Dict, result: Dict) -> None:
+        run = runs[spec["variant"]]
+        annotate_steps_for_eval(result["steps"])
+        result["summary"]["hallucinations"] = count_hallucinations(result["steps"])
+        run["summaries"].append(result["summary"])
+        run["step_columns"].add(result["steps"])
+        writer.append_jsonl(os.path.join(run["dir"], "steps_eval.jsonl"), result["steps"])
+        writer.append_jsonl(os.path.join(run["dir"], "episode_summary.jsonl"), result["summary"])
+
+    in_flight = True
+    try:
+        _, vector_stats = run_vectorized(
             cfg,
-            env,
+            envs,
             model,
             prompt_tmpl,
-            rag_store,
+            None,
             output_dir,
-            episode_id=idx,
-            scene=scene,
-            start_pose=start_pose,
-        )
-        annotate_steps_for_eval(result["steps"])
-        episode_summaries.append(result["summary"])
-        all_steps.extend(result["steps"])
-        steps_eval_path = os.path.join(output_dir, "steps_eval.jsonl")
-        with open(steps_eval_path, "a", encoding="utf-8") as f:
-            for item in result["steps"]:
-                f.write(json.dumps(item) + "\n")
-        write_json(
-            os.path.join(output_dir, "episode_summary.json"),
-            {"episodes": episode_summaries},
+            jobs,
+            on_start=on_start,
+            on_result=on_result,
+            prompt_prefix=prompt_prefix,
+            writer=writer,
+            spec_context=spec_context,
         )
+        in_flight = False
+    finally:
+        _close(writer.close, in_flight)
+        for run in runs:
+            _close(run["step_columns"].close, in_flight)
+        _close(envs.close, in_flight)
+
+    rows = []
+    for run in runs:
+        summaries = sorted(run["summaries"], key=lambda ep: ep["episode_id"])
+        write_json(os.path.join(run["dir"], "episode_summary.json"), {"episodes": summaries})
+        metrics = compute_metrics(summaries, {"variant": run["overrides"], "rag": run["rag"].stats()})
+        write_json(os.path.join(run["dir"], "metrics.json"), metrics)
+        rows.append({"variant": run["variant"], "label": run["label"], "episodes": len(summaries), "metrics": metrics})
+    sweep = {"variants": rows, "vector": vector_stats, "writer": dict(writer.stats), "env_pool": envs.stats()}
+    sweep.update(model_stats(model))
+    write_json(os.path.join(output_dir, "sweep.json"), sweep)
+    with open(os.path.join(output_dir, "sweep_table.md"), "w", encoding="utf-8") as f:
+        f.write(format_table(rows))
+    return rows
+
 
-    metrics = summarize(episode_summaries)
-    halluc_counts = {"PH_Existence": 0, "PH_Localization": 0, "overconfident_stop": 0}
-    for step in all_steps:
-        hall = step.get("hallucinations", {})
-        if hall.get("PH_Existence"):
-            halluc_counts["PH_Existence"] += 1
-        if hall.get("PH_Localization"):
-            halluc_counts["PH_Localization"] += 1
-    overconf = sum(ep.get("overconfident_stop", 0) for ep in episode_summaries)
-    halluc_counts["overconfident_stop"] = overconf
-    write_json(os.path.join(output_dir, "metrics.json"), {"nav": metrics, "hallucinations": halluc_counts})
-
-    env.close()
+def compute_metrics(episode_summaries: Iterable[Dict], extra: Optional[Dict] = None) -> Dict:
+    fold = MetricsFold()
+    for summary in episode_summaries:
+        fold.add(summary)
+    payload = fold.result()
+    payload.update(extra or {})
+    return payload
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--config", default=None, help="run config; with --resume only its prompt.yaml is used, if the run has none"
+    )
+    parser.add_argument("--sweep", default=None, help="sweep spec (grid of config overrides) run in one process")
+    parser.add_argument("--workers", type=int, default=None, help="shard episodes across N processes")
+    parser.add_argument(
+        "--resume", default=None, metavar="RUN_DIR", help="continue an interrupted run with its saved config"
+    )
+    args = parser.parse_args()
+    if not args.config and not args.resume:
+        parser.error("--config is required unless --resume is given")
+
+    startup: Dict[str, float] = {}
+    start = time.perf_counter()
+    cfg = load_yaml(os.path.join(args.resume, "config.yaml") if args.resume else args.config)
+    # A resumed run keeps the prompt it started with, even if configs/prompt.yaml changed since.
+    prompt_file = prompt_path(args.config, args.resume)
+    prompt_cfg = load_yaml(prompt_file)
+    prompt_tmpl, prompt_prefix = planner_prompt(prompt_cfg, cfg)
+    problems = validate_config(cfg)
+    variants = []
+    if args.sweep:
+        if args.resume:
+            raise ValueError("--sweep cannot be combined with --resume")
+        variants = expand_grid(cfg, load_sweep(args.sweep))
+        for overrides, variant_cfg in variants:
+            problems += [f"[{variant_label(overrides)}] {p}" for p in validate_config(variant_cfg)]
+    if problems:
+        raise ValueError("invalid config:\n  " + "\n  ".join(problems))
+    startup["config"] = round(time.perf_counter() - start, 3)
+
+    start = time.perf_counter()
+    episodes = load_episodes(cfg)
+    if episodes is None and not cfg["run"].get("allow_fallback", False):
+        raise RuntimeError("No episodes found. Set run.dataset or run.episodes_file, or allow_fallback=true.")
+    specs = [build_episode_spec(cfg, episodes, idx) for idx in range(cfg["run"]["num_episodes"])]
+    problems = validate_specs(specs)
+    if problems:
+        raise ValueError("invalid episodes:\n  " + "\n  ".join(problems))
+    startup["episodes"] = round(time.perf_counter() - start, 3)
+
+    if variants:
+        output_dir = os.path.join(cfg["run"]["output_dir"], f"sweep_{int(time.time())}")
+        ensure_dir(output_dir)
+        write_json(os.path.join(output_dir, "config.yaml"), cfg)
+        shutil.copyfile(args.sweep, os.path.join(output_dir, "sweep.yaml"))
+        shutil.copyfile(prompt_file, os.path.join(output_dir, PROMPT))
+        rows = run_sweep(cfg, variants, specs, output_dir, prompt_tmpl, prompt_prefix, startup)
+        print(format_table(rows), end="")
+        return
+
+    resume = args.resume is not None
+    if resume:
+        # The saved config already carries the worker count the episodes were sharded with.
+        output_dir = args.resume
+        num_workers = int(cfg["run"].get("workers", 1))
+        if not os.path.exists(os.path.join(output_dir, PROMPT)):
+            # Older runs did not save their prompt; later resumes keep the one used now.
+            shutil.copyfile(prompt_file, os.path.join(output_dir, PROMPT))
+    else:
+        run_id = f"run_{int(time.time())}"
+        output_dir = os.path.join(cfg["run"]["output_dir"], run_id)
+        ensure_dir(output_dir)
+        num_workers = args.workers if args.workers is not None else int(cfg["run"].get("workers", 1))
+        cfg["run"]["workers"] = num_workers
+        write_json(os.path.join(output_dir, "config.yaml"), cfg)
+        shutil.copyfile(prompt_file, os.path.join(output_dir, PROMPT))
+
+    if num_workers > 1:
+        episode_summaries, extra = run_sharded(
+            cfg, specs, output_dir, prompt_tmpl, num_workers, prompt_prefix, resume
+        )
+        write_json(os.path.join(output_dir, "startup.json"), startup)
+    else:
+        episode_summaries, extra = run_local(
+            cfg, specs, output_dir, prompt_tmpl, prompt_prefix, startup, resume=resume
+        )
+    write_json(os.path.join(output_dir, "metrics.json"), compute_metrics(episode_summaries, extra))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,43 @@
+from typing import Dict
+
+from .nav_metrics import episode_spl
+
+
+class MetricsFold:
+    """Run metrics folded one episode summary at a time.
+
+    Gives the same numbers as `nav_metrics.summarize` (sharing its
+    per-episode SPL) plus the hallucination totals, but holds only running
+    sums, so memory does not grow with the number of episodes. Summaries
+    need the `hallucinations` counts written by `count_hallucinations`.
+    """
+
+    def __init__(self) -> None:
+        self.episodes = 0
+        self.successes = 0
+        self.success_steps = 0
+        self.spl_sum = 0.0
+        self.halluc = {"PH_Existence": 0, "PH_Localization": 0, "overconfident_stop": 0}
+
+    def add(self, summary: Dict) -> None:
+        self.episodes += 1
+        if summary.get("success"):
+            self.successes += 1
+            self.success_steps += summary.get("steps", 0)
+        self.spl_sum += episode_spl(summary)
+        counts = summary.get("hallucinations", {})
+        self.halluc["PH_Existence"] += counts.get("PH_Existence", 0)
+        self.halluc["PH_Localization"] += counts.get("PH_Localization", 0)
+        self.halluc["overconfident_stop"] += summary.get("overconfident_stop", 0)
+
+    def nav(self) -> Dict:
+        if not self.episodes:
+            return {"success_rate": 0.0, "avg_steps": 0.0, "spl": 0.0}
+        return {
+            "success_rate": self.successes / self.episodes,
+            "avg_steps": self.success_steps / max(1, self.successes),
+            "spl": self.spl_sum / self.episodes,
+        }
+
+    def result(self) -> Dict:
+        return {"nav": self.nav(), "hallucinations": dict(self.halluc)}
@@ -45,3 +45,14 @@ def annotate_steps_for_eval(steps: List[Dict]) -> None:
             frame_width,
             step.get("target_seen_claim"),
         )
+
+
+def count_hallucinations(steps: List[Dict]) -> Dict[str, int]:
+    """Per-episode flag counts, stored in the episode summary so metrics never need the steps."""
+    counts = {"PH_Existence": 0, "PH_Localization": 0}
+    for step in steps:
+        hall = step.get("hallucinations", {})
+        for key in counts:
+            if hall.get(key):
+                counts[key] += 1
+    return counts
@@ -0,0 +1,73 @@
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+from .retrieval import tokenize
+
+
+class InvertedIndex:
+    """Token -> entry postings with cached per-entry token counts.
+
+    Scores match `retrieval.similarity`: shared-token multiset overlap divided
+    by sqrt(len(query_tokens) * len(entry_tokens)). Ties keep entry id order,
+    like the stable sort in `retrieval.retrieve`.
+    """
+
+    def __init__(self) -> None:
+        self.postings: Dict[str, Set[int]] = {}
+        self.counts: Dict[int, Counter] = {}
+        self.norms: Dict[int, int] = {}
+        self.types: Dict[int, Optional[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def add(self, entry_id: int, text: str, entry_type: Optional[str]) -> None:
+        counts = Counter(tokenize(text))
+        self.counts[entry_id] = counts
+        self.norms[entry_id] = sum(counts.values())
+        self.types[entry_id] = entry_type
+        for tok in counts:
+            self.postings.setdefault(tok, set()).add(entry_id)
+
+    def remove(self, entry_id: int) -> None:
+        for tok in self.counts.pop(entry_id):
+            postings = self.postings[tok]
+            postings.discard(entry_id)
+            if not postings:
+                del self.postings[tok]
+        del self.norms[entry_id]
+        del self.types[entry_id]
+
+    def search(self, query: str, top_k: int, types: List[str]) -> List[Tuple[float, int]]:
+        if top_k <= 0:
+            return []
+        query_counts = Counter(tokenize(query))
+        query_norm = sum(query_counts.values())
+        candidates: Set[int] = set()
+        if query_norm:
+            for tok in query_counts:
+                candidates.update(self.postings.get(tok, ()))
+        scored: List[Tuple[float, int]] = []
+        for entry_id in candidates:
+            if types and self.types[entry_id] not in types:
+                continue
+            norm = self.norms[entry_id]
+            common = sum((query_counts & self.counts[entry_id]).values())
+            scored.append((common / (query_norm * norm) ** 0.5, entry_id))
+        scored.sort(key=lambda x: (-x[0], x[1]))
+        hits = scored[:top_k]
+        if len(hits) < top_k:
+            # Entries sharing no token score 0.0 and fill the tail in id order
+            # (dict insertion order, since ids are assigned increasing).
+            for entry_id in self.counts:
+                if entry_id in candidates:
+                    continue
+                if types and self.types[entry_id] not in types:
+                    continue
+                hits.append((0.0, entry_id))
+                if len(hits) >= top_k:
+                    break
+        return hits
+
+    def search_batch(self, queries: List[str], top_k: int, types: List[str]) -> List[List[Tuple[float, int]]]:
+        return [self.search(query, top_k, types) for query in queries]
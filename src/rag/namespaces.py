@@ -0,0 +1,92 @@
+import os
+import re
+from typing import Dict, Optional
+
+from .store import RagStore
+
+SCOPES = ("global", "scene", "episode")
+
+
+class RagNamespaces:
+    """One bounded `RagStore` per scene or per episode (or a single global one).
+
+    `rag.scope` picks the key; every store gets the same `rag.capacity` and
+    eviction policy. Episode stores are compacted and dropped by `release()`
+    when the episode ends, so at most one is resident at a time.
+    """
+
+    def __init__(self, output_dir: str, rag_cfg: Dict) -> None:
+        self.scope = rag_cfg.get("scope", "global")
+        if self.scope not in SCOPES:
+            raise ValueError(f"Unknown rag scope: {self.scope}")
+        self.output_dir = output_dir
+        self.store_kwargs = {
+            "backend": rag_cfg.get("backend", "index"),
+            "base_path": rag_cfg.get("base_store"),
+            "capacity": rag_cfg.get("capacity"),
+            "eviction": rag_cfg.get("eviction", "lru"),
+            "recency_decay": float(rag_cfg.get("recency_decay", 0.99)),
+        }
+        self.stores: Dict[str, RagStore] = {}
+        self.opened = 0
+        self.released_evictions = 0
+
+    def namespace(self, scene: str, episode_id: int) -> str:
+        if self.scope == "scene":
+            return re.sub(r"[^A-Za-z0-9_.-]", "_", scene or "unknown")
+        if self.scope == "episode":
+            return f"episode_{episode_id:03d}"
+        return "global"
+
+    def path(self, namespace: str) -> str:
+        if namespace == "global":
+            return os.path.join(self.output_dir, "rag_store.jsonl")
+        return os.path.join(self.output_dir, "rag", f"{namespace}.jsonl")
+
+    def get(self, scene: str, episode_id: int) -> RagStore:
+        namespace = self.namespace(scene, episode_id)
+        store = self.stores.get(namespace)
+        if store is None:
+            store = RagStore(self.path(namespace), **self.store_kwargs)
+            self.stores[namespace] = store
+            self.opened += 1
+        return store
+
+    def release(self, scene: str, episode_id: int) -> Optional[RagStore]:
+        """Compact the episode's store; drop it from memory if episode-scoped."""
+        namespace = self.namespace(scene, episode_id)
+        store = self.stores.get(namespace)
+        if store is None:
+            return None
+        store.compact()
+        if self.scope == "episode":
+            self.released_evictions += store.evicted
+            del self.stores[namespace]
+        return store
+
+    def state(self) -> Dict:
+        return {
+            "opened": self.opened,
+            "released_evictions": self.released_evictions,
+            "stores": {namespace: store.state() for namespace, store in self.stores.items()},
+        }
+
+    def restore(self, state: Dict) -> None:
+        """Reopen the resident stores of a `state()` snapshot exactly as they were."""
+        self.opened = state["opened"]
+        self.released_evictions = state["released_evictions"]
+        self.stores = {}
+        for namespace, store_state in state["stores"].items():
+            store = RagStore(self.path(namespace), **self.store_kwargs)
+            store.restore(store_state)
+            self.stores[namespace] = store
+
+    def stats(self) -> Dict:
+        resident = list(self.stores.values())
+        return {
+            "scope": self.scope,
+            "namespaces_opened": self.opened,
+            "resident_entries": sum(len(store.entries) for store in resident),
+            "max_namespace_entries": max((len(store.entries) for store in resident), default=0),
+            "evicted": self.released_evictions + sum(store.evicted for store in resident),
+        }
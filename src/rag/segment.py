@@ -0,0 +1,289 @@
+"""Read-only binary RAG segment, opened with mmap.
+
+Layout (little endian, every section 8-byte aligned):
+
+    header   magic, version, n_entries, n_tokens, section table
+    ids      int64[n]             entry ids, ascending
+    norms    int64[n]             token count per entry
+    types    int32[n]             index into the types table
+    keys     uint64[n]            content keys (see `store.entry_key`)
+    key_rows int64[n]             rows ordered by key, for binary search
+    text     uint64[n+1] + utf-8  string table of entry texts
+    meta     uint64[n+1] + utf-8  JSON metadata column
+    vocab    uint64[V+1] + utf-8  sorted token strings
+    postings uint64[V+1] + int64[P] rows + int64[P] counts
+    typetab  JSON list of type names
+
+Opening only parses the header and type table; everything else is a
+`numpy.frombuffer` view that the OS pages in on first touch.
+"""
+
+import json
+import mmap
+import os
+import struct
+from collections import Counter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .retrieval import tokenize
+
+MAGIC = b"RAGSEG01"
+VERSION = 1
+_SECTIONS = [
+    "ids",
+    "norms",
+    "types",
+    "keys",
+    "key_rows",
+    "text_offsets",
+    "text_blob",
+    "meta_offsets",
+    "meta_blob",
+    "vocab_offsets",
+    "vocab_blob",
+    "post_offsets",
+    "post_rows",
+    "post_counts",
+    "typetab",
+]
+_HEADER = struct.Struct("<8sIQQ" + "QQ" * len(_SECTIONS))
+
+
+def _pad8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def _string_table(items: List[str]) -> Tuple[bytes, bytes]:
+    encoded = [item.encode("utf-8") for item in items]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+    if encoded:
+        offsets[1:] = np.cumsum([len(b) for b in encoded])
+    return offsets.tobytes(), b"".join(encoded)
+
+
+def write_segment(path: str, entries: List[Dict]) -> None:
+    """Write entries (RagStore dicts with id/key/text/metadata) as a segment."""
+    from .store import entry_key
+
+    entries = sorted(entries, key=lambda e: e["id"])
+    type_names: List[Optional[str]] = []
+    type_codes: Dict[Optional[str], int] = {}
+    postings: Dict[str, List[Tuple[int, int]]] = {}
+    ids, norms, types, keys, texts, metas = [], [], [], [], [], []
+    for row, entry in enumerate(entries):
+        meta = entry.get("metadata", {})
+        text = entry.get("text", "")
+        entry_type = meta.get("type")
+        if entry_type not in type_codes:
+            type_codes[entry_type] = len(type_names)
+            type_names.append(entry_type)
+        counts = Counter(tokenize(text))
+        for tok, count in counts.items():
+            postings.setdefault(tok, []).append((row, count))
+        ids.append(entry["id"])
+        norms.append(sum(counts.values()))
+        types.append(type_codes[entry_type])
+        keys.append(int(entry.get("key") or entry_key(text, entry_type), 16))
+        texts.append(text)
+        metas.append(json.dumps(meta))
+    vocab = sorted(postings)
+    post_offsets = np.zeros(len(vocab) + 1, dtype="<u8")
+    post_rows: List[int] = []
+    post_counts: List[int] = []
+    for idx, tok in enumerate(vocab):
+        for row, count in postings[tok]:
+            post_rows.append(row)
+            post_counts.append(count)
+        post_offsets[idx + 1] = len(post_rows)
+    key_arr = np.asarray(keys, dtype="<u8")
+    key_order = np.argsort(key_arr, kind="stable")
+    text_offsets, text_blob = _string_table(texts)
+    meta_offsets, meta_blob = _string_table(metas)
+    vocab_offsets, vocab_blob = _string_table(vocab)
+    payloads = {
+        "ids": np.asarray(ids, dtype="<i8").tobytes(),
+        "norms": np.asarray(norms, dtype="<i8").tobytes(),
+        "types": np.asarray(types, dtype="<i4").tobytes(),
+        "keys": key_arr.tobytes(),
+        "key_rows": key_order.astype("<i8").tobytes(),
+        "text_offsets": text_offsets,
+        "text_blob": text_blob,
+        "meta_offsets": meta_offsets,
+        "meta_blob": meta_blob,
+        "vocab_offsets": vocab_offsets,
+        "vocab_blob": vocab_blob,
+        "post_offsets": post_offsets.tobytes(),
+        "post_rows": np.asarray(post_rows, dtype="<i8").tobytes(),
+        "post_counts": np.asarray(post_counts, dtype="<i8").tobytes(),
+        "typetab": json.dumps(type_names).encode("utf-8"),
+    }
+    table = []
+    offset = _pad8(_HEADER.size)
+    for name in _SECTIONS:
+        table.extend([offset, len(payloads[name])])
+        offset = _pad8(offset + len(payloads[name]))
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(entries), len(vocab), *table))
+        for name in _SECTIONS:
+            f.write(b"\0" * (_pad8(f.tell()) - f.tell()))
+            f.write(payloads[name])
+    os.replace(tmp_path, path)
+
+
+class Segment:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        fields = _HEADER.unpack_from(self._mm, 0)
+        magic, version, self.n_entries, self.n_tokens = fields[:4]
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a RAG segment (v{VERSION}): {path}")
+        self._sections = {
+            name: (fields[4 + 2 * i], fields[5 + 2 * i]) for i, name in enumerate(_SECTIONS)
+        }
+        self.ids = self._array("ids", "<i8")
+        self.norms = self._array("norms", "<i8")
+        self.types = self._array("types", "<i4")
+        self.keys = self._array("keys", "<u8")
+        self.key_rows = self._array("key_rows", "<i8")
+        self.text_offsets = self._array("text_offsets", "<u8")
+        self.meta_offsets = self._array("meta_offsets", "<u8")
+        self.vocab_offsets = self._array("vocab_offsets", "<u8")
+        self.post_offsets = self._array("post_offsets", "<u8")
+        self.post_rows = self._array("post_rows", "<i8")
+        self.post_counts = self._array("post_counts", "<i8")
+        self.type_names: List[Optional[str]] = json.loads(self._bytes("typetab", 0, None))
+
+    def _array(self, name: str, dtype: str) -> np.ndarray:
+        offset, length = self._sections[name]
+        return np.frombuffer(self._mm, dtype=dtype, count=length // np.dtype(dtype).itemsize, offset=offset)
+
+    def _bytes(self, name: str, start: int, end: Optional[int]) -> bytes:
+        offset, length = self._sections[name]
+        end = length if end is None else end
+        return self._mm[offset + start : offset + end]
+
+    def __len__(self) -> int:
+        return self.n_entries
+
+    def close(self) -> None:
+        self.ids = self.norms = self.types = self.keys = self.key_rows = None
+        self.text_offsets = self.meta_offsets = self.vocab_offsets = None
+        self.post_offsets = self.post_rows = self.post_counts = None
+        self._mm.close()
+        self._file.close()
+
+    @property
+    def max_id(self) -> int:
+        return int(self.ids[-1]) if self.n_entries else -1
+
+    def entry(self, row: int) -> Dict:
+        text = self._bytes("text_blob", int(self.text_offsets[row]), int(self.text_offsets[row + 1]))
+        meta = self._bytes("meta_blob", int(self.meta_offsets[row]), int(self.meta_offsets[row + 1]))
+        return {
+            "id": int(self.ids[row]),
+            "key": f"{int(self.keys[row]):016x}",
+            "text": text.decode("utf-8"),
+            "metadata": json.loads(meta),
+        }
+
+    def get(self, entry_id: int) -> Dict:
+        row = int(np.searchsorted(self.ids, entry_id))
+        if row >= self.n_entries or int(self.ids[row]) != entry_id:
+            raise KeyError(entry_id)
+        return self.entry(row)
+
+    def find_key(self, key: str) -> Optional[int]:
+        """Row holding `key`, by binary search over the sorted key column."""
+        value = int(key, 16)
+        lo, hi = 0, self.n_entries
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if int(self.keys[self.key_rows[mid]]) < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n_entries and int(self.keys[self.key_rows[lo]]) == value:
+            return int(self.key_rows[lo])
+        return None
+
+    def _token(self, idx: int) -> str:
+        start, end = int(self.vocab_offsets[idx]), int(self.vocab_offsets[idx + 1])
+        return self._bytes("vocab_blob", start, end).decode("utf-8")
+
+    def _lookup_token(self, tok: str) -> Optional[int]:
+        lo, hi = 0, self.n_tokens
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._token(mid) < tok:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n_tokens and self._token(lo) == tok:
+            return lo
+        return None
+
+    def _type_allowed(self, types: List[str]) -> Optional[np.ndarray]:
+        if not types:
+            return None
+        allowed = np.zeros(len(self.type_names), dtype=bool)
+        for code, name in enumerate(self.type_names):
+            allowed[code] = name in types
+        return allowed
+
+    def search(self, query: str, top_k: int, types: List[str]) -> List[Tuple[float, int]]:
+        """Same scores and ordering as `InvertedIndex.search`, read from the mmap."""
+        if top_k <= 0:
+            return []
+        allowed = self._type_allowed(types)
+        query_counts = Counter(tokenize(query))
+        query_norm = sum(query_counts.values())
+        common: Dict[int, int] = {}
+        if query_norm:
+            for tok, q_count in query_counts.items():
+                idx = self._lookup_token(tok)
+                if idx is None:
+                    continue
+                start, end = int(self.post_offsets[idx]), int(self.post_offsets[idx + 1])
+                for row, count in zip(self.post_rows[start:end].tolist(), self.post_counts[start:end].tolist()):
+                    common[row] = common.get(row, 0) + min(q_count, count)
+        scored = []
+        for row, overlap in common.items():
+            if allowed is not None and not allowed[self.types[row]]:
+                continue
+            scored.append((overlap / (query_norm * int(self.norms[row])) ** 0.5, row))
+        scored.sort(key=lambda x: (-x[0], x[1]))
+        hits = scored[:top_k]
+        row = 0
+        while len(hits) < top_k and row < self.n_entries:
+            if row not in common and (allowed is None or allowed[self.types[row]]):
+                hits.append((0.0, row))
+            row += 1
+        return [(score, int(self.ids[r])) for score, r in hits]
+
+    def iter_entries(self) -> Iterator[Dict]:
+        for row in range(self.n_entries):
+            yield self.entry(row)
+
+
+def jsonl_to_segment(jsonl_path: str, segment_path: str) -> int:
+    from .store import RagStore
+
+    store = RagStore(jsonl_path)
+    write_segment(segment_path, store.all())
+    return len(store.all())
+
+
+def segment_to_jsonl(segment_path: str, jsonl_path: str) -> int:
+    segment = Segment(segment_path)
+    count = 0
+    with open(jsonl_path, "w", encoding="utf-8") as f:
+        for entry in segment.iter_entries():
+            f.write(json.dumps(entry) + "\n")
+            count += 1
+    segment.close()
+    return count
@@ -0,0 +1,195 @@
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .retrieval import tokenize
+
+
+class SparseIndex:
+    """CSR term-count matrix over the store, scored for many queries at once.
+
+    `retrieval.similarity` is a multiset overlap (sum of per-token minimum
+    counts), not a dot product. A query batch is kept sparse too, as the
+    (query, column, count) triples of its known tokens; each triple walks
+    its column's postings in a column-sorted copy of the matrix, and the
+    per-posting minimums are summed per (query, row). Work grows with the
+    postings of the queried terms, not with the vocabulary or the whole
+    matrix. Overlaps are sums of small integers, so they are exact and
+    scores/rankings match `InvertedIndex` bit for bit.
+
+    Each column tracks its document frequency over live and pending rows; a
+    term whose last row is removed leaves the vocabulary and its column is
+    reused by the next new term (tombstoned rows are masked out of results,
+    so their stale column entries never rank).
+    """
+
+    def __init__(self) -> None:
+        self.vocab: Dict[str, int] = {}
+        # Per column: document frequency and term (None once freed), plus freed columns.
+        self._df: List[int] = []
+        self._terms: List[Optional[str]] = []
+        self._free: List[int] = []
+        self.type_codes: Dict[Optional[str], int] = {}
+        self.row_ids = np.zeros(0, dtype=np.int64)
+        self.row_types = np.zeros(0, dtype=np.int32)
+        self.row_norms = np.zeros(0, dtype=np.int64)
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int64)
+        self.data = np.zeros(0, dtype=np.int64)
+        self.alive = np.zeros(0, dtype=bool)
+        self._dead = 0
+        self._pending: List[Tuple[int, int, Counter]] = []
+        # Column-sorted (col_ptr, rows, counts) view of the matrix, rebuilt after it changes.
+        self._postings: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+
+    def __len__(self) -> int:
+        return len(self.row_ids) - self._dead + len(self._pending)
+
+    def add(self, entry_id: int, text: str, entry_type: Optional[str]) -> None:
+        counts = Counter(tokenize(text))
+        for tok in counts:
+            col = self.vocab.get(tok)
+            if col is None:
+                if self._free:
+                    col = self._free.pop()
+                    self._terms[col] = tok
+                else:
+                    col = len(self._df)
+                    self._df.append(0)
+                    self._terms.append(tok)
+                self.vocab[tok] = col
+            self._df[col] += 1
+        type_code = self.type_codes.setdefault(entry_type, len(self.type_codes))
+        self._pending.append((entry_id, type_code, counts))
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        ids, types, norms, lengths, cols, vals = [], [], [], [], [], []
+        for entry_id, type_code, counts in self._pending:
+            ids.append(entry_id)
+            types.append(type_code)
+            norms.append(sum(counts.values()))
+            lengths.append(len(counts))
+            cols.extend(self.vocab[tok] for tok in counts)
+            vals.extend(counts.values())
+        self._pending = []
+        self._postings = None
+        self.row_ids = np.concatenate([self.row_ids, np.asarray(ids, dtype=np.int64)])
+        self.row_types = np.concatenate([self.row_types, np.asarray(types, dtype=np.int32)])
+        self.row_norms = np.concatenate([self.row_norms, np.asarray(norms, dtype=np.int64)])
+        self.alive = np.concatenate([self.alive, np.ones(len(ids), dtype=bool)])
+        offsets = self.indptr[-1] + np.cumsum(np.asarray(lengths, dtype=np.int64))
+        self.indptr = np.concatenate([self.indptr, offsets])
+        self.indices = np.concatenate([self.indices, np.asarray(cols, dtype=np.int64)])
+        self.data = np.concatenate([self.data, np.asarray(vals, dtype=np.int64)])
+
+    def remove(self, entry_id: int) -> None:
+        """Tombstone a row; rows are physically dropped once half are dead."""
+        self._flush()
+        row = int(np.searchsorted(self.row_ids, entry_id))
+        if row >= len(self.row_ids) or self.row_ids[row] != entry_id or not self.alive[row]:
+            raise KeyError(entry_id)
+        self.alive[row] = False
+        self._dead += 1
+        for col in self.indices[self.indptr[row] : self.indptr[row + 1]].tolist():
+            self._df[col] -= 1
+            if self._df[col] == 0:
+                del self.vocab[self._terms[col]]
+                self._terms[col] = None
+                self._free.append(col)
+        if self._dead * 2 > len(self.row_ids):
+            self._drop_dead_rows()
+
+    def _drop_dead_rows(self) -> None:
+        keep = self.alive
+        lengths = np.diff(self.indptr)
+        nnz_keep = np.repeat(keep, lengths)
+        self.indices = self.indices[nnz_keep]
+        self.data = self.data[nnz_keep]
+        self.indptr = np.concatenate([[0], np.cumsum(lengths[keep])]).astype(np.int64)
+        self.row_ids = self.row_ids[keep]
+        self.row_types = self.row_types[keep]
+        self.row_norms = self.row_norms[keep]
+        self.alive = np.ones(len(self.row_ids), dtype=bool)
+        self._dead = 0
+        self._postings = None
+
+    def _column_postings(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if self._postings is None:
+            order = np.argsort(self.indices, kind="stable")
+            rows = np.repeat(np.arange(len(self.row_ids), dtype=np.int64), np.diff(self.indptr))
+            col_ptr = np.zeros(len(self._df) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.indices, minlength=len(self._df)), out=col_ptr[1:])
+            self._postings = (col_ptr, rows[order], self.data[order])
+        return self._postings
+
+    def _query_terms(self, queries: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """(query row, column, count) of every known query token, plus each query's token count."""
+        q_rows, q_cols, q_counts = [], [], []
+        norms = np.zeros(len(queries), dtype=np.int64)
+        for row, query in enumerate(queries):
+            counts = Counter(tokenize(query))
+            norms[row] = sum(counts.values())
+            for tok, count in counts.items():
+                col = self.vocab.get(tok)
+                if col is not None:
+                    q_rows.append(row)
+                    q_cols.append(col)
+                    q_counts.append(count)
+        return (
+            np.asarray(q_rows, dtype=np.int64),
+            np.asarray(q_cols, dtype=np.int64),
+            np.asarray(q_counts, dtype=np.int64),
+            norms,
+        )
+
+    def score_batch(self, queries: List[str]) -> np.ndarray:
+        """Return a (len(queries), n_rows) float64 matrix of similarity scores."""
+        self._flush()
+        n_rows = len(self.row_ids)
+        q_rows, q_cols, q_counts, q_norms = self._query_terms(queries)
+        col_ptr, post_rows, post_counts = self._column_postings()
+        starts = col_ptr[q_cols]
+        lengths = col_ptr[q_cols + 1] - starts
+        # Index of every posting of every query term, grouped by term.
+        group_start = np.cumsum(lengths) - lengths
+        idx = np.arange(int(lengths.sum()), dtype=np.int64) + np.repeat(starts - group_start, lengths)
+        overlap = np.minimum(np.repeat(q_counts, lengths), post_counts[idx])
+        cells = np.repeat(q_rows, lengths) * n_rows + post_rows[idx]
+        common = np.bincount(cells, weights=overlap, minlength=len(queries) * n_rows).reshape(len(queries), n_rows)
+        denom = (q_norms[:, None] * self.row_norms[None, :]) ** 0.5
+        scores = np.zeros(common.shape, dtype=np.float64)
+        np.divide(common, denom, out=scores, where=denom > 0)
+        return scores
+
+    def _type_mask(self, types: List[str]) -> Optional[np.ndarray]:
+        if not types:
+            return self.alive if self._dead else None
+        codes = [self.type_codes[t] for t in types if t in self.type_codes]
+        return np.isin(self.row_types, np.asarray(codes, dtype=np.int32)) & self.alive
+
+    def _top_k(self, scores: np.ndarray, top_k: int, mask: Optional[np.ndarray]) -> List[Tuple[float, int]]:
+        rows = np.arange(len(scores)) if mask is None else np.flatnonzero(mask)
+        k = min(top_k, len(rows))
+        if k <= 0:
+            return []
+        row_scores = scores[rows]
+        if k < len(rows):
+            kth = np.argpartition(-row_scores, k - 1)[:k]
+            # Keep every row tied with the k-th score so ties resolve by id, not by partition order.
+            keep = row_scores >= row_scores[kth].min()
+            rows, row_scores = rows[keep], row_scores[keep]
+        order = np.lexsort((self.row_ids[rows], -row_scores))[:k]
+        return [(float(row_scores[i]), int(self.row_ids[rows[i]])) for i in order]
+
+    def search_batch(self, queries: List[str], top_k: int, types: List[str]) -> List[List[Tuple[float, int]]]:
+        if not queries:
+            return []
+        scores = self.score_batch(queries)
+        mask = self._type_mask(types)
+        return [self._top_k(row, top_k, mask) for row in scores]
+
+    def search(self, query: str, top_k: int, types: List[str]) -> List[Tuple[float, int]]:
+        return self.search_batch([query], top_k, types)[0]
@@ -1,35 +1,288 @@
+import hashlib
+import heapq
 import json
+import math
 import os
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
+
+from .index import InvertedIndex
+
+
+EVICTION_POLICIES = ("lru", "lfu", "recency")
+
+
+def make_index(backend: str):
+    if backend == "index":
+        return InvertedIndex()
+    if backend == "sparse":
+        from .sparse_index import SparseIndex
+
+        return SparseIndex()
+    raise ValueError(f"Unknown rag backend: {backend}")
+
+
+def entry_key(text: str, entry_type: Optional[str]) -> str:
+    payload = f"{entry_type or ''}\x00{text}".encode("utf-8")
+    return hashlib.sha1(payload).hexdigest()[:16]
 
 
 class RagStore:
-    def __init__(self, path: str) -> None:
+    """Append-only JSONL store with one entry per distinct (type, text).
+
+    Repeated upserts only bump `hits` / `last_seen_step` in memory; `compact()`
+    rewrites the file so the counters persist and legacy duplicates collapse.
+
+    `base_path` optionally mounts a read-only binary segment (see `segment.py`)
+    shared across runs; it is searched in place and ranks as if its entries
+    preceded the local ones.
+
+    With `capacity` set, local entries beyond it are evicted (and dropped from
+    the file on the next `compact()`): `lru` by last retrieval, `lfu` by hit
+    count, or `recency` by hits decayed by `recency_decay` per tick since the
+    entry was last upserted. The store clock ticks once per upsert/retrieve.
+    Victims come off a lazy min-heap of eviction keys: every key change pushes
+    a new item and outdated ones are skipped when popped.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        backend: str = "index",
+        base_path: Optional[str] = None,
+        capacity: Optional[int] = None,
+        eviction: str = "lru",
+        recency_decay: float = 0.99,
+    ) -> None:
+        if eviction not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown eviction policy: {eviction}")
+        if eviction == "recency" and recency_decay <= 0:
+            raise ValueError("recency_decay must be positive")
         self.path = path
+        self.backend = backend
+        self.capacity = capacity
+        self.eviction = eviction
+        self.recency_decay = recency_decay
+        self.clock = 0
+        self.evicted = 0
+        # Eviction bookkeeping stays out of the persisted entries: entry id -> clock tick.
+        self._last_seen: Dict[int, int] = {}
+        self._last_retrieved: Dict[int, int] = {}
+        self._heap: List[Tuple[float, int]] = []
+        self.base = None
+        self.base_hits: Dict[str, int] = {}
+        if base_path:
+            from .segment import Segment
+
+            self.base = Segment(base_path)
         os.makedirs(os.path.dirname(path), exist_ok=True)
         if not os.path.exists(path):
             with open(path, "w", encoding="utf-8"):
                 pass
-        self.entries: List[Dict] = self._load()
+        self.index = make_index(backend)
+        self._by_id: Dict[int, Dict] = {}
+        self._by_key: Dict[str, Dict] = {}
+        self._next_id = self.base.max_id + 1 if self.base is not None else 0
+        for entry in self._load():
+            self._index_entry(entry)
+        self._rebuild_heap()
+        self._evict()
+
+    @property
+    def entries(self) -> List[Dict]:
+        """Local entries in insertion order."""
+        return list(self._by_id.values())
 
     def _load(self) -> List[Dict]:
         entries = []
+        by_key: Dict[str, Dict] = {}
         with open(self.path, "r", encoding="utf-8") as f:
             for line in f:
                 line = line.strip()
                 if not line:
                     continue
                 entry = json.loads(line)
+                meta = entry.setdefault("metadata", {})
+                key = entry.get("key") or entry_key(entry.get("text", ""), meta.get("type"))
+                entry["key"] = key
+                meta.setdefault("hits", 1)
                 if "id" not in entry:
-                    entry["id"] = len(entries)
+                    entry["id"] = self._next_id
+                # Never reuse a legacy id, even a folded one: old step logs reference them.
+                self._next_id = max(self._next_id, entry["id"] + 1)
+                existing = by_key.get(key)
+                if existing is not None:
+                    # Legacy files repeat identical texts; fold them into the first one.
+                    old_meta = existing["metadata"]
+                    old_meta["hits"] += meta["hits"]
+                    if meta.get("last_seen_step") is not None:
+                        old_meta["last_seen_step"] = meta["last_seen_step"]
+                    continue
+                by_key[key] = entry
                 entries.append(entry)
         return entries
 
-    def upsert(self, text: str, metadata: Dict) -> None:
-        entry = {"id": len(self.entries), "text": text, "metadata": metadata}
-        self.entries.append(entry)
+    def _index_entry(self, entry: Dict) -> None:
+        self._by_id[entry["id"]] = entry
+        self._by_key[entry["key"]] = entry
+        meta = entry.get("metadata", {})
+        self.index.add(entry["id"], entry.get("text", ""), meta.get("type"))
+
+    def _eviction_key(self, entry: Dict) -> float:
+        """Eviction order key; the lowest goes first.
+
+        `recency` scores all decay by the same factor per tick, so the
+        clock-free log score keeps their order.
+        """
+        hits = entry["metadata"].get("hits", 1)
+        if self.eviction == "lfu":
+            return hits
+        if self.eviction == "recency":
+            return math.log(hits) - self._last_seen.get(entry["id"], 0) * math.log(self.recency_decay)
+        return self._last_retrieved.get(entry["id"], 0)
+
+    def _touch(self, entry: Dict) -> None:
+        if self.capacity is None:
+            return
+        heapq.heappush(self._heap, (self._eviction_key(entry), entry["id"]))
+        if len(self._heap) > 2 * len(self._by_id) + 64:
+            self._rebuild_heap()
+
+    def _rebuild_heap(self) -> None:
+        if self.capacity is None:
+            return
+        self._heap = [(self._eviction_key(entry), entry_id) for entry_id, entry in self._by_id.items()]
+        heapq.heapify(self._heap)
+
+    def _drop(self, entry: Dict) -> None:
+        del self._by_id[entry["id"]]
+        del self._by_key[entry["key"]]
+        self.index.remove(entry["id"])
+        self._last_seen.pop(entry["id"], None)
+        self._last_retrieved.pop(entry["id"], None)
+        self.evicted += 1
+
+    def _evict(self, keep: Optional[Dict] = None) -> None:
+        if self.capacity is None:
+            return
+        kept = []
+        while len(self._by_id) > self.capacity and self._heap:
+            # Lowest key loses; older ids lose ties. Never evict the entry just added.
+            key, entry_id = heapq.heappop(self._heap)
+            entry = self._by_id.get(entry_id)
+            if entry is None or key != self._eviction_key(entry):
+                continue  # already evicted, or pushed again with a newer key
+            if entry is keep:
+                kept.append((key, entry_id))
+                continue
+            self._drop(entry)
+        for item in kept:
+            heapq.heappush(self._heap, item)
+
+    def upsert(self, text: str, metadata: Dict, step: Optional[int] = None) -> Dict:
+        self.clock += 1
+        key = entry_key(text, metadata.get("type"))
+        entry = self._by_key.get(key)
+        if entry is not None:
+            meta = entry["metadata"]
+            hits = meta.get("hits", 1) + 1
+            meta.update(metadata)
+            meta["hits"] = hits
+            meta["last_seen_step"] = step
+            self._last_seen[entry["id"]] = self.clock
+            self._touch(entry)
+            return entry
+        if self.base is not None:
+            row = self.base.find_key(key)
+            if row is not None:
+                # The segment is read-only; keep its hit counts as an in-memory overlay.
+                self.base_hits[key] = self.base_hits.get(key, 0) + 1
+                return self.base.entry(row)
+        meta = dict(metadata)
+        meta["hits"] = 1
+        meta["last_seen_step"] = step
+        entry = {"id": self._next_id, "key": key, "text": text, "metadata": meta}
+        self._next_id += 1
+        # A fresh entry counts as just used so LRU does not evict it before it can be retrieved.
+        self._last_seen[entry["id"]] = self.clock
+        self._last_retrieved[entry["id"]] = self.clock
+        self._index_entry(entry)
+        self._touch(entry)
         with open(self.path, "a", encoding="utf-8") as f:
             f.write(json.dumps(entry) + "\n")
+        self._evict(keep=entry)
+        return entry
+
+    def compact(self) -> None:
+        """Rewrite the JSONL with one line per entry and current counters."""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in self.entries:
+                f.write(json.dumps(entry) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def state(self) -> Dict:
+        """Entries plus the in-memory clock and eviction bookkeeping, JSON-serializable."""
+        return {
+            "entries": self.entries,
+            "clock": self.clock,
+            "evicted": self.evicted,
+            "next_id": self._next_id,
+            "last_seen": self._last_seen,
+            "last_retrieved": self._last_retrieved,
+            "base_hits": self.base_hits,
+        }
+
+    def restore(self, state: Dict) -> None:
+        """Replace this store with a `state()` snapshot and rewrite the file to match it."""
+        self.index = make_index(self.backend)
+        self._by_id = {}
+        self._by_key = {}
+        for entry in state["entries"]:
+            self._index_entry(entry)
+        self.clock = state["clock"]
+        self.evicted = state["evicted"]
+        self._next_id = state["next_id"]
+        # JSON object keys come back as strings.
+        self._last_seen = {int(k): v for k, v in state["last_seen"].items()}
+        self._last_retrieved = {int(k): v for k, v in state["last_retrieved"].items()}
+        self.base_hits = dict(state["base_hits"])
+        self._rebuild_heap()
+        self.compact()
+
+    def _resolve(self, hits: List[Tuple[float, int]], query: str, top_k: int, types: List[str]) -> List[Dict]:
+        if self.base is not None:
+            hits = sorted(hits + self.base.search(query, top_k, types), key=lambda x: (-x[0], x[1]))
+            hits = hits[:top_k]
+        self.clock += 1
+        resolved = []
+        for _, entry_id in hits:
+            entry = self._by_id.get(entry_id)
+            if entry is None:
+                resolved.append(self.base.get(entry_id))
+                continue
+            self._last_retrieved[entry_id] = self.clock
+            if self.eviction == "lru":
+                self._touch(entry)
+            resolved.append(entry)
+        return resolved
+
+    def retrieve(self, query: str, top_k: int, types: List[str]) -> List[Dict]:
+        """Indexed equivalent of `retrieval.retrieve(self.all(), ...)`."""
+        return self._resolve(self.index.search(query, top_k, types), query, top_k, types)
+
+    def retrieve_batch(self, queries: List[str], top_k: int, types: List[str]) -> List[List[Dict]]:
+        """Score several queries (e.g. one per parallel episode) in one pass."""
+        batch = self.index.search_batch(queries, top_k, types)
+        return [self._resolve(hits, query, top_k, types) for hits, query in zip(batch, queries)]
 
     def all(self) -> List[Dict]:
         return self.entries
+
+
+def compact_file(path: str) -> Dict[str, int]:
+    """Offline compaction of a (possibly legacy, duplicated) store file."""
+    with open(path, "r", encoding="utf-8") as f:
+        lines_before = sum(1 for line in f if line.strip())
+    store = RagStore(path)
+    store.compact()
+    return {"lines_before": lines_before, "entries_after": len(store.entries)}
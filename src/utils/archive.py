@@ -0,0 +1,106 @@
+import json
+import os
+import threading
+import zlib
+from typing import Dict, Iterator, List, Optional
+
+
+class DebugArchive:
+    """Append-only record file holding one episode's debug payloads.
+
+    `<path>` is the concatenated payload bytes; `<path>.idx` gets one JSON
+    line per record, `{"name", "offset", "length", "crc32"}`, where `name` is
+    the file's path relative to the run directory in the unpacked layout
+    (e.g. `frames/episode_000/step_00003.png`). Two appends per record, no
+    per-step file creation. The index line is written after its payload, so
+    a crash can only lose the tail, never point at missing bytes.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._data = open(path, "ab")
+        self._index = open(path + ".idx", "a", encoding="utf-8")
+        self._offset = self._data.tell()
+        self.records = 0
+        # The frame encoder and the episode's I/O path add records from different threads.
+        self._lock = threading.Lock()
+
+    def add(self, name: str, payload: bytes) -> None:
+        with self._lock:
+            self._data.write(payload)
+            entry = {"name": name, "offset": self._offset, "length": len(payload), "crc32": zlib.crc32(payload)}
+            self._offset += len(payload)
+            # The payload must reach the file before an index line can refer to it.
+            self._data.flush()
+            self._index.write(json.dumps(entry) + "\n")
+            self.records += 1
+
+    def add_text(self, name: str, text: str) -> None:
+        self.add(name, text.encode("utf-8"))
+
+    def close(self) -> None:
+        self._data.close()
+        self._index.close()
+
+
+class ArchiveReader:
+    """Random access to a `DebugArchive` by record name (last write of a name wins)."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        size = os.path.getsize(path)
+        self.entries: Dict[str, Dict] = {}
+        with open(path + ".idx", "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # torn last line
+                if entry["offset"] + entry["length"] > size:
+                    break
+                self.entries[entry["name"]] = entry
+        self._file = open(path, "rb")
+
+    def names(self, prefix: str = "") -> List[str]:
+        return sorted(name for name in self.entries if name.startswith(prefix))
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.entries
+
+    def read(self, name: str) -> bytes:
+        entry = self.entries[name]
+        self._file.seek(entry["offset"])
+        payload = self._file.read(entry["length"])
+        if zlib.crc32(payload) != entry["crc32"]:
+            raise ValueError(f"{self.path}: checksum mismatch for {name}")
+        return payload
+
+    def read_text(self, name: str) -> str:
+        return self.read(name).decode("utf-8")
+
+    def get_text(self, name: str) -> Optional[str]:
+        return self.read_text(name) if name in self.entries else None
+
+    def extract(self, out_dir: str, prefix: str = "") -> int:
+        """Write every record back to `out_dir/<name>`; return the number written."""
+        count = 0
+        for name in self.names(prefix):
+            target = os.path.join(out_dir, name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as f:
+                f.write(self.read(name))
+            count += 1
+        return count
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def iter_archives(run_dir: str) -> Iterator[str]:
+    debug_dir = os.path.join(run_dir, "debug")
+    if not os.path.isdir(debug_dir):
+        return
+    for name in sorted(os.listdir(debug_dir)):
+        if name.endswith(".rec"):
+            yield os.path.join(debug_dir, name)
@@ -130,8 +130,8 @@ def extract_start_pose(ep: Dict) -> Optional[Dict[str, Any]]:
     if isinstance(agent_pose, dict):
         position = agent_pose.get("position")
         rotation = agent_pose.get("rotation")
-        horizon = agent_pose.get("horizon") or agent_pose.get("cameraHorizon")
-        standing = agent_pose.get("standing") or agent_pose.get("isStanding")
+        horizon = _pick_pose_field(agent_pose, ["horizon", "cameraHorizon"])
+        standing = _pick_pose_field(agent_pose, ["standing", "isStanding"])
         if isinstance(rotation, (int, float)):
             rotation = {"x": 0.0, "y": float(rotation), "z": 0.0}
         return {
@@ -144,8 +144,8 @@ def extract_start_pose(ep: Dict) -> Optional[Dict[str, Any]]:
     if isinstance(pose, dict):
         position = pose.get("position") or pose.get("pos")
         rotation = pose.get("rotation") or pose.get("rot")
-        horizon = pose.get("horizon") or pose.get("cameraHorizon")
-        standing = pose.get("standing") or pose.get("isStanding")
+        horizon = _pick_pose_field(pose, ["horizon", "cameraHorizon"])
+        standing = _pick_pose_field(pose, ["standing", "isStanding"])
         if isinstance(rotation, (int, float)):
             rotation = {"x": 0.0, "y": float(rotation), "z": 0.0}
         return {
@@ -200,3 +200,29 @@ def pick_episode(episodes: List[Dict], idx: int) -> Tuple[str, str, Dict]:
     if scene is None or target is None:
         raise ValueError("Episode missing scene or target fields")
     return scene, target, ep
+
+
+def build_episode_spec(cfg: Dict, episodes: Optional[List[Dict]], idx: int) -> Dict[str, Any]:
+    """Scene/target/start pose for run index `idx`, from the dataset or the fallback lists."""
+    if episodes:
+        scene, target, ep = pick_episode(episodes, idx)
+        start_pose = extract_start_pose(ep)
+    else:
+        target = cfg["run"]["target_objects"][idx % len(cfg["run"]["target_objects"])]
+        scene = cfg["run"]["scenes"][idx % len(cfg["run"]["scenes"])]
+        ep = None
+        start_pose = None
+    return {"episode_id": idx, "scene": scene, "target": target, "episode": ep, "start_pose": start_pose}
+
+
+def apply_episode(cfg: Dict, spec: Dict[str, Any]) -> Dict:
+    """Set the per-episode target keys that `run_episode` reads from cfg."""
+    target = spec["target"]
+    cfg["target"] = target
+    cfg["target_object_type"] = target
+    cfg["target_prompt"] = str(target).lower()
+    if spec.get("episode") is not None:
+        cfg["episode_meta"] = spec["episode"]
+    else:
+        cfg.pop("episode_meta", None)
+    return cfg
@@ -0,0 +1,150 @@
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .archive import DebugArchive
+from .pipeline import BackgroundWorker
+
+
+class FrameEncoder(BackgroundWorker):
+    """Encodes an episode's frames and video on its own thread.
+
+    `submit` only enqueues the array, so the agent loop never waits on
+    colour conversion, resizing or compression. Frames go to
+    `frames_dir/step_XXXXX.<png|jpg>` (or into `archive` under the same
+    relative name) and/or one video. When the agent collided and the view is
+    pixel-identical to the last stored frame, no image is written; a line in
+    `frames_dir/unchanged.jsonl` (an `unchanged_XXXXX.json` record in an
+    archive) points at the step whose image to reuse.
+    With `drop_when_full`, a full queue drops the frame instead of blocking.
+    """
+
+    failure = "frame encoder failed"
+
+    def __init__(
+        self,
+        frames_dir: Optional[str] = None,
+        video_path: Optional[str] = None,
+        archive: Optional[DebugArchive] = None,
+        archive_root: str = "",
+        image_format: str = "png",
+        jpeg_quality: int = 90,
+        scale: float = 1.0,
+        codec: str = "mp4v",
+        fps: float = 10.0,
+        skip_unchanged: bool = False,
+        maxsize: int = 64,
+        drop_when_full: bool = False,
+    ) -> None:
+        if image_format not in ("png", "jpg"):
+            raise ValueError("image_format must be png or jpg")
+        self.frames_dir = frames_dir
+        self.video_path = video_path
+        self.archive = archive
+        self.archive_root = archive_root
+        self.image_format = image_format
+        self.jpeg_quality = int(jpeg_quality)
+        self.scale = float(scale)
+        self.codec = codec
+        self.fps = float(fps)
+        self.skip_unchanged = skip_unchanged
+        self.drop_when_full = drop_when_full
+        self.stats = {
+            "submitted": 0,
+            "images": 0,
+            "video_frames": 0,
+            "unchanged": 0,
+            "dropped": 0,
+            "max_backlog": 0,
+            "encode_s": 0.0,
+        }
+        if frames_dir and archive is None:
+            os.makedirs(frames_dir, exist_ok=True)
+        if video_path:
+            os.makedirs(os.path.dirname(video_path), exist_ok=True)
+        self._cv2 = None
+        self._video = None
+        self._last_stored: Optional[Tuple[int, np.ndarray]] = None
+        super().__init__("frame_encoder", maxsize=maxsize)
+
+    def submit(self, step_idx: int, frame: np.ndarray, save_image: bool, collided: bool = False) -> bool:
+        """Queue `frame`; return False if it was dropped."""
+        self._raise_error()
+        self.stats["submitted"] += 1
+        if not self._put((step_idx, frame, save_image, collided), block=not self.drop_when_full):
+            self.stats["dropped"] += 1
+            return False
+        self.stats["max_backlog"] = max(self.stats["max_backlog"], self.backlog)
+        return True
+
+    def close(self) -> Dict:
+        """Encode what is queued, release the video and return the counters."""
+        super().close()
+        stats = dict(self.stats)
+        stats["encode_s"] = round(self.busy_s, 6)
+        return stats
+
+    def _process(self, items: List[Tuple], final: bool) -> None:
+        # After an error the rest is only drained, so a blocked submit() can still reach it.
+        if self.error is not None:
+            return
+        if self._cv2 is None:
+            import cv2
+
+            self._cv2 = cv2
+        for item in items:
+            self._encode(self._cv2, *item)
+
+    def _finish(self) -> None:
+        if self._video is not None:
+            self._video.release()
+            self._video = None
+
+    def _encode(self, cv2, step_idx: int, frame: np.ndarray, save_image: bool, collided: bool) -> None:
+        bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        if self.scale != 1.0:
+            bgr = cv2.resize(bgr, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        if self.video_path:
+            if self._video is None:
+                fourcc = cv2.VideoWriter_fourcc(*self.codec)
+                self._video = cv2.VideoWriter(self.video_path, fourcc, self.fps, (bgr.shape[1], bgr.shape[0]))
+            self._video.write(bgr)
+            self.stats["video_frames"] += 1
+        if not save_image or not self.frames_dir:
+            return
+        if (
+            self.skip_unchanged
+            and collided
+            and self._last_stored is not None
+            and np.array_equal(self._last_stored[1], frame)
+        ):
+            self._write_unchanged(step_idx, self._last_stored[0])
+            return
+        if self.image_format == "jpg":
+            ok, buf = cv2.imencode(".jpg", bgr, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        else:
+            ok, buf = cv2.imencode(".png", bgr)
+        if not ok:
+            raise ValueError(f"{self.image_format} encoding failed for step {step_idx}")
+        self._store(f"step_{step_idx:05d}.{self.image_format}", buf.tobytes())
+        self._last_stored = (step_idx, frame)
+        self.stats["images"] += 1
+
+    def _store(self, name: str, payload: bytes) -> None:
+        path = os.path.join(self.frames_dir, name)
+        if self.archive is not None:
+            self.archive.add(os.path.relpath(path, self.archive_root), payload)
+            return
+        with open(path, "wb") as f:
+            f.write(payload)
+
+    def _write_unchanged(self, step_idx: int, same_as: int) -> None:
+        line = json.dumps({"step_idx": step_idx, "same_as": same_as}) + "\n"
+        self.stats["unchanged"] += 1
+        if self.archive is not None:
+            self._store(f"unchanged_{step_idx:05d}.json", line.encode("utf-8"))
+            return
+        with open(os.path.join(self.frames_dir, "unchanged.jsonl"), "a", encoding="utf-8") as f:
+            f.write(line)
@@ -0,0 +1,138 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+
+class StageTimer:
+    """Wall-clock seconds per named stage, per step and accumulated over the episode."""
+
+    def __init__(self) -> None:
+        self.step: Dict[str, float] = {}
+        self.total: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float) -> None:
+        self.step[name] = self.step.get(name, 0.0) + seconds
+        self.total[name] = self.total.get(name, 0.0) + seconds
+
+    def next_step(self) -> Dict[str, float]:
+        """Return this step's timings (rounded) and start a new step."""
+        snapshot = {name: round(sec, 6) for name, sec in self.step.items()}
+        self.step = {}
+        return snapshot
+
+    def totals(self) -> Dict[str, float]:
+        return {name: round(sec, 6) for name, sec in self.total.items()}
+
+
+class BackgroundWorker:
+    """Single daemon thread draining a bounded queue in FIFO order.
+
+    One thread keeps ordering (video frames, appends to one file) without
+    locks. The base runs submitted `(fn, args, kwargs)` jobs; subclasses
+    queue their own items and override `_process`, which gets up to
+    `max_batch` items at a time plus whether the queue is being closed.
+    The first error is kept and re-raised on the next `submit`, `flush` or
+    `close`, while the thread keeps draining so a blocked producer gets
+    there. `busy_s` is time spent processing, i.e. work taken off the
+    caller's thread; `close()` drains the queue and reports how long the
+    caller waited.
+    """
+
+    failure = "background worker failed"
+
+    def __init__(self, name: str = "io", maxsize: int = 256, max_batch: int = 1) -> None:
+        self._queue: "queue.Queue[Optional[Any]]" = queue.Queue(maxsize=maxsize)
+        self.max_batch = max_batch
+        self.busy_s = 0.0
+        self.jobs = 0
+        self.error: Optional[BaseException] = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    @property
+    def backlog(self) -> int:
+        return self._queue.qsize()
+
+    def _raise_error(self) -> None:
+        if self.error is not None:
+            raise RuntimeError(self.failure) from self.error
+
+    def _put(self, item: Any, block: bool = True) -> bool:
+        """Queue `item`; without `block`, return False instead of waiting on a full queue."""
+        self._raise_error()
+        try:
+            self._queue.put(item, block=block)
+        except queue.Full:
+            return False
+        return True
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while batch[-1] is not None and len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            items = [item for item in batch if item is not None]
+            start = time.perf_counter()
+            try:
+                if items or stop:
+                    self._process(items, stop)
+            except BaseException as exc:  # surfaced on the next call
+                if self.error is None:
+                    self.error = exc
+            if items:
+                self.busy_s += time.perf_counter() - start
+                self.jobs += len(items)
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                break
+        try:
+            self._finish()
+        except BaseException as exc:
+            if self.error is None:
+                self.error = exc
+
+    def _process(self, items: List[Any], final: bool) -> None:
+        for fn, args, kwargs in items:
+            try:
+                fn(*args, **kwargs)
+            except BaseException as exc:  # later jobs still run
+                if self.error is None:
+                    self.error = exc
+
+    def _finish(self) -> None:
+        """Runs on the worker thread after the last item, e.g. to close handles."""
+
+    def submit(self, fn: Callable, *args, **kwargs) -> None:
+        self._put((fn, args, kwargs))
+
+    def flush(self) -> None:
+        """Block until everything queued so far is processed."""
+        self._queue.join()
+        self._raise_error()
+
+    def close(self) -> float:
+        """Finish queued items; return seconds the caller spent waiting for them."""
+        start = time.perf_counter()
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+        waited = time.perf_counter() - start
+        self._raise_error()
+        return waited
@@ -0,0 +1,157 @@
+import json
+import os
+import shutil
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from ..metrics.hallucinations import count_hallucinations
+from ..rag.namespaces import RagNamespaces
+from .jsonl import dump_jsonl
+from .shards import MERGED_JSONL
+
+CHECKPOINT = "checkpoint.json"
+PROMPT = "prompt.yaml"
+SUMMARIES = "episode_summary.jsonl"
+# One line of resume stats per resume; kept out of metrics.json.
+RESUME_LOG = "resume.jsonl"
+
+
+def prompt_path(config: Optional[str], run_dir: Optional[str]) -> str:
+    """The prompt file a run reads: the copy saved in `run_dir` when resuming, else the one beside `config`.
+
+    Runs saved without a prompt copy resume with the one beside `config`.
+    """
+    if run_dir:
+        saved = os.path.join(run_dir, PROMPT)
+        if os.path.exists(saved):
+            return saved
+        if not config:
+            raise FileNotFoundError(f"{saved} not found; pass --config to resume with the prompt beside it")
+    return os.path.join(os.path.dirname(config), PROMPT)
+
+
+def write_checkpoint(output_dir: str, completed: List[int], rag_state: Dict) -> None:
+    """Atomically record the RAG state and the finished episodes it includes."""
+    path = os.path.join(output_dir, CHECKPOINT)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"completed": completed, "rag": rag_state}, f)
+    os.replace(path + ".tmp", path)
+
+
+def load_checkpoint(output_dir: str) -> Dict:
+    path = os.path.join(output_dir, CHECKPOINT)
+    if not os.path.exists(path):
+        return {"completed": [], "rag": None}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _records(path: str) -> Iterator[Tuple[str, Optional[Dict]]]:
+    """Every non-blank line with its record; None for a torn or unreadable line."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line) if line.endswith("\n") else None
+            except json.JSONDecodeError:
+                item = None  # torn tail
+            yield line, item
+
+
+def _filter_jsonl(path: str, keep: Set[int]) -> int:
+    """Keep whole lines of finished episodes; return how many lines were dropped."""
+    if not os.path.exists(path):
+        return 0
+    kept, dropped = [], 0
+    for line, item in _records(path):
+        if item is None or item.get("episode_id") not in keep:
+            dropped += 1
+            continue
+        kept.append(line)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.writelines(kept)
+    os.replace(path + ".tmp", path)
+    return dropped
+
+
+def _finished_summaries(output_dir: str) -> List[Dict]:
+    """Summaries of the episodes whose logs are complete, read from the run's own outputs.
+
+    `episode_summary.jsonl` gets a line once an episode's logs are written.
+    Older runs instead rewrote `episode_summary.json` after every episode and
+    did not count hallucinations in it; those summaries are completed from
+    `steps_eval.jsonl` and written out as `episode_summary.jsonl`.
+    """
+    path = os.path.join(output_dir, SUMMARIES)
+    if os.path.exists(path):
+        return [item for _, item in _records(path) if item is not None]
+    legacy = os.path.join(output_dir, "episode_summary.json")
+    if not os.path.exists(legacy):
+        return []
+    with open(legacy, "r", encoding="utf-8") as f:
+        summaries = json.load(f).get("episodes", [])
+    steps_path = os.path.join(output_dir, "steps_eval.jsonl")
+    steps: Dict[int, List[Dict]] = {}
+    if os.path.exists(steps_path):
+        for _, item in _records(steps_path):
+            if item is not None:
+                steps.setdefault(item.get("episode_id"), []).append(item)
+    for summary in summaries:
+        if "hallucinations" not in summary:
+            summary["hallucinations"] = count_hallucinations(steps.get(summary["episode_id"], []))
+    dump_jsonl(path, summaries)
+    return summaries
+
+
+def _remove_episode_outputs(output_dir: str, episode_id: int) -> None:
+    """Delete what an unfinished episode left behind; some of it is appended to, not overwritten."""
+    name = f"episode_{episode_id:03d}"
+    for path in (
+        os.path.join(output_dir, "frames", name),
+        os.path.join(output_dir, "debug", "lmk_raw", name),
+    ):
+        shutil.rmtree(path, ignore_errors=True)
+    for path in (
+        os.path.join(output_dir, "debug", f"{name}.rec"),
+        os.path.join(output_dir, "debug", f"{name}.rec.idx"),
+        os.path.join(output_dir, "videos", f"{name}.mp4"),
+    ):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def prepare_resume(output_dir: str, specs: List[Dict]) -> Tuple[Optional[Dict], List[Dict], List[Dict], Dict]:
+    """Roll `output_dir` back to its finished episodes.
+
+    An episode is finished when its summary line is on disk, so runs from
+    before checkpoints, or killed before their first one, resume too.
+    Returns (checkpointed RAG state or None, summaries of finished episodes,
+    specs still to run, resume stats). Log lines of unfinished episodes,
+    including a torn last line, are dropped from every per-run JSONL file.
+    """
+    summaries = _finished_summaries(output_dir)
+    done = {summary["episode_id"] for summary in summaries}
+    dropped = {name: _filter_jsonl(os.path.join(output_dir, name), done) for name in MERGED_JSONL}
+    pending = [spec for spec in specs if spec["episode_id"] not in done]
+    for spec in pending:
+        _remove_episode_outputs(output_dir, spec["episode_id"])
+    checkpoint = load_checkpoint(output_dir)
+    stats = {
+        "completed": len(done),
+        "pending": len(pending),
+        "dropped_lines": dropped,
+        # Finished episodes whose RAG writes the checkpoint lacks; only shared scopes read them later.
+        "rag_missing_episodes": len(done - set(checkpoint["completed"])),
+    }
+    return checkpoint["rag"], summaries, pending, stats
+
+
+def restore_rag(rag_namespaces: RagNamespaces, rag_state: Dict, pending: List[Dict]) -> None:
+    """Restore the checkpointed stores and drop files only unfinished episodes wrote to."""
+    if rag_state is not None:
+        rag_namespaces.restore(rag_state)
+    for spec in pending:
+        namespace = rag_namespaces.namespace(spec["scene"], spec["episode_id"])
+        path = rag_namespaces.path(namespace)
+        if namespace not in rag_namespaces.stores and os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,69 @@
+import json
+import os
+import shutil
+from typing import Dict, List
+
+import numpy as np
+
+from .logging import write_json
+from .step_store import COLUMNS, ColumnarStepWriter, load_columns
+
+# Per-run files every shard writes, merged line by line ordered by (episode_id, step_idx).
+MERGED_JSONL = ("episode_meta.jsonl", "steps.jsonl", "steps_eval.jsonl", "episode_summary.jsonl")
+
+
+def shard_specs(specs: List[Dict], num_shards: int) -> List[List[Dict]]:
+    """Round-robin split so every shard sees a similar mix of scenes."""
+    return [specs[k::num_shards] for k in range(num_shards)]
+
+
+def shard_dir(output_dir: str, shard: int) -> str:
+    return os.path.join(output_dir, "shards", f"shard_{shard:02d}")
+
+
+def _merge_jsonl(paths: List[str], out_path: str) -> int:
+    keyed = []
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            for order, line in enumerate(f):
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                key = (item.get("episode_id", -1), item.get("step_idx", -1), order)
+                keyed.append((key, line if line.endswith("\n") else line + "\n"))
+    keyed.sort(key=lambda x: x[0])
+    # Original line bytes are copied verbatim, so the merge is independent of shard timing.
+    with open(out_path, "w", encoding="utf-8") as f:
+        for _, line in keyed:
+            f.write(line)
+    return len(keyed)
+
+
+def _merge_step_columns(shard_dirs: List[str], out_dir: str) -> None:
+    """Rewrite every shard's step columns as one store ordered by (episode_id, step_idx)."""
+    shutil.rmtree(out_dir, ignore_errors=True)
+    writer = ColumnarStepWriter(out_dir)
+    shards = [load_columns(os.path.join(d, "step_columns")) for d in shard_dirs]
+    merged = {name: np.concatenate([cols[name] for cols in shards]) for name in COLUMNS} if shards else {}
+    if merged:
+        order = np.lexsort((merged["step_idx"], merged["episode_id"]))
+        writer.add_columns({name: column[order] for name, column in merged.items()})
+    writer.close()
+
+
+def merge_shard_outputs(output_dir: str, shard_dirs: List[str]) -> List[Dict]:
+    """Merge shard files into `output_dir`; return episode summaries sorted by id."""
+    for name in MERGED_JSONL:
+        _merge_jsonl([os.path.join(d, name) for d in shard_dirs], os.path.join(output_dir, name))
+    _merge_step_columns(shard_dirs, os.path.join(output_dir, "step_columns"))
+    episodes: List[Dict] = []
+    for d in shard_dirs:
+        path = os.path.join(d, "episode_summary.json")
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                episodes.extend(json.load(f).get("episodes", []))
+    episodes.sort(key=lambda ep: ep["episode_id"])
+    write_json(os.path.join(output_dir, "episode_summary.json"), {"episodes": episodes})
+    return episodes
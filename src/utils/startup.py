@@ -0,0 +1,129 @@
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from ..agent.action_space import ACTIONS
+from ..rag.store import EVICTION_POLICIES
+
+# iTHOR rooms: kitchens 1-30, living rooms 201-230, bedrooms 301-330, bathrooms 401-430.
+_ITHOR_SCENE = re.compile(r"^FloorPlan(\d+)(_physics)?$")
+_ITHOR_RANGES = ((1, 30), (201, 230), (301, 330), (401, 430))
+
+ACTION_DECODING = ("generate", "score", "candidates")
+PRECISIONS = ("auto", "fp32", "bf16", "fp16", "int8")
+
+
+def is_ithor_scene(name: str) -> bool:
+    match = _ITHOR_SCENE.match(str(name))
+    if not match:
+        return False
+    num = int(match.group(1))
+    return any(lo <= num <= hi for lo, hi in _ITHOR_RANGES)
+
+
+def validate_config(cfg: Dict) -> List[str]:
+    """Problems that would otherwise surface only after the model has loaded."""
+    problems = []
+    for section in ("run", "model", "agent", "rag", "headless"):
+        if not isinstance(cfg.get(section), dict):
+            problems.append(f"missing section: {section}")
+    if problems:
+        return problems
+    run, model, rag = cfg["run"], cfg["model"], cfg["rag"]
+    if int(run.get("num_episodes", 0)) <= 0:
+        problems.append("run.num_episodes must be > 0")
+    episodes_file = run.get("episodes_file")
+    if episodes_file and not os.path.exists(episodes_file):
+        problems.append(f"run.episodes_file not found: {episodes_file}")
+    if not os.path.isdir(str(model.get("local_path", ""))):
+        problems.append(f"model.local_path is not a directory: {model.get('local_path')}")
+    if model.get("action_decoding", "generate") not in ACTION_DECODING:
+        problems.append(f"model.action_decoding must be one of {ACTION_DECODING}")
+    if model.get("precision", "fp32") not in PRECISIONS:
+        problems.append(f"model.precision must be one of {PRECISIONS}")
+    elif model.get("precision") == "int8" and model.get("device") != "cpu":
+        problems.append("model.precision int8 requires model.device cpu")
+    if rag.get("backend", "index") not in ("index", "sparse"):
+        problems.append("rag.backend must be index or sparse")
+    if rag.get("scope", "global") not in ("global", "scene", "episode"):
+        problems.append("rag.scope must be global, scene or episode")
+    if rag.get("eviction", "lru") not in EVICTION_POLICIES:
+        problems.append(f"rag.eviction must be one of {EVICTION_POLICIES}")
+    elif rag.get("eviction") == "recency" and float(rag.get("recency_decay", 0.99)) <= 0:
+        problems.append("rag.recency_decay must be positive")
+    base_store = rag.get("base_store")
+    if base_store and not os.path.exists(base_store):
+        problems.append(f"rag.base_store not found: {base_store}")
+    unknown = [a for a in cfg["agent"].get("action_space", []) if a not in ACTIONS]
+    if unknown:
+        problems.append(f"agent.action_space has unknown actions: {unknown}")
+    return problems
+
+
+def validate_specs(specs: List[Dict]) -> List[str]:
+    problems = []
+    for spec in specs:
+        if not is_ithor_scene(spec["scene"]):
+            problems.append(f"episode {spec['episode_id']}: unknown scene {spec['scene']!r}")
+        if not spec.get("target"):
+            problems.append(f"episode {spec['episode_id']}: no target object")
+    return problems
+
+
+def start_concurrently(
+    jobs: Dict[str, Callable[[], Any]],
+    timings: Dict[str, float],
+    cleanup: Optional[Dict[str, Callable[[Any], None]]] = None,
+) -> Dict[str, Any]:
+    """Run each job on its own daemon thread; return results by name.
+
+    Seconds per job go into `timings[name]`. The first failure is raised as
+    soon as it happens; daemon threads let the process exit without waiting
+    for a multi-minute model load that is no longer needed. After a failure,
+    `cleanup[name](result)` releases every other job's result (e.g. closes
+    started controllers): at once for jobs already done, on completion for
+    jobs still running.
+    """
+    cleanup = cleanup or {}
+    results: Dict[str, Any] = {}
+    errors: List[BaseException] = []
+    done = threading.Condition()
+
+    def release(name: str, value: Any) -> None:
+        if name in cleanup:
+            try:
+                cleanup[name](value)
+            except Exception:
+                pass  # the job failure being raised is the error to report
+
+    def run(name: str, fn: Callable[[], Any]) -> None:
+        start = time.perf_counter()
+        try:
+            value = fn()
+        except BaseException as exc:
+            with done:
+                errors.append(exc)
+                done.notify()
+            return
+        with done:
+            failed = bool(errors)
+            if not failed:
+                results[name] = value
+                timings[name] = round(time.perf_counter() - start, 3)
+            done.notify()
+        if failed:
+            release(name, value)
+
+    for name, fn in jobs.items():
+        threading.Thread(target=run, args=(name, fn), name=f"startup_{name}", daemon=True).start()
+    with done:
+        while not errors and len(results) < len(jobs):
+            done.wait()
+        finished = dict(results)
+    if errors:
+        for name, value in finished.items():
+            release(name, value)
+        raise errors[0]
+    return results
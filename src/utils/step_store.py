@@ -0,0 +1,116 @@
+import glob
+import json
+import os
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+def _env(step: Dict, key: str):
+    return (step.get("env_meta_for_eval_only") or {}).get(key)
+
+
+def _seen(step: Dict) -> int:
+    claim = step.get("target_seen_claim")
+    return -1 if claim is None else int(bool(claim))
+
+
+def _float(value) -> float:
+    return float("nan") if value is None else float(value)
+
+
+def _dtype(name: str):
+    dtype = COLUMNS[name][0]
+    return str if dtype == "U" else dtype
+
+
+# Column name -> (NumPy dtype, getter over one annotated step record).
+COLUMNS: Dict[str, Tuple[str, Callable[[Dict], object]]] = {
+    "episode_id": ("i4", lambda s: s["episode_id"]),
+    "step_idx": ("i4", lambda s: s["step_idx"]),
+    "scene": ("U", lambda s: s.get("scene") or ""),
+    "target_object_type": ("U", lambda s: s.get("target_object_type") or ""),
+    "action": ("U", lambda s: s.get("action") or ""),
+    "source": ("U", lambda s: (s.get("vlm_output") or {}).get("source", "")),
+    "collision": ("?", lambda s: bool(s.get("collision"))),
+    "loop_break_triggered": ("?", lambda s: bool(s.get("loop_break_triggered"))),
+    "target_seen_claim": ("i1", _seen),  # -1 unknown, 0 no, 1 yes
+    "target_visible": ("?", lambda s: bool(_env(s, "target_visible"))),
+    "target_distance": ("f4", lambda s: _float(_env(s, "target_distance"))),
+    "PH_Existence": ("?", lambda s: bool((s.get("hallucinations") or {}).get("PH_Existence"))),
+    "PH_Localization": ("?", lambda s: bool((s.get("hallucinations") or {}).get("PH_Localization"))),
+    "rag_hits": ("i2", lambda s: len(s.get("rag_hit_ids") or [])),
+    "planner_input_tokens": ("i4", lambda s: s.get("planner_input_token_estimate") or 0),
+    "step_s": ("f4", lambda s: sum((s.get("timings") or {}).values())),
+}
+
+
+class ColumnarStepWriter:
+    """Buffers step records as columns and writes one `.npz` per `chunk_rows` rows.
+
+    Each chunk holds one array per `COLUMNS` entry; `schema.json` lists the
+    columns and dtypes. Text fields (raw VLM output, prompts) stay in
+    steps.jsonl / the debug archive. Only the current chunk is held in memory.
+    """
+
+    def __init__(self, out_dir: str, chunk_rows: int = 4096, prefix: str = "chunk") -> None:
+        self.out_dir = out_dir
+        self.chunk_rows = chunk_rows
+        self.prefix = prefix
+        self.rows = 0
+        self.chunks = 0
+        self._buffer: Dict[str, List] = {name: [] for name in COLUMNS}
+        os.makedirs(out_dir, exist_ok=True)
+        schema = {name: dtype for name, (dtype, _) in COLUMNS.items()}
+        with open(os.path.join(out_dir, "schema.json"), "w", encoding="utf-8") as f:
+            json.dump(schema, f, indent=2)
+
+    def add(self, steps: Iterable[Dict]) -> None:
+        for step in steps:
+            for name, (_, getter) in COLUMNS.items():
+                self._buffer[name].append(getter(step))
+            self.rows += 1
+            if len(self._buffer["episode_id"]) >= self.chunk_rows:
+                self.flush()
+
+    def add_columns(self, arrays: Dict[str, np.ndarray]) -> None:
+        """Append rows that are already columns (e.g. from `load_columns`), `chunk_rows` per chunk."""
+        self.flush()
+        total = len(arrays["episode_id"])
+        for start in range(0, total, self.chunk_rows):
+            self._write({name: arrays[name][start : start + self.chunk_rows] for name in COLUMNS})
+        self.rows += total
+
+    def flush(self) -> None:
+        if not self._buffer["episode_id"]:
+            return
+        arrays = {}
+        for name in COLUMNS:
+            arrays[name] = np.array(self._buffer[name], dtype=_dtype(name))
+            self._buffer[name] = []
+        self._write(arrays)
+
+    def _write(self, arrays: Dict[str, np.ndarray]) -> None:
+        path = os.path.join(self.out_dir, f"{self.prefix}_{self.chunks:05d}.npz")
+        np.savez_compressed(path, **arrays)
+        self.chunks += 1
+
+    def close(self) -> Dict:
+        self.flush()
+        return {"rows": self.rows, "chunks": self.chunks}
+
+
+def load_columns(store_dir: str, columns: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+    """Concatenate `columns` (default: all) across chunks; other members are not decompressed."""
+    paths = sorted(glob.glob(os.path.join(store_dir, "*.npz")))
+    if columns is None:
+        columns = list(COLUMNS)
+    parts: Dict[str, List[np.ndarray]] = {name: [] for name in columns}
+    for path in paths:
+        with np.load(path) as chunk:
+            for name in columns:
+                parts[name].append(chunk[name])
+    return {
+        name: np.concatenate(arrays) if arrays else np.array([], dtype=_dtype(name))
+        for name, arrays in parts.items()
+    }
@@ -0,0 +1,78 @@
+import copy
+import itertools
+import json
+from typing import Any, Dict, List, Tuple
+
+import yaml
+
+# Variants share one loaded model, one set of controllers and one episode list,
+# so only keys read per episode can vary.
+SWEEPABLE_SECTIONS = ("agent", "rag", "logging")
+SWEEPABLE_KEYS = ("run.max_steps", "run.success_distance")
+# Batched action scoring offers every env the same action list.
+FIXED_KEYS = ("agent.action_space",)
+TABLE_COLUMNS = ("episodes", "success_rate", "spl", "avg_steps", "PH_Existence", "PH_Localization", "overconfident_stop")
+
+
+def load_sweep(path: str) -> Dict[str, List[Any]]:
+    """Read a sweep spec: `grid:` maps dotted config keys to lists of values."""
+    with open(path, "r", encoding="utf-8") as f:
+        spec = yaml.safe_load(f) or {}
+    grid = spec.get("grid")
+    if not isinstance(grid, dict) or not grid:
+        raise ValueError(f"{path}: expected a non-empty `grid` mapping")
+    for key, values in grid.items():
+        sweepable = key.split(".", 1)[0] in SWEEPABLE_SECTIONS or key in SWEEPABLE_KEYS
+        if not sweepable or key in FIXED_KEYS:
+            raise ValueError(f"{path}: {key} cannot vary within one sweep")
+        if not isinstance(values, list) or not values:
+            raise ValueError(f"{path}: {key} needs a non-empty list of values")
+    return grid
+
+
+def set_key(cfg: Dict, dotted: str, value: Any) -> None:
+    *parents, leaf = dotted.split(".")
+    node = cfg
+    for part in parents:
+        if not isinstance(node.get(part), dict):
+            raise KeyError(f"config has no section {dotted.rsplit('.', 1)[0]}")
+        node = node[part]
+    node[leaf] = value
+
+
+def variant_label(overrides: Dict[str, Any]) -> str:
+    return " ".join(f"{key}={json.dumps(value, separators=(',', ':'))}" for key, value in overrides.items())
+
+
+def expand_grid(cfg: Dict, grid: Dict[str, List[Any]]) -> List[Tuple[Dict[str, Any], Dict]]:
+    """Every combination of grid values as (overrides, full config), in grid order."""
+    keys = list(grid)
+    variants = []
+    for values in itertools.product(*(grid[key] for key in keys)):
+        overrides = dict(zip(keys, values))
+        variant_cfg = copy.deepcopy(cfg)
+        for key, value in overrides.items():
+            set_key(variant_cfg, key, copy.deepcopy(value))
+        variants.append((overrides, variant_cfg))
+    return variants
+
+
+def format_table(rows: List[Dict]) -> str:
+    """Markdown comparison table; each row has `variant`, `label` and a `metrics.json` payload."""
+    header = ["variant", *TABLE_COLUMNS, "overrides"]
+    lines = ["| " + " | ".join(header) + " |", "|" + "---|" * len(header)]
+    for row in rows:
+        nav, halluc = row["metrics"]["nav"], row["metrics"]["hallucinations"]
+        cells = [
+            row["variant"],
+            str(row["episodes"]),
+            f"{nav['success_rate']:.3f}",
+            f"{nav['spl']:.3f}",
+            f"{nav['avg_steps']:.1f}",
+            str(halluc["PH_Existence"]),
+            str(halluc["PH_Localization"]),
+            str(halluc["overconfident_stop"]),
+            row["label"],
+        ]
+        lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines) + "\n"
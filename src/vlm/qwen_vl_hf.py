@@ -1,21 +1,66 @@
+import copy
 import re
-from typing import Dict, List, Tuple
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
 
 import numpy as np
-from PIL import Image
-from transformers import AutoModelForVision2Seq, AutoProcessor
+import torch
+from transformers import AutoModelForVision2Seq, AutoProcessor, LogitsProcessorList
+
+
+VISION_START = "<|vision_start|>"
+IMAGE_PAD = "<|image_pad|>"
+ACTION_PREFIX = "ACTION="
+# Frames whose pixel tensors stay cached; a vector runner tick touches one per env.
+PIXEL_CACHE_SIZE = 16
+# model.precision values. fp32 is the default (what the baseline ran at); "auto" keeps the checkpoint's stored dtype.
+PRECISIONS = {"auto": "auto", "fp32": torch.float32, "bf16": torch.bfloat16, "fp16": torch.float16, "int8": torch.float32}
+
+
+class _StepClock:
+    """Logits processor that only records when each decoding step runs."""
+
+    def __init__(self) -> None:
+        self.stamps: List[float] = []
+
+    def __call__(self, input_ids, scores):
+        self.stamps.append(time.perf_counter())
+        return scores
 
 
 class QwenVLHF:
-    def __init__(self, model_path: str, device: str = "cuda") -> None:
+    def __init__(
+        self,
+        model_path: str,
+        device: str = "cuda",
+        prefix_cache_size: int = 0,
+        precision: str = "fp32",
+        num_threads: Optional[int] = None,
+    ) -> None:
+        if precision not in PRECISIONS:
+            raise ValueError(f"precision must be one of {sorted(PRECISIONS)}")
+        if precision == "int8" and device != "cpu":
+            raise ValueError("int8 is dynamic quantization and only runs on cpu")
+        if num_threads:
+            torch.set_num_threads(int(num_threads))
         self.model_path = model_path
         self.device = device
+        self.precision = precision
+        # Prefill KV caches of static text prefixes, keyed by templated prefix text (LRU).
+        self.prefix_cache_size = prefix_cache_size
+        self._prefix_cache: "OrderedDict[str, Tuple[object, int]]" = OrderedDict()
+        self.prefix_cache_stats = {"hits": 0, "misses": 0, "bypassed": 0}
+        self._pixel_cache: "OrderedDict[int, Tuple[np.ndarray, Dict]]" = OrderedDict()
+        self.preprocess_stats = {"hits": 0, "misses": 0, "seconds": 0.0}
         self.processor = AutoProcessor.from_pretrained(
             model_path, trust_remote_code=True, local_files_only=True
         )
+        # Batched generation needs left padding so every row ends at its prompt.
+        self.processor.tokenizer.padding_side = "left"
         self.model = AutoModelForVision2Seq.from_pretrained(
             model_path,
-            torch_dtype=None,
+            torch_dtype=PRECISIONS[precision],
             device_map="auto" if device.startswith("cuda") else None,
             trust_remote_code=True,
             local_files_only=True,
@@ -23,53 +68,449 @@ class QwenVLHF:
         if device == "cpu":
             self.model.to("cpu")
         self.model.eval()
+        if precision == "int8":
+            # Linear weights become int8; activations are quantized per call.
+            self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
 
-    def generate(self, frame: np.ndarray, prompt: str, max_new_tokens: int = 256) -> str:
-        image = Image.fromarray(frame)
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "image", "image": image},
-                    {"type": "text", "text": prompt},
-                ],
-            }
+    def _chat_text(self, prompt: str, prefix: Optional[str] = None) -> str:
+        content = [
+            {"type": "image"},
+            {"type": "text", "text": prompt},
         ]
-        text = self.processor.apply_chat_template(messages, add_generation_prompt=True)
-        inputs = self.processor(text=[text], images=[image], return_tensors="pt")
+        if prefix:
+            # Static text goes before the image so its tokens are identical across steps.
+            content.insert(0, {"type": "text", "text": prefix})
+        messages = [{"role": "user", "content": content}]
+        return self.processor.apply_chat_template(messages, add_generation_prompt=True)
+
+    def preprocess(self, frame: np.ndarray) -> Dict:
+        """Pixel tensor and grid for `frame`, computed once per frame object.
+
+        The landmark and planner calls of a step share the same `event.frame`,
+        so the image processor runs on the NumPy array directly, without PIL,
+        once per step. Entries keep their frame alive, so an identity match
+        cannot be a recycled `id`. On cuda the tensor is copied from pinned
+        memory without blocking.
+        """
+        key = id(frame)
+        entry = self._pixel_cache.get(key)
+        if entry is not None and entry[0] is frame:
+            self.preprocess_stats["hits"] += 1
+            return entry[1]
+        start = time.perf_counter()
+        out = self.processor.image_processor(images=[np.ascontiguousarray(frame)], return_tensors="pt")
+        pixel_values = out["pixel_values"].contiguous()
+        grid = out["image_grid_thw"]
+        if self.device.startswith("cuda"):
+            pixel_values = pixel_values.pin_memory().to("cuda", non_blocking=True)
+        pixels = {"pixel_values": pixel_values, "image_grid_thw": grid}
+        self._pixel_cache[key] = (frame, pixels)
+        while len(self._pixel_cache) > PIXEL_CACHE_SIZE:
+            self._pixel_cache.popitem(last=False)
+        self.preprocess_stats["misses"] += 1
+        self.preprocess_stats["seconds"] += time.perf_counter() - start
+        return pixels
+
+    def _prepare(self, frames: List[np.ndarray], texts: List[str]) -> Dict:
+        """Tokenize `texts` (one image each) around the cached pixels of `frames`."""
+        pixels = [self.preprocess(frame) for frame in frames]
+        merge = self.processor.image_processor.merge_size ** 2
+        expanded = [
+            text.replace(IMAGE_PAD, IMAGE_PAD * (int(p["image_grid_thw"].prod()) // merge), 1)
+            for text, p in zip(texts, pixels)
+        ]
+        inputs = dict(self.processor.tokenizer(expanded, padding=len(texts) > 1, return_tensors="pt"))
         if self.device.startswith("cuda"):
             inputs = {k: v.to("cuda") for k, v in inputs.items()}
-        outputs = self.model.generate(**inputs, max_new_tokens=max_new_tokens)
+        inputs["pixel_values"] = torch.cat([p["pixel_values"] for p in pixels])
+        inputs["image_grid_thw"] = torch.cat([p["image_grid_thw"] for p in pixels]).to(inputs["input_ids"].device)
+        return inputs
+
+    def _rope_index(self, inputs: Dict):
+        owner = self.model if hasattr(self.model, "get_rope_index") else self.model.model
+        return owner.get_rope_index(
+            input_ids=inputs["input_ids"],
+            image_grid_thw=inputs.get("image_grid_thw"),
+            attention_mask=inputs.get("attention_mask"),
+        )
+
+    def _set_rope_deltas(self, rope_deltas) -> None:
+        for owner in (self.model, getattr(self.model, "model", None)):
+            if owner is not None and hasattr(owner, "rope_deltas"):
+                owner.rope_deltas = rope_deltas
+
+    def _prefill(self, inputs: Dict, length: int, **kwargs):
+        """Forward the first `length` tokens of every row, image included, into a new KV cache.
+
+        Returns the model output and the rows' M-RoPE deltas, which place any
+        token after the prompt at `cache_position + delta`.
+        """
+        ids = inputs["input_ids"]
+        position_ids, rope_deltas = self._rope_index(inputs)
+        out = self.model(
+            input_ids=ids[:, :length],
+            pixel_values=inputs["pixel_values"],
+            image_grid_thw=inputs["image_grid_thw"],
+            attention_mask=inputs["attention_mask"][:, :length],
+            position_ids=position_ids[..., :length],
+            cache_position=torch.arange(length, device=ids.device),
+            use_cache=True,
+            **kwargs,
+        )
+        return out, rope_deltas
+
+    def _prefix_cached_generate(self, inputs: Dict, text: str, max_new_tokens: int):
+        """`generate` that skips prefilling the text before the image when cached.
+
+        The prefix cache is copied, the image and dynamic suffix (all but the
+        last prompt token) are prefilled with explicit M-RoPE positions, and
+        `generate` finishes from there with the usual decoding settings. HF
+        drops `pixel_values` once the cache is non-empty, which is why the
+        image has to go through this manual prefill. Returns None when the
+        prompt has no cacheable prefix.
+        """
+        cut = text.find(VISION_START)
+        ids = inputs["input_ids"]
+        length = ids.shape[1]
+        if cut <= 0 or ids.shape[0] != 1:
+            self.prefix_cache_stats["bypassed"] += 1
+            return None
+        prefix_text = text[:cut]
+        position_ids, rope_deltas = self._rope_index(inputs)
+        entry = self._prefix_cache.get(prefix_text)
+        with torch.inference_mode():
+            if entry is None:
+                prefix_ids = self.processor.tokenizer(
+                    prefix_text, add_special_tokens=False, return_tensors="pt"
+                )["input_ids"].to(ids.device)
+                plen = prefix_ids.shape[1]
+                if plen >= length - 1 or not torch.equal(ids[0, :plen], prefix_ids[0]):
+                    self.prefix_cache_stats["bypassed"] += 1
+                    return None
+                out = self.model(
+                    input_ids=ids[:, :plen],
+                    attention_mask=inputs["attention_mask"][:, :plen],
+                    position_ids=position_ids[..., :plen],
+                    cache_position=torch.arange(plen, device=ids.device),
+                    use_cache=True,
+                )
+                entry = (out.past_key_values, plen)
+                self._prefix_cache[prefix_text] = entry
+                while len(self._prefix_cache) > self.prefix_cache_size:
+                    self._prefix_cache.popitem(last=False)
+                self.prefix_cache_stats["misses"] += 1
+            else:
+                self._prefix_cache.move_to_end(prefix_text)
+                self.prefix_cache_stats["hits"] += 1
+            cache = copy.deepcopy(entry[0])
+            plen = entry[1]
+            self.model(
+                input_ids=ids[:, plen : length - 1],
+                pixel_values=inputs["pixel_values"],
+                image_grid_thw=inputs["image_grid_thw"],
+                attention_mask=inputs["attention_mask"][:, : length - 1],
+                past_key_values=cache,
+                position_ids=position_ids[..., plen : length - 1],
+                cache_position=torch.arange(plen, length - 1, device=ids.device),
+                use_cache=True,
+            )
+        self._set_rope_deltas(rope_deltas)
+        return self.model.generate(**inputs, past_key_values=cache, max_new_tokens=max_new_tokens)
+
+    def _generate_ids(self, inputs: Dict, text: str, max_new_tokens: int, prefix: Optional[str]):
+        if prefix and self.prefix_cache_size > 0:
+            outputs = self._prefix_cached_generate(inputs, text, max_new_tokens)
+            if outputs is not None:
+                return outputs
+        return self.model.generate(**inputs, max_new_tokens=max_new_tokens)
+
+    def generate(
+        self, frame: np.ndarray, prompt: str, max_new_tokens: int = 256, prefix: Optional[str] = None
+    ) -> str:
+        text = self._chat_text(prompt, prefix)
+        inputs = self._prepare([frame], [text])
+        outputs = self._generate_ids(inputs, text, max_new_tokens, prefix)
         decoded = self.processor.batch_decode(outputs, skip_special_tokens=True)[0]
         return self._extract_assistant(decoded)
 
     def generate_with_debug(
-        self, frame: np.ndarray, prompt: str, max_new_tokens: int = 256
+        self, frame: np.ndarray, prompt: str, max_new_tokens: int = 256, prefix: Optional[str] = None
     ) -> Tuple[str, Dict]:
-        image = Image.fromarray(frame)
+        text = self._chat_text(prompt, prefix)
+        inputs = self._prepare([frame], [text])
+        outputs = self._generate_ids(inputs, text, max_new_tokens, prefix)
+        decoded = self.processor.batch_decode(outputs, skip_special_tokens=True)[0]
+        assistant_text = self._extract_assistant(decoded)
+        debug = {
+            "full_text": decoded,
+            "input_text_preview": text[:400],
+            "image_size": (frame.shape[1], frame.shape[0]),
+            "image_mode": "RGB",
+        }
+        return assistant_text, debug
+
+    def generate_batch(
+        self,
+        frames: List[np.ndarray],
+        prompts: List[str],
+        max_new_tokens: int = 256,
+        prefix: Optional[str] = None,
+    ) -> List[Tuple[str, Dict]]:
+        """Run N (frame, prompt) requests through one left-padded `generate` call.
+
+        Returns one `(assistant_text, debug)` pair per request, in input order,
+        shaped like `generate_with_debug`.
+        """
+        if len(frames) != len(prompts):
+            raise ValueError("frames and prompts must have the same length")
+        if not frames:
+            return []
+        texts = [self._chat_text(prompt, prefix) for prompt in prompts]
+        inputs = self._prepare(frames, texts)
+        outputs = self.model.generate(**inputs, max_new_tokens=max_new_tokens)
+        decoded = self.processor.batch_decode(outputs, skip_special_tokens=True)
+        results = []
+        for frame, text, full_text in zip(frames, texts, decoded):
+            debug = {
+                "full_text": full_text,
+                "input_text_preview": text[:400],
+                "image_size": (frame.shape[1], frame.shape[0]),
+                "image_mode": "RGB",
+                "batch_size": len(frames),
+            }
+            results.append((self._extract_assistant(full_text), debug))
+        return results
+
+    def score_actions(
+        self, frame: np.ndarray, prompt: str, actions: List[str], prefix: Optional[str] = None
+    ) -> Tuple[List[Dict], Dict]:
+        return self.score_actions_batch([frame], [prompt], actions, prefix=prefix)[0]
+
+    def score_actions_batch(
+        self,
+        frames: List[np.ndarray],
+        prompts: List[str],
+        actions: List[str],
+        prefix: Optional[str] = None,
+    ) -> List[Tuple[List[Dict], Dict]]:
+        """Rank `ACTION=<name>` answers by log-likelihood instead of decoding.
+
+        Each request's image and prompt are prefilled once; the KV cache is
+        then repeated per action and one forward pass over the right-padded
+        `ACTION=<name>` tokens scores every continuation. Per request returns
+        candidates `{"action", "logprob", "confidence"}` (confidence = softmax
+        over the actions' summed log-probs, best first) and a debug dict
+        shaped like `generate_with_debug`'s.
+        """
+        if len(frames) != len(prompts):
+            raise ValueError("frames and prompts must have the same length")
+        if not frames or not actions:
+            return [([], {}) for _ in frames]
+        texts = [self._chat_text(prompt, prefix) for prompt in prompts]
+        inputs = self._prepare(frames, texts)
+        tokenizer = self.processor.tokenizer
+        conts = [tokenizer(ACTION_PREFIX + name, add_special_tokens=False)["input_ids"] for name in actions]
+        width = max(len(ids) for ids in conts)
+        pad = tokenizer.pad_token_id or 0
+        device = inputs["input_ids"].device
+        length = inputs["input_ids"].shape[1]
+        # Row i * len(actions) + j scores action j for request i.
+        cont_ids = torch.tensor([ids + [pad] * (width - len(ids)) for ids in conts], device=device).repeat(len(frames), 1)
+        cont_mask = torch.tensor(
+            [[1] * len(ids) + [0] * (width - len(ids)) for ids in conts], device=device
+        ).repeat(len(frames), 1)
+        with torch.inference_mode():
+            prefill, rope_deltas = self._prefill(inputs, length, logits_to_keep=1)
+            cache = prefill.past_key_values
+            cache.batch_repeat_interleave(len(actions))
+            cache_position = torch.arange(length, length + width, device=device)
+            position_ids = cache_position + rope_deltas.repeat_interleave(len(actions), dim=0)
+            out = self.model(
+                input_ids=cont_ids,
+                attention_mask=torch.cat(
+                    [inputs["attention_mask"].repeat_interleave(len(actions), dim=0), cont_mask], dim=1
+                ),
+                past_key_values=cache,
+                position_ids=position_ids.unsqueeze(0).expand(3, -1, -1),
+                cache_position=cache_position,
+                use_cache=True,
+            )
+            # The prompt's last logit predicts continuation token 0; continuation logit k predicts token k + 1.
+            first = prefill.logits[:, -1:].float().repeat_interleave(len(actions), dim=0)
+            logits = torch.cat([first, out.logits[:, :-1].float()], dim=1)
+            token_lp = torch.log_softmax(logits, dim=-1).gather(-1, cont_ids.unsqueeze(-1)).squeeze(-1)
+            sums = token_lp.masked_fill(cont_mask == 0, 0.0).sum(dim=1).view(len(frames), len(actions))
+            probs = torch.softmax(sums, dim=-1)
+        results = []
+        for i, (frame, text) in enumerate(zip(frames, texts)):
+            candidates = [
+                {"action": name, "logprob": float(sums[i, j]), "confidence": float(probs[i, j])}
+                for j, name in enumerate(actions)
+            ]
+            candidates.sort(key=lambda c: c["confidence"], reverse=True)
+            debug = {
+                "full_text": ACTION_PREFIX + candidates[0]["action"],
+                "input_text_preview": text[:400],
+                "image_size": (frame.shape[1], frame.shape[0]),
+                "image_mode": "RGB",
+                "batch_size": len(frames),
+                "scored_rows": len(frames) * len(actions),
+            }
+            results.append((candidates, debug))
+        return results
+
+    def generate_candidates(
+        self,
+        frame: np.ndarray,
+        prompt: str,
+        n: int,
+        max_new_tokens: int = 256,
+        prefix: Optional[str] = None,
+    ) -> Tuple[List[Dict], Dict]:
+        return self.generate_candidates_batch([frame], [prompt], n, max_new_tokens, prefix=prefix)[0]
+
+    def generate_candidates_batch(
+        self,
+        frames: List[np.ndarray],
+        prompts: List[str],
+        n: int,
+        max_new_tokens: int = 256,
+        prefix: Optional[str] = None,
+    ) -> List[Tuple[List[Dict], Dict]]:
+        """Sample `n` answers per request from one `generate` call.
+
+        `num_return_sequences` would repeat every row `n` times before the
+        prefill, encoding the image and prompt `n` times. Instead each
+        request's prompt (all but its last token) is prefilled once, the KV
+        cache is repeated per sample, and sampling starts from there. Each
+        candidate is `{"text", "logprob", "confidence", "tokens", "latency_s"}`:
+        `logprob` sums the sampled tokens' normalized log-probs, `confidence`
+        is its softmax over the request's samples, and `latency_s` is when the
+        sample's last token was produced, measured from the start of the call.
+        """
+        if len(frames) != len(prompts):
+            raise ValueError("frames and prompts must have the same length")
+        if not frames:
+            return []
+        texts = [self._chat_text(prompt, prefix) for prompt in prompts]
+        inputs = self._prepare(frames, texts)
+        clock = _StepClock()
+        start = time.perf_counter()
+        with torch.inference_mode():
+            prefill, rope_deltas = self._prefill(inputs, inputs["input_ids"].shape[1] - 1, logits_to_keep=1)
+        cache = prefill.past_key_values
+        cache.batch_repeat_interleave(n)
+        self._set_rope_deltas(rope_deltas.repeat_interleave(n, dim=0))
+        out = self.model.generate(
+            input_ids=inputs["input_ids"].repeat_interleave(n, dim=0),
+            attention_mask=inputs["attention_mask"].repeat_interleave(n, dim=0),
+            past_key_values=cache,
+            max_new_tokens=max_new_tokens,
+            do_sample=True,
+            output_scores=True,
+            return_dict_in_generate=True,
+            logits_processor=LogitsProcessorList([clock]),
+        )
+        total = time.perf_counter() - start
+        prompt_len = inputs["input_ids"].shape[1]
+        generated = out.sequences[:, prompt_len:]
+        token_lp = self.model.compute_transition_scores(out.sequences, out.scores, normalize_logits=True)
+        eos = self.model.generation_config.eos_token_id
+        eos_ids = set(eos if isinstance(eos, (list, tuple)) else [eos])
+        texts_out = self.processor.batch_decode(generated, skip_special_tokens=True)
+        results = []
+        for i, (frame, text) in enumerate(zip(frames, texts)):
+            candidates = []
+            for row in range(i * n, (i + 1) * n):
+                ids = generated[row].tolist()
+                length = next((k + 1 for k, tok in enumerate(ids) if tok in eos_ids), len(ids))
+                stamp = clock.stamps[length - 1] if length - 1 < len(clock.stamps) else time.perf_counter()
+                candidates.append(
+                    {
+                        "text": texts_out[row].strip(),
+                        "logprob": float(token_lp[row, :length].sum()),
+                        "tokens": length,
+                        "latency_s": round(min(stamp - start, total), 6),
+                    }
+                )
+            weights = torch.softmax(torch.tensor([c["logprob"] for c in candidates]), dim=0)
+            for cand, weight in zip(candidates, weights.tolist()):
+                cand["confidence"] = weight
+            debug = {
+                "full_text": candidates[0]["text"],
+                "input_text_preview": text[:400],
+                "image_size": (frame.shape[1], frame.shape[0]),
+                "image_mode": "RGB",
+                "batch_size": len(frames),
+                "n_candidates": n,
+                "latency_s": round(total, 6),
+            }
+            results.append((candidates, debug))
+        return results
+
+    def generate_chained(
+        self,
+        frame: np.ndarray,
+        first_prompt: str,
+        make_followup: Callable[[str], Optional[str]],
+        first_max_new_tokens: int = 32,
+        max_new_tokens: int = 256,
+    ) -> Tuple[Tuple[str, Dict], Optional[Tuple[str, Dict]]]:
+        """Two-turn chat on one frame that reuses the first turn's KV cache.
+
+        `make_followup(first_answer)` builds the second user turn (or returns
+        None to stop). The second `generate` call gets the first call's cache
+        cropped to the longest token prefix shared with the re-templated
+        conversation, so the image and first prompt are not encoded or
+        prefilled again; only the new turn's tokens are.
+        """
+        first_text = self._chat_text(first_prompt)
+        inputs = self._prepare([frame], [first_text])
+        first_out = self.model.generate(
+            **inputs, max_new_tokens=first_max_new_tokens, return_dict_in_generate=True
+        )
+        first_decoded = self.processor.batch_decode(first_out.sequences, skip_special_tokens=True)[0]
+        first_answer = self._extract_assistant(first_decoded)
+        first_debug = {"full_text": first_decoded, "input_text_preview": first_text[:400]}
+        followup = make_followup(first_answer)
+        if followup is None:
+            return (first_answer, first_debug), None
+
         messages = [
             {
                 "role": "user",
                 "content": [
-                    {"type": "image", "image": image},
-                    {"type": "text", "text": prompt},
+                    {"type": "image"},
+                    {"type": "text", "text": first_prompt},
                 ],
-            }
+            },
+            {"role": "assistant", "content": [{"type": "text", "text": first_answer}]},
+            {"role": "user", "content": [{"type": "text", "text": followup}]},
         ]
         text = self.processor.apply_chat_template(messages, add_generation_prompt=True)
-        inputs = self.processor(text=[text], images=[image], return_tensors="pt")
-        if self.device.startswith("cuda"):
-            inputs = {k: v.to("cuda") for k, v in inputs.items()}
-        outputs = self.model.generate(**inputs, max_new_tokens=max_new_tokens)
+        inputs = self._prepare([frame], [text])
+        cache = first_out.past_key_values
+        new_ids = inputs["input_ids"][0]
+        old_ids = first_out.sequences[0]
+        # The cache holds every token of the first call except the last generated one.
+        limit = min(len(old_ids) - 1, len(new_ids) - 1)
+        mismatch = (old_ids[:limit] != new_ids[:limit]).nonzero()
+        reused = int(mismatch[0]) if len(mismatch) else limit
+        gen_kwargs = {}
+        if cache is not None and reused > 0:
+            cache.crop(reused)
+            gen_kwargs["past_key_values"] = cache
+        outputs = self.model.generate(**inputs, max_new_tokens=max_new_tokens, **gen_kwargs)
         decoded = self.processor.batch_decode(outputs, skip_special_tokens=True)[0]
-        assistant_text = self._extract_assistant(decoded)
         debug = {
             "full_text": decoded,
             "input_text_preview": text[:400],
-            "image_size": image.size,
-            "image_mode": image.mode,
+            "image_size": (frame.shape[1], frame.shape[0]),
+            "image_mode": "RGB",
+            "kv_reused_tokens": reused if gen_kwargs else 0,
+            "input_tokens": len(new_ids),
         }
-        return assistant_text, debug
+        return (first_answer, first_debug), (self._extract_assistant(decoded), debug)
 
     @staticmethod
     def _extract_assistant(text: str) -> str:
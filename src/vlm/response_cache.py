@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Load options of the wrapped model that change its answers; part of every key.
+LOAD_PARAMS = ("precision", "device")
+
+
+def response_key(method: str, model_path: str, frame: np.ndarray, prompt: str, **params) -> str:
+    """sha256 over the frame bytes, prompt, model and every generation parameter."""
+    h = hashlib.sha256()
+    header = {"method": method, "model": model_path, "shape": frame.shape, "dtype": str(frame.dtype)}
+    header.update(params)
+    h.update(json.dumps(header, sort_keys=True, default=str).encode("utf-8"))
+    h.update(b"\x00")
+    h.update(prompt.encode("utf-8"))
+    h.update(b"\x00")
+    h.update(np.ascontiguousarray(frame).tobytes())
+    return h.hexdigest()
+
+
+class ResponseCache:
+    """On-disk store of VLM answers, one JSON file per key, bounded by total bytes.
+
+    Files live in `<dir>/<key[:2]>/<key>.json` and are written via a temp file
+    plus `os.replace`, so shard processes can share one directory. A hit
+    touches the file's mtime; when the total size exceeds `max_bytes` the
+    least recently used files are deleted.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evicted = 0
+        self._sizes: Dict[str, int] = {}
+        self._mtimes: Dict[str, float] = {}
+        os.makedirs(cache_dir, exist_ok=True)
+        for root, _, files in os.walk(cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                st = os.stat(os.path.join(root, name))
+                key = name[: -len(".json")]
+                self._sizes[key] = st.st_size
+                self._mtimes[key] = st.st_mtime
+        self.total_bytes = sum(self._sizes.values())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[object]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+            os.utime(path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+        self._mtimes[key] = os.path.getmtime(path)
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: object) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(value, f)
+        os.replace(tmp, path)
+        size = os.path.getsize(path)
+        self.total_bytes += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+        self._mtimes[key] = os.path.getmtime(path)
+        self.writes += 1
+        self._evict(keep=key)
+
+    def _evict(self, keep: str) -> None:
+        if self.total_bytes <= self.max_bytes:
+            return
+        for key in sorted(self._mtimes, key=self._mtimes.get):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= self._sizes.pop(key, 0)
+            del self._mtimes[key]
+            self.evicted += 1
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "writes": self.writes,
+            "evicted": self.evicted,
+            "entries": len(self._sizes),
+            "bytes": self.total_bytes,
+        }
+
+
+class CachedVLM:
+    """`QwenVLHF` front end that answers repeated (frame, prompt) calls from a `ResponseCache`.
+
+    Deterministic calls (`generate`, `generate_with_debug`, `generate_batch`,
+    `score_actions`, `score_actions_batch`) are cached; batches forward only
+    their misses. Sampling (`generate_candidates*`) and `generate_chained`,
+    whose second prompt depends on retrieval in between, pass through, as does
+    every other attribute. Keys include the model's `LOAD_PARAMS`, so an fp32
+    run never replays bf16 answers. `preprocess` is deferred: the wrapped
+    model prepares the frame itself when a call misses, so a fully cached
+    replay never runs the image processor.
+    """
+
+    def __init__(self, model, cache: ResponseCache, model_path: str) -> None:
+        self.model = model
+        self.cache = cache
+        self.model_path = model_path
+        self.load_params = {name: getattr(model, name, None) for name in LOAD_PARAMS}
+
+    def __getattr__(self, name: str):
+        return getattr(self.model, name)
+
+    def preprocess(self, frame: np.ndarray) -> None:
+        return None
+
+    def _cached_batch(self, method: str, frames: List[np.ndarray], prompts: List[str], compute, **params) -> List:
+        params.update(self.load_params)
+        keys = [response_key(method, self.model_path, f, p, **params) for f, p in zip(frames, prompts)]
+        results = [self.cache.get(key) for key in keys]
+        missing = [i for i, value in enumerate(results) if value is None]
+        if missing:
+            fresh = compute([frames[i] for i in missing], [prompts[i] for i in missing])
+            for i, value in zip(missing, fresh):
+                value = list(value) if isinstance(value, tuple) else value
+                self.cache.put(keys[i], value)
+                results[i] = value
+        return [tuple(value) if isinstance(value, list) else value for value in results]
+
+    def generate(self, frame: np.ndarray, prompt: str, max_new_tokens: int = 256, prefix: Optional[str] = None) -> str:
+        return self.generate_with_debug(frame, prompt, max_new_tokens, prefix=prefix)[0]
+
+    def generate_with_debug(
+        self, frame: np.ndarray, prompt: str, max_new_tokens: int = 256, prefix: Optional[str] = None
+    ) -> Tuple[str, Dict]:
+        return self._cached_batch(
+            "generate",
+            [frame],
+            [prompt],
+            lambda fs, ps: [self.model.generate_with_debug(fs[0], ps[0], max_new_tokens, prefix=prefix)],
+            max_new_tokens=max_new_tokens,
+            prefix=prefix,
+        )[0]
+
+    def generate_batch(
+        self,
+        frames: List[np.ndarray],
+        prompts: List[str],
+        max_new_tokens: int = 256,
+        prefix: Optional[str] = None,
+    ) -> List[Tuple[str, Dict]]:
+        return self._cached_batch(
+            "generate",
+            frames,
+            prompts,
+            lambda fs, ps: self.model.generate_batch(fs, ps, max_new_tokens=max_new_tokens, prefix=prefix),
+            max_new_tokens=max_new_tokens,
+            prefix=prefix,
+        )
+
+    def score_actions(
+        self, frame: np.ndarray, prompt: str, actions: List[str], prefix: Optional[str] = None
+    ) -> Tuple[List[Dict], Dict]:
+        return self.score_actions_batch([frame], [prompt], actions, prefix=prefix)[0]
+
+    def score_actions_batch(
+        self,
+        frames: List[np.ndarray],
+        prompts: List[str],
+        actions: List[str],
+        prefix: Optional[str] = None,
+    ) -> List[Tuple[List[Dict], Dict]]:
+        return self._cached_batch(
+            "score_actions",
+            frames,
+            prompts,
+            lambda fs, ps: self.model.score_actions_batch(fs, ps, actions, prefix=prefix),
+            actions=list(actions),
+            prefix=prefix,
+        )